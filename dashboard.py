@@ -11,6 +11,7 @@ import asyncio
 import json
 import os
 import socket
+import time
 import webbrowser
 
 # pypiライブラリ
@@ -25,11 +26,18 @@ from pystray import Icon, MenuItem, Menu
 from fastapi import WebSocket
 
 # 自作モジュール
-from src.clipboard_manager import input_handler
-from src.clipboard_manager import VirtualClipboardManager
+from src.clipboard_backend import input_handler, WindowsClipboardBackend
+from src.clipboard_manager import VirtualClipboardManager, decode_content
 from src.keyboard_handler import InputHandler
 from src.hardware_info import SystemMonitor
 from src.audio_info import MediaInfoManager
+from src.binary_frame import BinaryFrame
+from src.blob_store import BlobStore
+from src.clipboard_journal import ClipboardJournal
+from src.clipboard_history import ClipboardHistory, DEFAULT_PAGE_SIZE, HISTORY_MAX_AGE, HISTORY_MAX_ENTRIES, SEARCH_SUBSTRING
+from src.event_bus import EventBus
+from src.image_pipeline import ImagePipeline, PIPELINE_MODE_THREAD
+from src.media_watcher import MediaWatcher
 from src.websocket_handler import start_async_server, start_server, WebSocketConnectionManager, key_manager
 
 # その他
@@ -39,13 +47,45 @@ g.VERSION = VERSION
 
 #######################################################################################
 # 定数
-NUM_CLIPBOARDS = 10
+NUM_CLIPBOARDS = 100  # 仮想クリップボードの数。クライアントはページ単位で表示・購読する
+CLIPBOARD_PAGE_SIZE = 10  # ページサイズを指定しないクライアントに使う1ページあたりの仮想クリップボードの数
+MAX_CLIPBOARD_PAGE_SIZE = 100  # 1ページあたりの仮想クリップボードの数の上限
+CLIPBOARD_PASTE_GRACE = 0.15  # ペースト操作を送ってから元のクリップボードを復元するまで待つ固定の時間（秒）。遅いアプリケーションでは長くする
+CLIPBOARD_COPY_TIMEOUT = 0.2  # コピー操作でクリップボードが変わるのを待つ時間の上限（秒）。何も選択されていない場合はこの時間だけ他の操作が待たされる
+# クリップボードの履歴。コピーした内容（パスワードなども含む）がディスクに残るため、既定では記録しない
+CLIPBOARD_HISTORY_ENABLED = False
+CLIPBOARD_HISTORY_MAX_ENTRIES = HISTORY_MAX_ENTRIES  # 保持する項目数の上限
+CLIPBOARD_HISTORY_MAX_AGE = HISTORY_MAX_AGE  # 項目を保持する期間（秒）
+MAX_UPLOAD_SIZE = 64 * 1024 * 1024  # クライアントからアップロードできるファイルの最大サイズ（バイト）
+SYSTEM_INFO_INTERVAL = 2  # システム情報の取得間隔（秒）。購読者がより短い間隔を要求した場合はそちらを優先
+MIN_SYSTEM_INFO_INTERVAL = 0.5  # システム情報の最短の取得間隔（秒）
+SERVER_TIME_REUSE = 0.1  # オーディオ情報に付けた送信時のサーバーの時刻を、他のクライアントへの送信でも使い回す時間（秒）
+# 画像処理（アルバムアートとクリップボードのサムネイル）の実行方法。
+# PIPELINE_MODE_PROCESSはワーカーがこのモジュールを読み込み直すため、常駐アプリとしてはスレッドを使う
+IMAGE_PIPELINE_MODE = PIPELINE_MODE_THREAD
+IMAGE_PIPELINE_WORKERS = 2
 
 #######################################################################################
 # グローバル変数
-audio_info_manager = MediaInfoManager()
+event_bus = EventBus()
+image_pipeline = ImagePipeline(IMAGE_PIPELINE_MODE, IMAGE_PIPELINE_WORKERS)
 system_monitor = SystemMonitor()
-clipboard_manager = VirtualClipboardManager(num_clipboards=NUM_CLIPBOARDS)
+blob_store = BlobStore()
+audio_info_manager = MediaInfoManager(event_bus=event_bus, image_pipeline=image_pipeline, blob_store=blob_store)
+media_watcher = MediaWatcher(audio_info_manager, media_options={"quality": 60})
+clipboard_journal = ClipboardJournal()
+clipboard_history = None
+if CLIPBOARD_HISTORY_ENABLED:
+    clipboard_history = ClipboardHistory(max_entries=CLIPBOARD_HISTORY_MAX_ENTRIES, max_age=CLIPBOARD_HISTORY_MAX_AGE)
+    clipboard_history.load()
+clipboard_manager = VirtualClipboardManager(num_clipboards=NUM_CLIPBOARDS, blob_store=blob_store, event_bus=event_bus,
+                                            backend=WindowsClipboardBackend(paste_grace=CLIPBOARD_PASTE_GRACE),
+                                            copy_timeout=CLIPBOARD_COPY_TIMEOUT,
+                                            journal=clipboard_journal, history=clipboard_history,
+                                            image_pipeline=image_pipeline)
+system_info_cache = {"message": None, "sampled_at": None}
+audio_info_cache = {"info": None, "message": None, "stamped": None}
+clipboard_info_cache = {"version": None, "messages": {}}
 
 #######################################################################################
 # 関数
@@ -69,12 +109,38 @@ def get_local_ip():
 
     return local_ip
 
-def get_clipboard_info():
+def get_clipboard_page_indices(page=None, page_size=None):
+    """
+    ページに含まれる仮想クリップボードのインデックスの範囲を取得する関数。
+
+    Args:
+        page (int or None): 0から始まるページ番号。Noneの場合は全ての仮想クリップボード。
+        page_size (int or None): 1ページあたりの仮想クリップボードの数。省略時はCLIPBOARD_PAGE_SIZE。
+
+    Returns:
+        range: ページに含まれるインデックスの範囲。
+    """
+    count = clipboard_manager.get_num_clipboards()
+    if page is None:
+        return range(count)
+    page_size = min(max(int(page_size or CLIPBOARD_PAGE_SIZE), 1), MAX_CLIPBOARD_PAGE_SIZE)
+    start = min(max(int(page), 0) * page_size, count)
+    return range(start, min(start + page_size, count))
+
+def get_clipboard_info(since_version=0, indices=None):
     """
     クリップボード情報を取得する関数。
+    指定したバージョンより後に内容が設定された仮想クリップボードの情報のみを返します。
+
+    Args:
+        since_version (int): クライアントが受信済みのバージョン番号。0の場合は全ての情報を返します。
+        indices (iterable or None): 対象とするインデックス。Noneの場合は全ての仮想クリップボード。
+
+    Returns:
+        dict: "clipboard_{インデックス}" をキーとするクリップボード情報の辞書。
     """
-    info = {"type": "clipboard_info"}
-    for i in range(NUM_CLIPBOARDS):
+    info = {}
+    for i in clipboard_manager.get_changed_indices(since_version, indices):
         label = clipboard_manager.get_clipboard_label(i)
         # print(f"CLIPBOARD {i}: {label}")
         clp_type = clipboard_manager.get_clipboard_type(i)
@@ -91,18 +157,93 @@ def get_clipboard_info():
                 "label": label,
                 "type": clp_type
             }
+        # 内容本体はHTTP（/blob/{ハッシュ値}）で取得できるよう、ハッシュ値とサイズを付与する
+        # 読み取りの間に内容が差し替えられて以前のデータが解放された場合は付与しない（新しい内容の変更通知で送り直される）
+        blob = clipboard_manager.get_clipboard_blob(i)
+        blob_info = blob_store.get_info(blob) if blob else None
+        if blob_info is not None:
+            info[f"clipboard_{i}"]["blob"] = blob
+            info[f"clipboard_{i}"]["size"] = blob_info["size"]
+        info[f"clipboard_{i}"]["version"] = clipboard_manager.get_clipboard_version(i)
     return info
 
-def process_message(message: str, ws: WebSocketConnectionManager) -> str:
+def create_clipboard_info_message(since_version=0, page=None, page_size=None):
+    """
+    クリップボード情報の差分メッセージを作成する関数。
+    ページを指定した場合は、そのページに含まれる仮想クリップボードの情報のみを含めます。
+
+    Args:
+        since_version (int): クライアントが受信済みのバージョン番号。0の場合は全ての情報を含めます。
+        page (int or None): 0から始まるページ番号。Noneの場合は全ての仮想クリップボード。
+        page_size (int or None): 1ページあたりの仮想クリップボードの数。
+
+    Returns:
+        dict: "version"（このメッセージで反映されるバージョン）、"base_version"（差分の基準）、
+            "total"（仮想クリップボードの数）と、ページを指定した場合は"page"・"page_size"を含むメッセージ。
+    """
+    # 差分を作る前に最新バージョンを読み込む（作成中に変更された内容は次回の差分にも含まれる）
+    version = clipboard_manager.get_version()
+    indices = get_clipboard_page_indices(page, page_size)
+    message = {
+        "type": "clipboard_info",
+        "version": version,
+        "base_version": since_version,
+        "total": clipboard_manager.get_num_clipboards(),
+        "data": get_clipboard_info(since_version, indices)
+    }
+    if page is not None:
+        message["page"] = page
+        message["page_size"] = len(indices) if page_size is None else page_size
+    return message
+
+def create_clipboard_response(message: dict):
+    """
+    クリップボード操作に応答するメッセージを作成する関数。メッセージで指定されたページの差分を返します。
+
+    Args:
+        message (dict): クライアントから受信したメッセージ。"version"・"page"・"page_size"を参照します。
+
+    Returns:
+        dict: クリップボード情報の差分メッセージ。
+    """
+    return create_clipboard_info_message(message.get("version", 0), message.get("page"), message.get("page_size"))
+
+def process_upload(path: str, mime: str, target: dict):
+    """
+    分割アップロードで受信した画像を仮想クリップボードに設定する関数。
+    一時ファイルのパスはサーバーが作成したものだけを受け取り、クライアントからはtargetで保存先のみを指定します。
+
+    Args:
+        path (str): 受信したデータを書き込んだ一時ファイルのパス。
+        mime (str): データのMIMEタイプ。
+        target (dict): upload_initで指定された保存先。"id"（仮想クリップボードのインデックス）と、
+            応答に使う"version"・"page"・"page_size"を参照します。
+
+    Returns:
+        dict: 処理された結果を返します。
+    """
+    index = target.get("id")
+    if type(index) is not int or not 0 <= index < NUM_CLIPBOARDS:
+        return {"response": f"Invalid clipboard index ({index}).", "status": "error"}
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        clipboard_manager.copy_clipboard_auto_from_api(index, {"type": "image", "content": data})
+    except OSError as e:
+        # 画像として読み込めないファイル（PILのUnidentifiedImageError）はこのアップロードだけを失敗とする
+        return {"response": f"Uploaded file is not a supported image ({e}).", "status": "error"}
+    return create_clipboard_response(target)
+
+def process_message(message: dict, ws: WebSocketConnectionManager):
     """
     クライアントから受信したメッセージを処理します。
     必要に応じて、ここでメッセージの処理ロジックを実装します。
 
     Args:
-        message (str): 受信したメッセージ。
+        message (dict): 受信したメッセージ。バイナリフレームで受信した場合、ペイロードはbytesとして格納されます。
 
     Returns:
-        str: 処理された結果を返します（ここではエコーバック）。
+        dict or BinaryFrame: 処理された結果を返します。
     """
     # メッセージをJSON形式にパース
     # print(f"Received message: {message}")
@@ -117,32 +258,59 @@ def process_message(message: str, ws: WebSocketConnectionManager) -> str:
     elif message["type"] == "clipboard_copy":
         # クリップボード操作を処理
         clipboard_manager.copy_clipboard_auto(message["id"])
-        clipboard_info = get_clipboard_info()
-        return {
-            "type": "clipboard_info",
-            "data": clipboard_info
-        }
+        return create_clipboard_response(message)
     elif message["type"] == "clipboard_paste":
         clipboard_manager.paste_clipboard(message["id"])
-        clipboard_info = get_clipboard_info()
-        return {
-            "type": "clipboard_info",
-            "data": clipboard_info
-        }
+        return create_clipboard_response(message)
     elif message["type"] == "clipboard_upload":
         clipboard_manager.copy_clipboard_auto_from_api(message["id"], message["data"])
-        clipboard_info = get_clipboard_info()
-        return {
-            "type": "clipboard_info",
-            "data": clipboard_info
-        }
+        return create_clipboard_response(message)
+    elif message["type"] == "clipboard_sync":
+        # クライアントが受信済みのバージョン以降の差分を返す
+        return create_clipboard_response(message)
     elif message["type"] == "clipboard_download":
+        if clipboard_manager.get_clipboard_type(message["id"]) == "image":
+            # 画像はバイナリフレームで送信する。バイナリフレームを利用しない接続には、
+            # Base64で膨らませずキャッシュ可能なHTTPのURL（BlobStoreに無い場合はデータURL）を送る
+            header = {"type": "clipboard_download", "id": message["id"], "content_type": "image"}
+            blob = clipboard_manager.get_clipboard_blob(message["id"])
+            lease = blob_store.acquire(blob) if blob else None
+            if lease is None:
+                image_data = clipboard_manager.get_clipboard_image_bytes(message["id"])
+                return BinaryFrame(header, image_data, field="data", mime="image/png")
+            try:
+                # アップロードされたJPEGなどは再エンコードせず、保存されている形式のまま送る
+                return BinaryFrame(header, blob_store.get(blob), field="data", mime=lease.info["mime"],
+                                   fallback={**header, "url": f"/blob/{blob}"})
+            finally:
+                lease.release()
         data = clipboard_manager.get_clipboard(message["id"])
-        clipboard_info = get_clipboard_info()
         return {
             "type": "clipboard_download",
+            "id": message["id"],
+            "content_type": clipboard_manager.get_clipboard_type(message["id"]),
             "data": data
         }
+    elif message["type"] in ("history_query", "history_restore") and clipboard_history is None:
+        return {"response": "Clipboard history is disabled.", "status": "error"}
+    elif message["type"] == "history_query":
+        # 履歴を新しい順に1ページ分返す。次のページはnext_beforeをbeforeに指定して取得する
+        result = clipboard_history.query(
+            message.get("query", ""), message.get("mode", SEARCH_SUBSTRING), message.get("content_type"),
+            message.get("before"), message.get("limit", DEFAULT_PAGE_SIZE))
+        return {"type": "history", "query": message.get("query", ""), "before": message.get("before"), **result}
+    elif message["type"] == "history_restore":
+        # 履歴の項目を仮想クリップボードに設定する
+        entry = clipboard_history.get_entry(message["entry"])
+        data = clipboard_history.get_content(message["entry"])
+        if entry is None or data is None:
+            return {"response": f"History entry ({message['entry']}) not found.", "status": "error"}
+        if entry["type"] == "image":
+            # 画像はデコードせずに保存されたデータのまま設定する
+            clipboard_manager.set_clipboard(message["id"], None, "image", data=data, mime=entry["mime"])
+        else:
+            clipboard_manager.set_clipboard(message["id"], decode_content(data, entry["type"]), entry["type"])
+        return create_clipboard_response(message)
     else:
         response_data = {
             "response": message,
@@ -152,13 +320,28 @@ def process_message(message: str, ws: WebSocketConnectionManager) -> str:
         return response_data
 
 
-async def periodic_task_function(websocket_send_function, is_first=False, buffer=None):
+def create_audio_info_message(media_info):
     """
-    定期的に実行するタスクを定義する関数。
-    ここでは、定期的にシステム情報を取得してクライアントに送信します。
+    オーディオ情報の送信メッセージを作成する関数。
+    サムネイルはメッセージに含めず、/blob で配信される複数のサイズのURL（album_art）のみを送信します。
 
     Args:
-        websocket (WebSocket): WebSocket接続オブジェクト。
+        media_info (dict or None): MediaInfoManagerから取得したメディア情報。
+
+    Returns:
+        dict: 送信するメッセージ。
+    """
+    return {
+        "type": "audio_info",
+        "data": media_info
+    }
+
+def sample_system_info():
+    """
+    システム情報を取得し、送信メッセージを作成する関数。
+
+    Returns:
+        dict: システム情報の送信メッセージ。
     """
     # システム情報を取得
     cpu_usage = system_monitor.get_cpu_usage()
@@ -171,8 +354,7 @@ async def periodic_task_function(websocket_send_function, is_first=False, buffer
     # print(f"CPU Name: {cpu_name}")
     memory_info = system_monitor.get_total_memory_info()
     # print(f"Memory Info: {memory_info}")
-    # システム情報を送信
-    response_data = {
+    return {
         "type": "system_info",
         "data": {
             "cpu_usage": cpu_usage,
@@ -187,55 +369,106 @@ async def periodic_task_function(websocket_send_function, is_first=False, buffer
             "memory_info": memory_info
         }
     }
-    await websocket_send_function(response_data)
 
-    # オーディオ情報を取得
-    media_info, info_changed = await audio_info_manager.get_media_info_async(quality=60)
-    if info_changed or is_first or True:
-        # オーディオ情報が変更された場合のみ送信
-        response_data = {
-            "type": "audio_info",
-            "data": media_info
-        }
-        if buffer is None:
-            await websocket_send_function(response_data)
-        else:
-            if "audio_info" in buffer:
-                if buffer["audio_info"] != response_data:
-                    await websocket_send_function(response_data)
-        if buffer is not None:
-            buffer["audio_info"] = response_data
-
-    # クリップボード情報を送信
-    clipboard_info = get_clipboard_info()
-    response_data = {
-        "type": "clipboard_info",
-        "data": {}
-    }
+async def periodic_task_function(topic_intervals=None):
+    """
+    定期的に実行するタスクを定義する関数。
+    共有サンプラーから呼び出され、ポーリングが必要な情報を取得して変化をイベントとして発行します。
+    誰も購読していない情報は取得しません。
+    クライアントへの送信はイベントを受け取ったWebSocketConnectionManagerが行います。
 
-    # bufferが存在しない場合、全てのクリップボード情報を送信する
-    if buffer is None:
-        for i in range(NUM_CLIPBOARDS):
-            clipboard_key = f"clipboard_{i}"
-            response_data["data"][clipboard_key] = clipboard_info.get(clipboard_key, {})
-        await websocket_send_function(response_data)
-    else:
-        # 変更されたクリップボードのみをresponse_dataに追加する
-        for i in range(NUM_CLIPBOARDS):
-            clipboard_key = f"clipboard_{i}"
-            new_clipboard_data = clipboard_info.get(clipboard_key, {})
-            old_clipboard_data = buffer.get("clipboard_info", {}).get(clipboard_key, {})
-            
-            if new_clipboard_data != old_clipboard_data:
-                response_data["data"][clipboard_key] = new_clipboard_data
-        
-        # もしresponse_dataに変更があった場合のみ送信する
-        if response_data["data"]:
-            await websocket_send_function(response_data)
-
-    # bufferを更新する
-    if buffer is not None:
-        buffer["clipboard_info"] = clipboard_info
+    Args:
+        topic_intervals (dict or None): 購読者が居るトピックと最小送信間隔（秒、0は変化のたび）の辞書。
+            Noneの場合は全ての情報を既定の間隔で取得します。
+    """
+    if topic_intervals is None:
+        topic_intervals = {"system_info": 0, "audio_info": 0}
+
+    # システム情報は購読者が要求する間隔（指定が無ければSYSTEM_INFO_INTERVAL）ごとに取得する
+    if "system_info" in topic_intervals:
+        interval = max(topic_intervals["system_info"] or SYSTEM_INFO_INTERVAL, MIN_SYSTEM_INFO_INTERVAL)
+        now = time.monotonic()
+        if system_info_cache["sampled_at"] is None or now - system_info_cache["sampled_at"] >= interval:
+            system_info_cache["message"] = sample_system_info()
+            system_info_cache["sampled_at"] = now
+            event_bus.publish("system_info")
+
+    # オーディオ情報は変化の通知を受けた時だけMediaWatcherが取得する（変化した場合はMediaInfoManagerがイベントを発行する）
+    # バックエンドが通知に対応していない場合はここでポーリングする
+    if "audio_info" in topic_intervals:
+        if not await media_watcher.start():
+            await media_watcher.refresh()
+
+def build_system_info_message(state):
+    """
+    配信するシステム情報のメッセージを作成する関数。
+
+    Args:
+        state (dict): トピックの送信状態（未使用）。
+
+    Returns:
+        dict or None: 最後に取得したシステム情報。未取得の場合はNone。
+    """
+    return system_info_cache["message"]
+
+def build_audio_info_message(state):
+    """
+    配信するオーディオ情報のメッセージを作成する関数。前回の送信内容と同じ場合は送信しません。
+    再生位置はクライアントが補間するため、再生位置の更新時刻とクライアントの時計の差を補正できるよう送信時のサーバーの時刻を付けます。
+
+    Args:
+        state (dict): トピックの送信状態。空の場合は必ずメッセージを作成します。
+
+    Returns:
+        dict or None: 送信するメッセージ。
+    """
+    media_info = audio_info_manager.get_current_media_info()
+    if audio_info_cache["message"] is None or audio_info_cache["info"] != media_info:
+        audio_info_cache["info"] = media_info
+        audio_info_cache["message"] = create_audio_info_message(media_info)
+    message = audio_info_cache["message"]
+    if "last" in state and state["last"] == message:
+        return None
+    state["last"] = message
+    # 同じ配信で送るクライアントには時刻を付けた同じメッセージオブジェクトを共有し、シリアライズを1回にする
+    now = time.time()
+    stamped = audio_info_cache["stamped"]
+    if stamped is None or stamped["source"] is not message or now - stamped["server_time"] > SERVER_TIME_REUSE:
+        stamped = {"source": message, "server_time": now, "message": dict(message, server_time=now)}
+        audio_info_cache["stamped"] = stamped
+    return stamped["message"]
+
+def build_clipboard_info_message(state):
+    """
+    配信するクリップボード情報の差分メッセージを作成する関数。
+    購読時に指定されたページ（state["options"] の "page"・"page_size"）の差分のみを含めるため、
+    仮想クリップボードの数を増やしても、1回の配信で各クライアントに対して行う処理は増えません。
+
+    Args:
+        state (dict): トピックの送信状態。"version"に送信済みのバージョンを保持し、空の場合は全ての情報を含めます。
+
+    Returns:
+        dict or None: 送信するメッセージ。表示中のページに変更が無い場合はNone。
+    """
+    version = clipboard_manager.get_version()
+    if "version" in state and version <= state["version"]:
+        return None
+    options = state.get("options") or {}
+    page, page_size = options.get("page"), options.get("page_size")
+    since_version = state.get("version", 0)
+    # 同じページ・同じバージョンからの差分は同じメッセージオブジェクトを共有し、シリアライズを1回にする
+    if clipboard_info_cache["version"] != version:
+        clipboard_info_cache["version"] = version
+        clipboard_info_cache["messages"] = {}
+    key = (page, page_size, since_version)
+    if key not in clipboard_info_cache["messages"]:
+        clipboard_info_cache["messages"][key] = create_clipboard_info_message(since_version, page, page_size)
+    message = clipboard_info_cache["messages"][key]
+    if "version" in state and not message["data"]:
+        # 他のページのみが変更された場合は送信しない。送信済みのバージョンは進めず、次の差分の基準とする
+        return None
+    state["version"] = message["version"]
+    return message
 
 def create_image(width, height, color1, color2):
     image = Image.new('RGB', (width, height), color1)
@@ -267,6 +500,10 @@ def show_qr_window():
     root.mainloop()
 
 def on_quit(icon, item):
+    # 書き込み待ちの仮想クリップボードの変更を保存してから終了する
+    clipboard_journal.close()
+    if clipboard_history is not None:
+        clipboard_history.close()
     icon.stop()
     exit(0)
 
@@ -297,7 +534,15 @@ def main():
     メイン処理を行う関数。
     """
     # 初期化処理
-    start_server(process_message, periodic_task_function)
+    start_server(process_message, periodic_task_function, blob_store_instance=blob_store,
+                 extra_blob_store_instances=[clipboard_history.blob_store] if clipboard_history is not None else [],
+                 max_upload_size=MAX_UPLOAD_SIZE,
+                 image_pipeline_instance=image_pipeline, upload_func=process_upload,
+                 event_bus_instance=event_bus, topic_builders={
+                     "system_info": build_system_info_message,
+                     "audio_info": build_audio_info_message,
+                     "clipboard_info": build_clipboard_info_message,
+                 })
     print("Server started.")
     icon.run()
     pass
@@ -0,0 +1,181 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# ActionExecutor モジュール
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import asyncio
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+## pypiライブラリ
+
+## 自作モジュール
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+
+
+#######################################################################################
+# クラス
+class ActionExecutor:
+    """
+    クリップボードやキーボードを操作するブロッキング処理を、専用のワーカースレッドで直列に実行するクラス。
+
+    システムクリップボードは同時に1つの処理しか扱えないため、キューに積まれた処理を1つずつ実行します。
+    asyncioのイベントループからは run() を await することで、ループをブロックせずに結果を待てます。
+    キューの深さや待ち時間・実行時間を統計として取得できます。
+    """
+
+    def __init__(self, name="action-executor"):
+        """
+        ActionExecutorの初期化を行うコンストラクタ。ワーカースレッドを開始します。
+
+        Args:
+            name (str): ワーカースレッドの名前。
+        """
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.last_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.total_wait_time = 0.0
+        self.last_run_time = 0.0
+        self.max_run_time = 0.0
+        self.total_run_time = 0.0
+        self.thread = threading.Thread(target=self._worker, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        """
+        処理をキューに追加する関数。
+
+        Args:
+            func (Callable): 実行する関数。
+            *args: 関数に渡す位置引数。
+            **kwargs: 関数に渡すキーワード引数。
+
+        Returns:
+            Future: 処理結果を受け取るためのFutureオブジェクト。
+        """
+        future = Future()
+        self.queue.put((future, func, args, kwargs, time.perf_counter()))
+        return future
+
+    async def run(self, func, *args, **kwargs):
+        """
+        処理をキューに追加し、イベントループをブロックせずに完了を待つ非同期関数。
+
+        Args:
+            func (Callable): 実行する関数。
+            *args: 関数に渡す位置引数。
+            **kwargs: 関数に渡すキーワード引数。
+
+        Returns:
+            関数の戻り値を返します。
+        """
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def get_queue_depth(self):
+        """
+        実行待ちの処理数を取得する関数。
+
+        Returns:
+            int: キューに積まれている処理の数。
+        """
+        return self.queue.qsize()
+
+    def get_stats(self):
+        """
+        キューの深さと待ち時間・実行時間の統計を取得する関数。
+
+        Returns:
+            dict: 統計情報を格納した辞書（時間はミリ秒）。
+        """
+        with self.lock:
+            count = self.completed + self.failed
+            return {
+                "queue_depth": self.get_queue_depth(),
+                "completed": self.completed,
+                "failed": self.failed,
+                "last_wait_ms": self.last_wait_time * 1000,
+                "avg_wait_ms": self.total_wait_time / count * 1000 if count else 0.0,
+                "max_wait_ms": self.max_wait_time * 1000,
+                "last_run_ms": self.last_run_time * 1000,
+                "avg_run_ms": self.total_run_time / count * 1000 if count else 0.0,
+                "max_run_ms": self.max_run_time * 1000,
+            }
+
+    def _worker(self):
+        """
+        キューから処理を取り出して順番に実行するワーカースレッドの本体。
+        """
+        while True:
+            future, func, args, kwargs, queued_at = self.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            started_at = time.perf_counter()
+            succeeded = False
+            try:
+                result = func(*args, **kwargs)
+                future.set_result(result)
+                succeeded = True
+            except BaseException as e:
+                print(f"Error in action executor: {e}")
+                future.set_exception(e)
+            finished_at = time.perf_counter()
+            self._record(started_at - queued_at, finished_at - started_at, succeeded)
+
+    def _record(self, wait_time, run_time, succeeded):
+        """
+        1件分の待ち時間と実行時間を統計に反映する関数。
+
+        Args:
+            wait_time (float): キューで待機した時間（秒）。
+            run_time (float): 実行に要した時間（秒）。
+            succeeded (bool): 処理が成功したかどうか。
+        """
+        with self.lock:
+            if succeeded:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.last_wait_time = wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            self.total_wait_time += wait_time
+            self.last_run_time = run_time
+            self.max_run_time = max(self.max_run_time, run_time)
+            self.total_run_time += run_time
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    executor = ActionExecutor()
+
+    async def main():
+        results = await asyncio.gather(*[executor.run(time.sleep, 0.1) for _ in range(5)])
+        print(results)
+        print(executor.get_stats())
+
+    asyncio.run(main())
@@ -9,23 +9,26 @@
 import asyncio
 # import nest_asyncio
 # nest_asyncio.apply()
-import base64
+import hashlib
 import io
 
 ## pypiライブラリ
 from PIL import Image, ImageOps
 
 ## 自作モジュール
+from src.blob_store import BlobStore
+from src.image_pipeline import ImagePipeline
+from src.lru_cache import LRUCache
+from src.media_backend import WinsdkMediaBackend
 
 ## その他
-try:
-    from winsdk.windows.media.control import GlobalSystemMediaTransportControlsSessionManager as MediaManager
-    from winsdk.windows.storage.streams import DataReader, Buffer, InputStreamOptions
-except Exception:
-    pass
 
 #######################################################################################
 # 定数
+ALBUM_THUMBNAIL_CACHE_SIZE = 256  # 作成したサムネイルを曲ごとにキャッシュする数
+ALBUM_ART_SIZES = (150, 300, 600)  # 作成するサムネイルの一辺のサイズ（ピクセル）。高DPIの端末は大きいサイズを選択する
+ALBUM_ART_MIME = 'image/webp'
+TIMELINE_DRIFT_TOLERANCE = 1.0  # 前回の再生位置からの予測とのずれがこれ以下であれば再生位置を送り直さない（秒）
 
 
 #######################################################################################
@@ -34,7 +37,74 @@ except Exception:
 
 #######################################################################################
 # 関数
+def render_album_thumbnail(image: Image.Image, image_size=150, lossless=False, quality=90) -> bytes:
+    """
+    アルバムのサムネイル画像を正方形に縮小し、WebPとしてエンコードする関数。
+
+    Args:
+        image (PIL.Image.Image): 元の画像。
+        image_size (int): サムネイル画像のサイズ（ピクセル）。
+        lossless (bool): 可逆圧縮でエンコードするかどうか。
+        quality (int): 非可逆圧縮の品質。
+
+    Returns:
+        bytes: WebPのバイト列。
+    """
+    image = ImageOps.contain(image, (image_size, image_size), method=Image.LANCZOS)
+    background = Image.new('RGB', (image_size, image_size), (255, 255, 255))
+    offset = ((image_size - image.width) // 2, (image_size - image.height) // 2)
+    background.paste(image, offset)
 
+    with io.BytesIO() as output:
+        if lossless == True:
+            background.save(output, format="WEBP", quality=100, lossless=True)
+        else:
+            background.save(output, format="WEBP", quality=quality)
+        return output.getvalue()
+
+def encode_album_art(data, image_sizes=ALBUM_ART_SIZES, lossless=False, quality=90) -> list:
+    """
+    元の画像を1回だけデコードし、複数のサイズのサムネイルを作成する関数。
+    元の画像より大きいサイズは拡大しても精細にならないため作成しません（最小のサイズは常に作成します）。
+
+    Args:
+        data (bytes or bytearray): エンコードされた元の画像。
+        image_sizes (tuple): 作成するサムネイルのサイズ（ピクセル）。
+        lossless (bool): 可逆圧縮でエンコードするかどうか。
+        quality (int): 非可逆圧縮の品質。
+
+    Returns:
+        list: (サイズ, WebPのバイト列) のタプルのリスト（サイズの昇順）。
+    """
+    image = Image.open(io.BytesIO(data))
+    sizes = sorted(set(image_sizes))
+    sizes = [size for size in sizes if size <= max(image.size)] or sizes[:1]
+    # JPEGは最大のサムネイルに必要な解像度までしか展開しない
+    image.draft('RGB', (sizes[-1], sizes[-1]))
+    image.load()
+    return [(size, render_album_thumbnail(image, size, lossless, quality)) for size in sizes]
+
+def timeline_changed(previous, current, tolerance=TIMELINE_DRIFT_TOLERANCE) -> bool:
+    """
+    再生位置と再生状態が、前回の値から予測できない変化をしたかどうかを確認する関数。
+    再生中の位置は last_updated からの経過時間と再生速度で進むため、予測とのずれがtolerance以下であれば変化していないとみなします。
+
+    Args:
+        previous (dict or None): 前回の再生位置と再生状態（position・duration・playback_rate・playing・last_updated）。
+        current (dict or None): 今回の再生位置と再生状態。
+        tolerance (float): 許容する予測とのずれ（秒）。
+
+    Returns:
+        bool: シーク・一時停止・再生速度の変更などで予測できない変化があった場合はTrue。
+    """
+    if previous is None or current is None:
+        return previous is not current
+    if any(previous[key] != current[key] for key in ["duration", "playback_rate", "playing"]):
+        return True
+    predicted = previous["position"]
+    if previous["playing"]:
+        predicted += (current["last_updated"] - previous["last_updated"]) * previous["playback_rate"]
+    return abs(current["position"] - predicted) > tolerance
 
 #######################################################################################
 # クラス
@@ -44,55 +114,78 @@ class MediaInfoManager:
     
     現在再生中のメディア情報（アーティスト名、曲名、アルバム情報、サムネイル画像など）を取得し、
     以前の情報と比較して変化があったかをチェックする機能を提供します。
+    EventBusを指定した場合、情報やサムネイルが変化した時に "audio_info" イベントを発行します。
+    メディア情報の取得はMediaBackendに委譲します（既定はWinsdkMediaBackend）。
+    サムネイルは複数のサイズで作成してBlobStoreに保存し、メディア情報には /blob/{ハッシュ値} のURLのみを含めます。
+    再生位置（timeline）は時刻から計算できるため、シーク・一時停止など予測できない変化があった時だけ更新し、
+    クライアントが再生位置を補間します。
+    作成したサムネイルは曲（アーティスト・アルバム・曲名）とサイズ・品質ごとにキャッシュし、
+    再び同じ曲になった時はサムネイルを読み込まずに再利用します。
     """
-    def __init__(self):
+    def __init__(self, event_bus=None, backend=None, thumbnail_cache_size=ALBUM_THUMBNAIL_CACHE_SIZE, image_pipeline=None,
+                 blob_store=None):
         """
         MediaInfoManagerの初期化を行うコンストラクタ。
+
+        Args:
+            event_bus (EventBus or None): 変化を通知するEventBus。省略可能。
+            backend (MediaBackend or None): メディア情報を取得するバックエンド。省略時はWinsdkMediaBackend。
+            thumbnail_cache_size (int): 作成したサムネイルをキャッシュする曲の数。
+            image_pipeline (ImagePipeline or None): サムネイルの作成を実行するImagePipeline。省略時は新たに作成します。
+            blob_store (BlobStore or None): サムネイルを保存し、/blob で配信するBlobStore。省略時は新たに作成します。
         
         Attributes:
             previous_info (dict or None): 前回取得したメディア情報を保存する辞書。初期値はNone。
+            thumbnail_cache (LRUCache): (artist, album_title, title, サイズのタプル, 可逆圧縮, 品質) をキーとし、
+                (元画像のハッシュ値, BlobStoreのハッシュ値のリスト, album_art) を値とするキャッシュ。
+                キャッシュから外れたサムネイルはBlobStoreから解放します。
+            thumbnail_reads (int): サムネイルの元画像を読み込んだ回数。
+            thumbnail_encodes (int): サムネイルを作成した回数。
         """
         self.previous_info = None
         self.change_count = 0
+        self.event_bus = event_bus
+        self.backend = backend if backend is not None else WinsdkMediaBackend()
+        self.image_pipeline = image_pipeline if image_pipeline is not None else ImagePipeline()
+        # 既定のディレクトリはアプリケーションのBlobStoreと共有するため、残ったファイルの削除はそちらに任せる
+        self.blob_store = blob_store if blob_store is not None else BlobStore(remove_orphans=False)
+        self.thumbnail_cache = LRUCache(max_entries=thumbnail_cache_size, on_evict=self._release_album_art)
+        self.thumbnail_reads = 0
+        self.thumbnail_encodes = 0
 
-    async def read_stream_into_buffer(self, stream_ref, buffer):
+    def publish_change(self):
         """
-        ストリームをバッファに読み込む非同期関数。
-        
-        Args:
-            stream_ref: 読み込み元のストリーム参照。
-            buffer (Buffer): データを格納するためのバッファオブジェクト。
-        
-        Returns:
-            None
+        メディア情報の変化をEventBusに通知する関数。
         """
-        try:
-            readable_stream = await stream_ref.open_read_async()
-            await readable_stream.read_async(buffer, buffer.capacity, InputStreamOptions.READ_AHEAD)
-        except Exception as e:
-            print(f"Error reading stream: {e}")
+        if self.event_bus is not None:
+            self.event_bus.publish("audio_info")
 
-    async def get_media_info_async(self, image_size=150, lossless=False, quality=90):
+    async def get_media_info_async(self, image_sizes=ALBUM_ART_SIZES, lossless=False, quality=90, verify_thumbnail=False):
         """
         現在のメディア情報を非同期で取得する関数。
         
         Args:
-            image_size (int): サムネイル画像のサイズ。デフォルトは150ピクセル。
+            image_sizes (tuple): 作成するサムネイル画像のサイズ（ピクセル）。
+            lossless (bool): サムネイルを可逆圧縮でエンコードするかどうか。
+            quality (int): サムネイルの非可逆圧縮の品質。
+            verify_thumbnail (bool): 曲が変わっていない場合も、サムネイルの元画像が変わっていないか確認するかどうか。
+                ポーリングしない場合（MediaWatcher）に、曲の切り替えの少し後で指定します。
         
         Returns:
             tuple: 現在のメディア情報を格納した辞書と、情報が更新されたかどうかのブール値のタプル。
+                サムネイル（album_art）は {"size": サイズ, "url": URL} のリスト（サイズの昇順）です。
+                再生位置（timeline）は position・duration・playback_rate・playing・last_updated を含む辞書、またはNoneです。
         """
-        sessions = await MediaManager.request_async()
-        current_session = sessions.get_current_session()
+        info = await self.backend.get_media_properties()
         
-        if current_session:
-            info = await current_session.try_get_media_properties_async()
-            artist = info.artist
-            title = info.title
-            album_title = info.album_title
-            album_artist = info.album_artist
-            track_number = info.track_number
-            thumbnail_stream_ref = info.thumbnail
+        if info:
+            artist = info["artist"]
+            title = info["title"]
+            album_title = info["album_title"]
+            album_artist = info["album_artist"]
+            track_number = info["track_number"]
+            thumbnail_stream_ref = info["thumbnail"]
+            timeline = info.get("timeline")
 
             if self.previous_info is None:
                 self.change_count = 0
@@ -104,72 +197,107 @@ class MediaInfoManager:
                 pass
 
             
-            album_thumbnail = None
+            album_art = None
             if thumbnail_stream_ref:
-                async def create_thumbnail(image, image_size):
-                    thumb_read_buffer = Buffer(5000000)
-                    
-                    # `asyncio.run_in_executor` を使用して非同期タスクを実行
-                    loop = asyncio.get_running_loop()
-                    await loop.run_in_executor(None, self._blocking_read_stream, thumbnail_stream_ref, thumb_read_buffer)
-                    
-                    buffer_reader = DataReader.from_buffer(thumb_read_buffer)
-                    byte_buffer = bytearray(thumb_read_buffer.length)
-                    buffer_reader.read_bytes(byte_buffer)
-                    image = Image.open(io.BytesIO(byte_buffer))
-                    image = ImageOps.contain(image, (image_size, image_size), method=Image.LANCZOS)
-                    background = Image.new('RGB', (image_size, image_size), (255, 255, 255))
-                    offset = ((image_size - image.width) // 2, (image_size - image.height) // 2)
-                    background.paste(image, offset)
-
-                    with io.BytesIO() as output:
-                        if lossless == True:
-                            background.save(output, format="WEBP", quality=100, lossless=True)
-                        else:
-                            background.save(output, format="WEBP", quality=quality)
-                        album_thumbnail = output.getvalue()
-                        album_thumbnail = base64.b64encode(album_thumbnail).decode()
-                        return album_thumbnail
+                cache_key = (artist, album_title, title, tuple(image_sizes), lossless, quality)
                 if self.previous_info is None or self.previous_info["title"] != title:
-                    album_thumbnail = await create_thumbnail(album_thumbnail, image_size)
-                elif self.change_count == 3:
-                    album_thumbnail = await create_thumbnail(album_thumbnail, image_size)
+                    album_art = await self.get_album_art(cache_key, thumbnail_stream_ref)
+                # 曲の切り替え直後は前の曲のサムネイルが返ることがあるため、少し後に元画像が変わっていないか確認する
+                elif self.change_count == 3 or verify_thumbnail:
+                    album_art = await self.get_album_art(cache_key, thumbnail_stream_ref, verify=True)
                 # サムネイルが無いはずなのにサムネイルを取得できた場合は再取得
-                elif self.previous_info["album_thumbnail"] is None:
-                    album_thumbnail = await create_thumbnail(album_thumbnail, image_size)
+                elif self.previous_info["album_art"] is None:
+                    album_art = await self.get_album_art(cache_key, thumbnail_stream_ref, verify=True)
                 # 曲が変わっていない場合はサムネイルを再利用
                 else:
-                    album_thumbnail = self.previous_info["album_thumbnail"]
+                    album_art = self.previous_info["album_art"]
+
+            # 同じ曲で再生位置が予測どおりに進んでいるだけであれば、前回の値のまま（変化として扱わない）
+            if (self.previous_info is not None and self.previous_info["title"] == title and
+                    not timeline_changed(self.previous_info["timeline"], timeline)):
+                timeline = self.previous_info["timeline"]
             current_info = {
                 "artist": artist,
                 "title": title,
                 "album_title": album_title,
                 "album_artist": album_artist,
                 "track_number": track_number,
-                "album_thumbnail": album_thumbnail,
+                "album_art": album_art,
+                "timeline": timeline,
             }
             
             if self.previous_info is None or self.has_info_changed(current_info):
                 self.previous_info = current_info
+                self.publish_change()
                 return current_info, True
             else:
+                thumbnail_changed = self.previous_info["album_art"] != album_art
+                timeline_updated = self.previous_info["timeline"] != timeline
                 self.previous_info = current_info
+                if thumbnail_changed or timeline_updated:
+                    self.publish_change()
                 return current_info, False
         else:
+            if self.previous_info is not None:
+                # 再生中のセッションが無くなった
+                self.previous_info = None
+                self.publish_change()
+                return None, True
             return None, False
 
-    def _blocking_read_stream(self, stream_ref, buffer):
+    async def get_album_art(self, cache_key, thumbnail_stream_ref, verify=False):
+        """
+        複数のサイズのサムネイルのURLを取得する非同期関数。キャッシュに無い場合は元画像を読み込んで作成し、BlobStoreに保存します。
+
+        Args:
+            cache_key (tuple): (artist, album_title, title, サイズのタプル, 可逆圧縮, 品質) のタプル。
+            thumbnail_stream_ref: MediaBackendから取得したサムネイルの参照。
+            verify (bool): キャッシュにある場合も元画像を読み込み、変わっていれば作成し直すかどうか。
+
+        Returns:
+            list or None: {"size": サイズ, "url": URL} のリスト。元画像を読み込めない場合はNone。
+        """
+        cached = self.thumbnail_cache.get(cache_key)
+        if cached is not None and not verify:
+            return cached[2]
+        data = await self.backend.read_thumbnail(thumbnail_stream_ref)
+        self.thumbnail_reads += 1
+        if not data:
+            return cached[2] if cached is not None else None
+        source_digest = hashlib.sha256(data).digest()
+        if cached is not None and cached[0] == source_digest:
+            return cached[2]
+        # デコードと縮小はイベントループをブロックしないようImagePipelineで行う
+        _, _, _, image_sizes, lossless, quality = cache_key
+        thumbnails = await self.image_pipeline.run("album_art", encode_album_art, bytes(data), image_sizes, lossless, quality)
+        self.thumbnail_encodes += 1
+        digests = [self.blob_store.put(thumbnail, ALBUM_ART_MIME) for _, thumbnail in thumbnails]
+        # URLはハッシュ値で決まるため、ブラウザは長期間キャッシュでき、再接続しても再取得しない
+        album_art = [{"size": size, "url": f"/blob/{digest}"} for (size, _), digest in zip(thumbnails, digests)]
+        self.thumbnail_cache.put(cache_key, (source_digest, digests, album_art))
+        return album_art
+
+    def _release_album_art(self, cache_key, cached):
+        """
+        キャッシュから外れたサムネイルをBlobStoreから解放する関数。
+
+        Args:
+            cache_key (tuple): キャッシュのキー。
+            cached (tuple): (元画像のハッシュ値, BlobStoreのハッシュ値のリスト, album_art) のタプル。
         """
-        ストリームをバッファに同期的に読み込むブロッキング関数。
-        非同期タスクとして別スレッドで実行されることを前提とする。
+        for digest in cached[1]:
+            self.blob_store.release(digest)
+
+    def get_thumbnail_stats(self):
+        """
+        サムネイルのキャッシュのヒット数・ミス数と、元画像の読み込み回数・作成回数を取得する関数。
+
+        Returns:
+            dict: 統計情報を格納した辞書。
         """
-        try:
-            # open_read_async() を同期的に処理
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(self.read_stream_into_buffer(stream_ref, buffer))
-        except Exception as e:
-            print(f"Error in blocking read stream: {e}")
+        stats = self.thumbnail_cache.get_stats()
+        stats.update({"reads": self.thumbnail_reads, "encodes": self.thumbnail_encodes})
+        return stats
 
     def has_info_changed(self, current_info):
         """
@@ -0,0 +1,190 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# BinaryFrame モジュール
+#
+# WebSocketのバイナリフレーム形式:
+#   [ヘッダ長 (4バイト, ビッグエンディアン)] [ヘッダ (UTF-8のJSON)] [ペイロード (生のバイト列)]
+# ヘッダの "field" にはペイロードを格納するメッセージ内の位置（"data.content" のようなドット区切りのパス）、
+# "mime" にはペイロードのMIMEタイプを記述します。
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import base64
+import json
+import struct
+
+## pypiライブラリ
+
+## 自作モジュール
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+HEADER_LENGTH_FORMAT = ">I"
+HEADER_LENGTH_SIZE = struct.calcsize(HEADER_LENGTH_FORMAT)
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+def set_field(message: dict, path: str, value):
+    """
+    ドット区切りのパスで指定された位置に値を設定する関数。途中の辞書が無い場合は作成します。
+
+    Args:
+        message (dict): 値を設定する辞書。
+        path (str): "data.content" のようなドット区切りのパス。
+        value: 設定する値。
+    """
+    keys = path.split(".")
+    target = message
+    for key in keys[:-1]:
+        if not isinstance(target.get(key), dict):
+            target[key] = {}
+        target = target[key]
+    target[keys[-1]] = value
+
+def pack_frame(header: dict, payload: bytes) -> bytes:
+    """
+    ヘッダとペイロードをバイナリフレームにまとめる関数。
+
+    Args:
+        header (dict): JSONとしてシリアライズ可能なヘッダ。
+        payload (bytes): 生のバイト列。
+
+    Returns:
+        bytes: バイナリフレーム。
+    """
+    header_bytes = json.dumps(header).encode("utf-8")
+    return b"".join([struct.pack(HEADER_LENGTH_FORMAT, len(header_bytes)), header_bytes, payload])
+
+def unpack_frame(frame: bytes):
+    """
+    バイナリフレームをヘッダとペイロードに分解する関数。
+
+    Args:
+        frame (bytes): バイナリフレーム。
+
+    Returns:
+        tuple: ヘッダの辞書とペイロード（memoryview）のタプル。
+
+    Raises:
+        ValueError: フレームの形式が不正な場合。
+    """
+    if len(frame) < HEADER_LENGTH_SIZE:
+        raise ValueError("Binary frame is too short")
+    header_length = struct.unpack_from(HEADER_LENGTH_FORMAT, frame)[0]
+    header_end = HEADER_LENGTH_SIZE + header_length
+    if len(frame) < header_end:
+        raise ValueError("Binary frame header is truncated")
+    view = memoryview(frame)
+    header = json.loads(bytes(view[HEADER_LENGTH_SIZE:header_end]).decode("utf-8"))
+    return header, view[header_end:]
+
+def unpack_message(frame: bytes) -> dict:
+    """
+    バイナリフレームを受信メッセージの辞書に変換する関数。
+    ペイロードはヘッダの "field" で指定された位置に bytes として格納されます。
+
+    Args:
+        frame (bytes): バイナリフレーム。
+
+    Returns:
+        dict: JSONメッセージと同じ構造の辞書。
+
+    Raises:
+        ValueError: フレームの形式やヘッダが不正な場合。
+    """
+    header, payload = unpack_frame(frame)
+    if not isinstance(header, dict):
+        raise ValueError("Binary frame header must be an object")
+    field = header.pop("field", "payload")
+    if not isinstance(field, str) or not field:
+        raise ValueError("Binary frame field must be a non-empty string")
+    set_field(header, field, bytes(payload))
+    return header
+
+#######################################################################################
+# クラス
+class BinaryFrame:
+    """
+    生のバイト列を含む送信メッセージを表すクラス。
+
+    バイナリフレームを利用するクライアントにはヘッダとバイト列をそのまま送信し、
+    利用しないクライアントには "field" の位置にBase64（またはデータURL）を埋め込んだJSONメッセージとして送信します。
+    fallbackを指定した場合、利用しないクライアントにはペイロードを埋め込む代わりにそのメッセージ（URLなど）を送信します。
+    """
+
+    def __init__(self, header: dict, payload: bytes, field="data", mime="application/octet-stream", encoding="data_url",
+                 fallback=None):
+        """
+        BinaryFrameの初期化を行うコンストラクタ。
+
+        Args:
+            header (dict): メッセージのヘッダ（ペイロード以外の内容）。
+            payload (bytes): 送信する生のバイト列。
+            field (str): ペイロードを格納する位置を表すドット区切りのパス。
+            mime (str): ペイロードのMIMEタイプ。
+            encoding (str): JSONで送信する場合のエンコード方法。'data_url'または'base64'。
+            fallback (dict or None): バイナリフレームを利用しないクライアントに送信するメッセージ。省略時はペイロードを埋め込みます。
+        """
+        self.header = header
+        self.payload = payload
+        self.field = field
+        self.mime = mime
+        self.encoding = encoding
+        self.fallback = fallback
+
+    def __eq__(self, other):
+        if not isinstance(other, BinaryFrame):
+            return NotImplemented
+        return (self.header, self.field, self.mime, self.encoding, self.fallback, self.payload) == \
+            (other.header, other.field, other.mime, other.encoding, other.fallback, other.payload)
+
+    def to_bytes(self) -> bytes:
+        """
+        バイナリフレームに変換する関数。
+
+        Returns:
+            bytes: バイナリフレーム。
+        """
+        header = dict(self.header)
+        header["field"] = self.field
+        header["mime"] = self.mime
+        return pack_frame(header, self.payload)
+
+    def to_json_message(self) -> dict:
+        """
+        ペイロードをBase64（またはデータURL）として埋め込んだJSONメッセージに変換する関数。fallbackがある場合はそれを返します。
+
+        Returns:
+            dict: JSONとしてシリアライズ可能なメッセージ。
+        """
+        if self.fallback is not None:
+            return self.fallback
+        message = json.loads(json.dumps(self.header))
+        encoded = base64.b64encode(self.payload).decode("utf-8")
+        if self.encoding == "data_url":
+            encoded = f"data:{self.mime};base64,{encoded}"
+        set_field(message, self.field, encoded)
+        return message
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    frame = BinaryFrame({"type": "clipboard_download", "id": 0}, b"\x89PNG", mime="image/png")
+    print(unpack_message(frame.to_bytes()))
+    print(frame.to_json_message())
+    print(BinaryFrame({"type": "clipboard_download", "id": 0}, b"\x89PNG", mime="image/png",
+                      fallback={"type": "clipboard_download", "id": 0, "url": "/blob/digest"}).to_json_message())
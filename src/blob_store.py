@@ -0,0 +1,432 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# BlobStore モジュール
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import hashlib
+import os
+import re
+import threading
+
+## pypiライブラリ
+
+## 自作モジュール
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+BLOB_DIR = './blobs'
+SPILL_THRESHOLD = 1024 * 1024  # これより大きいデータはディスクに書き出す（バイト）
+READ_CHUNK_SIZE = 64 * 1024  # ストリーミング時の読み込み単位（バイト）
+SPILL_FILE_PATTERN = re.compile(r'[0-9a-f]{64}(\.tmp)?')  # BlobStoreが書き出すファイルの名前（ハッシュ値と書き込み途中の一時ファイル）
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+def compute_digest(data: bytes) -> str:
+    """
+    データのハッシュ値（SHA-256）を計算する関数。
+
+    Args:
+        data (bytes): ハッシュ値を計算するデータ。
+
+    Returns:
+        str: 16進数のハッシュ値。
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def parse_range_header(range_header: str, size: int):
+    """
+    HTTPのRangeヘッダ（単一範囲の "bytes=start-end" 形式）を解析する関数。
+
+    Args:
+        range_header (str): Rangeヘッダの値。
+        size (int): データ全体のサイズ。
+
+    Returns:
+        tuple: 開始位置と終了位置（終了位置を含む）のタプル。
+
+    Raises:
+        ValueError: 範囲の形式が不正、または満たせない範囲の場合。
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        raise ValueError(f"Unsupported range: {range_header}")
+    start_text, _, end_text = ranges.strip().partition("-")
+    if start_text:
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    else:
+        # "bytes=-500" は末尾500バイトを表す
+        length = int(end_text)
+        if length <= 0:
+            raise ValueError(f"Unsatisfiable range: {range_header}")
+        start = max(size - length, 0)
+        end = size - 1
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError(f"Unsatisfiable range: {range_header}")
+    return start, end
+
+#######################################################################################
+# クラス
+class BlobStore:
+    """
+    データをハッシュ値で管理するコンテンツアドレス型のストアクラス。
+
+    同じ内容のデータは1つだけ保持し、参照数で寿命を管理します。
+    小さなデータはメモリに、大きなデータはディスクに保存します。
+    """
+
+    def __init__(self, directory=BLOB_DIR, spill_threshold=SPILL_THRESHOLD, remove_orphans=True):
+        """
+        BlobStoreの初期化を行うコンストラクタ。
+
+        Args:
+            directory (str): ディスクに書き出したデータを保存するディレクトリ。
+            spill_threshold (int): このサイズ（バイト）を超えるデータをディスクに書き出します。
+            remove_orphans (bool): Trueの場合、前回の実行で書き出したまま残ったファイルを削除します。
+                起動後に add_file() で既存のファイルを登録して使うディレクトリではFalseを指定してください。
+
+        Attributes:
+            blobs (dict): ハッシュ値をキーとし、データ・パス・サイズ・MIMEタイプ・参照数・外部ファイルかどうかを保持する辞書。
+        """
+        self.directory = directory
+        self.spill_threshold = spill_threshold
+        self.lock = threading.Lock()
+        self.blobs = {}
+        if remove_orphans:
+            self._remove_orphan_files()
+
+    def _remove_orphan_files(self):
+        """
+        ディレクトリに残っている、書き出したデータのファイルを削除する関数。
+        データはメモリ上でのみ参照数を管理しているため、異常終了などで残ったファイルは以降参照されません。
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not SPILL_FILE_PATTERN.fullmatch(name):
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                print(f"Failed to remove orphaned blob file {name}: {e}")
+
+    def put(self, data: bytes, mime="application/octet-stream", spill=True) -> str:
+        """
+        データを保存し、参照数を1増やす関数。同じ内容のデータが既にある場合は再利用します。
+
+        Args:
+            data (bytes): 保存するデータ。
+            mime (str): データのMIMEタイプ。
+            spill (bool): Falseの場合、spill_thresholdを超えてもディスクに書き出さずにメモリに保持します。
+                他のモジュールが同じデータをファイルに保存し、adopt_file() で渡す場合に指定します。
+
+        Returns:
+            str: データのハッシュ値。
+        """
+        digest = compute_digest(data)
+        with self.lock:
+            if digest in self.blobs:
+                self.blobs[digest]["refs"] += 1
+                return digest
+            entry = {"data": None, "path": None, "size": len(data), "mime": mime, "refs": 1, "external": False}
+            if spill and len(data) > self.spill_threshold:
+                entry["path"] = self._write_file(digest, data)
+            else:
+                entry["data"] = bytes(data)
+            self.blobs[digest] = entry
+        return digest
+
+    def add_file(self, digest: str, path: str, size: int, mime="application/octet-stream", external=True):
+        """
+        ディスク上の既存のファイルを読み込まずに登録し、参照数を1増やす関数。
+        既定では登録したファイルは他のモジュールが管理するものとして扱い、参照が無くなっても削除しません。
+
+        Args:
+            digest (str): データのハッシュ値。
+            path (str): ファイルのパス。
+            size (int): データのサイズ（バイト）。
+            mime (str): データのMIMEタイプ。
+            external (bool): Falseの場合、put() で書き出したデータと同様に、参照が無くなった時にファイルを削除します。
+        """
+        with self.lock:
+            if digest in self.blobs:
+                self.blobs[digest]["refs"] += 1
+                return
+            self.blobs[digest] = {"data": None, "path": path, "size": size, "mime": mime, "refs": 1, "external": external}
+
+    def adopt_file(self, digest: str, path: str):
+        """
+        保持しているデータを、他のモジュールが同じ内容を保存したファイルから読み出すように切り替える関数。
+        メモリ上のデータや自身で書き出したファイルは破棄し、ディスク上のコピーを1つにします。
+        登録したファイルはadd_file() と同様に外部のファイルとして扱い、参照が無くなっても削除しません。
+
+        Args:
+            digest (str): データのハッシュ値。
+            path (str): 同じ内容を保存したファイルのパス。
+
+        Returns:
+            bool: 切り替えた場合はTrue。データが無い場合はFalse。
+        """
+        with self.lock:
+            entry = self.blobs.get(digest)
+            if entry is None:
+                return False
+            if entry["external"]:
+                return True
+            if entry["path"]:
+                # release() と同様に、同じ内容のput() と競合しないようlockを保持したまま削除する
+                try:
+                    os.remove(entry["path"])
+                except OSError as e:
+                    print(f"Failed to remove blob file {entry['path']}: {e}")
+            entry["data"] = None
+            entry["path"] = path
+            entry["external"] = True
+            return True
+
+    def retain(self, digest: str):
+        """
+        データの参照数を1増やす関数。
+
+        Args:
+            digest (str): データのハッシュ値。
+        """
+        with self.lock:
+            if digest in self.blobs:
+                self.blobs[digest]["refs"] += 1
+
+    def release(self, digest: str):
+        """
+        データの参照数を1減らし、参照が無くなったデータを削除する関数。
+
+        Args:
+            digest (str): データのハッシュ値。
+        """
+        with self.lock:
+            entry = self.blobs.get(digest)
+            if entry is None:
+                return
+            entry["refs"] -= 1
+            if entry["refs"] > 0:
+                return
+            del self.blobs[digest]
+            # ファイル名はハッシュ値なので、lockを解放した後に削除すると、同じ内容のput() で書き出し直したファイルを消してしまう
+            if entry["path"] and not entry["external"]:
+                try:
+                    os.remove(entry["path"])
+                except OSError as e:
+                    print(f"Failed to remove blob file {entry['path']}: {e}")
+
+    def acquire(self, digest: str):
+        """
+        データの参照数を1増やし、サイズとMIMEタイプと共に参照を取得する関数。
+        参照を保持している間は、他の参照が解放されてもデータは削除されません。
+
+        Args:
+            digest (str): データのハッシュ値。
+
+        Returns:
+            BlobLease or None: 取得した参照。使い終わったら release() を呼び出してください。データが無い場合はNone。
+        """
+        with self.lock:
+            entry = self.blobs.get(digest)
+            if entry is None:
+                return None
+            entry["refs"] += 1
+            info = {"size": entry["size"], "mime": entry["mime"]}
+        return BlobLease(self, digest, info)
+
+    def contains(self, digest: str) -> bool:
+        """
+        データが保存されているかを確認する関数。
+
+        Args:
+            digest (str): データのハッシュ値。
+
+        Returns:
+            bool: 保存されている場合はTrue。
+        """
+        with self.lock:
+            return digest in self.blobs
+
+    def get_info(self, digest: str):
+        """
+        データのサイズとMIMEタイプを取得する関数。
+
+        Args:
+            digest (str): データのハッシュ値。
+
+        Returns:
+            dict or None: 'size'と'mime'を含む辞書。データが無い場合はNone。
+        """
+        with self.lock:
+            entry = self.blobs.get(digest)
+            if entry is None:
+                return None
+            return {"size": entry["size"], "mime": entry["mime"]}
+
+    def get(self, digest: str):
+        """
+        データ全体を取得する関数。
+
+        Args:
+            digest (str): データのハッシュ値。
+
+        Returns:
+            bytes or None: 保存されているデータ。データが無い場合はNone。
+        """
+        with self.lock:
+            entry = self.blobs.get(digest)
+            if entry is None:
+                return None
+            if entry["data"] is not None:
+                return entry["data"]
+            path = entry["path"]
+        with open(path, "rb") as f:
+            return f.read()
+
+    def iter_range(self, digest: str, start=0, end=None, chunk_size=READ_CHUNK_SIZE):
+        """
+        データの指定範囲を少しずつ読み出すジェネレータ。
+
+        Args:
+            digest (str): データのハッシュ値。
+            start (int): 開始位置。
+            end (int or None): 終了位置（この位置を含む）。Noneの場合は末尾まで。
+            chunk_size (int): 1回に読み出すサイズ。
+
+        Yields:
+            bytes: 読み出したデータの断片。
+        """
+        with self.lock:
+            entry = self.blobs.get(digest)
+            if entry is None:
+                return
+            data = entry["data"]
+            path = entry["path"]
+            if end is None:
+                end = entry["size"] - 1
+        if data is not None:
+            view = memoryview(data)
+            for offset in range(start, end + 1, chunk_size):
+                yield bytes(view[offset:min(offset + chunk_size, end + 1)])
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def _write_file(self, digest: str, data: bytes) -> str:
+        """
+        データをディスクに書き出す関数。書き込み途中のファイルが参照されないよう、一時ファイルから置き換えます。
+
+        Args:
+            digest (str): データのハッシュ値。
+            data (bytes): 書き出すデータ。
+
+        Returns:
+            str: 書き出したファイルのパス。
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, digest)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return path
+
+
+class BlobLease:
+    """
+    BlobStore.acquire() で取得したデータの参照を表すクラス。
+
+    レスポンスの送信中などにデータが削除されないよう参照を保持し、release() で一度だけ解放します。
+    """
+
+    def __init__(self, store: BlobStore, digest: str, info: dict):
+        """
+        BlobLeaseの初期化を行うコンストラクタ。
+
+        Args:
+            store (BlobStore): データを保存しているBlobStore。
+            digest (str): データのハッシュ値。
+            info (dict): 'size'と'mime'を含む辞書。
+        """
+        self.store = store
+        self.digest = digest
+        self.info = info
+        self.lock = threading.Lock()
+        self.released = False
+
+    def iter_range(self, start=0, end=None, chunk_size=READ_CHUNK_SIZE):
+        """
+        データの指定範囲を少しずつ読み出し、読み終えた時（途中で中断された場合も）に参照を解放するジェネレータ。
+
+        Args:
+            start (int): 開始位置。
+            end (int or None): 終了位置（この位置を含む）。Noneの場合は末尾まで。
+            chunk_size (int): 1回に読み出すサイズ。
+
+        Yields:
+            bytes: 読み出したデータの断片。
+        """
+        try:
+            yield from self.store.iter_range(self.digest, start, end, chunk_size)
+        finally:
+            self.release()
+
+    def release(self):
+        """
+        参照を解放する関数。2回目以降の呼び出しでは何もしません。
+        """
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+        self.store.release(self.digest)
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    import tempfile
+
+    temp_directory = tempfile.TemporaryDirectory()
+    store = BlobStore(temp_directory.name, spill_threshold=4)
+    digest = store.put(b"hello world", "text/plain")
+    print(digest, store.get_info(digest))
+    print(b"".join(store.iter_range(digest, *parse_range_header("bytes=6-", 11))))
+    print(store.put(b"hello world") == digest, store.blobs[digest]["refs"])
+    # 参照を保持している間は、他の参照が全て解放されてもデータを読み出せる
+    lease = store.acquire(digest)
+    store.release(digest)
+    store.release(digest)
+    print(store.contains(digest), b"".join(lease.iter_range()), store.contains(digest))
+    lease.release()
+    print(store.acquire(digest))
+    # 前回の実行で残ったファイルは、次に作成したBlobStoreが削除する
+    store.put(b"left behind")
+    print(len(os.listdir(temp_directory.name)), len(os.listdir(BlobStore(temp_directory.name).directory)))
+    temp_directory.cleanup()
@@ -0,0 +1,800 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# ClipboardBackend モジュール
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+from subprocess import Popen, PIPE
+import io
+import struct
+import threading
+import time
+
+## pypiライブラリ
+from PIL import Image
+
+# Windows専用のライブラリ（インストールされていない環境ではMemoryClipboardBackendのみ使用可能）
+try:
+    import pyperclip
+    import pywintypes
+    import win32clipboard
+    import win32con
+except Exception:
+    pass
+
+## 自作モジュール
+try:
+    from src.keyboard_handler import InputHandler
+except Exception:
+    InputHandler = None
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+FORMAT_TEXT = 'text'
+FORMAT_FILES = 'files'
+FORMAT_IMAGE = 'image'
+FORMAT_DIB = 'dib'
+ENCODING_PNG = 'PNG'
+ENCODING_DIB = 'DIB'  # BMPファイルヘッダ（14バイト）を除いたBMP
+BMP_FILE_HEADER_SIZE = 14
+CHANGE_TIMEOUT = 1.0  # クリップボードの変更を待つ時間の上限（秒）
+CHANGE_POLL_INTERVAL = 0.005  # シーケンス番号を確認する間隔（秒）
+# ペースト操作を送ってからアプリケーションが読み取るまで待つ時間（秒）。以前の固定値（0.1秒）より短くしないこと。
+# Windowsではアプリケーションがクリップボードを読み取ったことを知る方法が無いため、ペーストは現在も固定時間の待ちです
+PASTE_GRACE = 0.15
+CLIPBOARD_OPEN_TIMEOUT = 0.5  # 他のアプリケーションがクリップボードを開いている間、開き直しを試みる時間の上限（秒）
+# 選択的バックアップ（明示的に指定した場合のみ）でバックアップする形式。CF_UNICODETEXT(13)、CF_HDROP(15)、"PNG"、CF_DIB(8)。
+# CF_BITMAPやCF_DIBV5などWindowsが自動で変換して提供する形式に加え、HTMLやリッチテキスト、アプリケーション独自の形式も
+# バックアップしないため、ペースト後に復元したクリップボードからはそれらが失われます。
+WINDOWS_BACKUP_FORMATS = (13, 15, "PNG", 8)
+CF_DIB = 8
+CF_HDROP = 15
+DROPFILES_FORMAT = '<IiiII'  # DROPFILES構造体（pFiles, pt.x, pt.y, fNC, fWide）
+DROPEFFECT_COPY = 1
+FILE_PASTE_NATIVE = 'native'  # DROPFILES構造体を直接クリップボードに設定する
+FILE_PASTE_POWERSHELL = 'powershell'  # PowerShellのSet-Clipboardを起動して設定する（比較用）
+
+#######################################################################################
+# 変数
+input_handler = InputHandler() if InputHandler is not None else None
+
+#######################################################################################
+# 関数
+def build_drop_files(files) -> bytes:
+    """
+    ファイルパスのリストから、CF_HDROP形式のデータ（DROPFILES構造体とNULL区切りのUTF-16パス）を作成する関数。
+
+    Args:
+        files (list): ファイルパスのリスト。
+
+    Returns:
+        bytes: CF_HDROP形式のデータ。
+    """
+    header = struct.pack(DROPFILES_FORMAT, struct.calcsize(DROPFILES_FORMAT), 0, 0, 0, 1)
+    # 各パスをNULLで区切り、最後にもう1つNULLを置いてリストの終わりを示す
+    paths = ''.join(f'{file}\0' for file in files) + '\0'
+    return header + paths.encode('utf-16-le')
+
+def encode_image_payload(image: Image.Image, encoding: str) -> bytes:
+    """
+    画像をクリップボードに設定する形式のバイト列にエンコードする関数。
+
+    Args:
+        image (PIL.Image.Image): エンコードする画像。
+        encoding (str): ENCODING_PNG または ENCODING_DIB。
+
+    Returns:
+        bytes: エンコードしたデータ。
+    """
+    with io.BytesIO() as output:
+        if encoding == ENCODING_DIB:
+            image.save(output, 'BMP')
+            return output.getbuffer()[BMP_FILE_HEADER_SIZE:].tobytes()
+        image.save(output, encoding)
+        return output.getvalue()
+
+def _copy_data(data):
+    """
+    クリップボードのデータを複製する関数。バイト列は内容を複製し、それ以外はそのまま返します。
+
+    Args:
+        data: クリップボードのデータ。
+
+    Returns:
+        複製したデータ。
+    """
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(memoryview(data))
+    return data
+
+#######################################################################################
+# クラス
+class ClipboardBackend:
+    """
+    システムクリップボードとキー入力を操作するバックエンドの基底クラス。
+
+    VirtualClipboardManagerはこのインターフェースを通してのみシステムクリップボードに触れるため、
+    実装を差し替えることでWindows以外の環境でもコピー・ペースト・バックアップ・復元の処理を実行できます。
+
+    Attributes:
+        selective_backup_formats (tuple or None): 選択的バックアップ（VirtualClipboardManagerのBACKUP_SELECTIVE_FORMATS）で
+            バックアップする形式。Noneの場合はすべての形式。コピー完了の判定で待つ形式としても使います。
+        image_payload_formats (dict): 画像を設定する時の、形式をキーとしエンコード方式を値とする辞書。
+        paste_grace (float): wait_for_paste() で、ペースト操作を送ってから待つ時間（秒）。
+    """
+
+    selective_backup_formats = None
+    image_payload_formats = {}
+    paste_grace = PASTE_GRACE
+
+    def get_text(self):
+        """
+        システムクリップボードのテキストを取得する関数。
+
+        Returns:
+            str: テキスト。テキストが無い場合は空文字列。
+        """
+        raise NotImplementedError
+
+    def set_text(self, text: str):
+        """
+        システムクリップボードにテキストを設定する関数。
+
+        Args:
+            text (str): 設定するテキスト。
+        """
+        raise NotImplementedError
+
+    def get_files(self):
+        """
+        システムクリップボードのファイルパスを取得する関数。
+
+        Returns:
+            tuple or None: ファイルパスのタプル。ファイルが無い場合はNone。
+        """
+        raise NotImplementedError
+
+    def set_files(self, files):
+        """
+        システムクリップボードにファイルパスを設定する関数。
+
+        Args:
+            files (list): 設定するファイルパスのリスト。
+        """
+        raise NotImplementedError
+
+    def get_image(self):
+        """
+        システムクリップボードの画像を取得する関数。
+
+        Returns:
+            PIL.Image.Image or None: 画像。画像が無い場合はNone。
+        """
+        raise NotImplementedError
+
+    def set_image(self, image: Image.Image):
+        """
+        システムクリップボードに画像を設定する関数。
+
+        Args:
+            image (PIL.Image.Image): 設定する画像。
+        """
+        self.set_image_payloads(self.encode_image_payloads(image))
+
+    def encode_image_payloads(self, image, executor=None, encoded=None):
+        """
+        画像をimage_payload_formatsの各形式にエンコードする関数。
+
+        Args:
+            image (PIL.Image.Image or None): エンコードする画像。encodedで全ての形式が揃う場合はNoneでも構いません。
+            executor (Executor or None): 各形式のエンコードを並行して実行するExecutor。Noneの場合は順に実行します。
+            encoded (dict or None): エンコード方式をキーとする、既にエンコードされたデータ。該当する形式はエンコードしません。
+
+        Returns:
+            dict: 形式をキーとし、エンコードしたデータを値とする辞書。
+        """
+        encoded = encoded or {}
+        pending = {clipboard_format: encoding for clipboard_format, encoding in self.image_payload_formats.items()
+                   if encoding not in encoded}
+        if executor is not None and len(pending) > 1:
+            futures = {clipboard_format: executor.submit(encode_image_payload, image, encoding)
+                       for clipboard_format, encoding in pending.items()}
+            results = {clipboard_format: future.result() for clipboard_format, future in futures.items()}
+        else:
+            results = {clipboard_format: encode_image_payload(image, encoding) for clipboard_format, encoding in pending.items()}
+        return {clipboard_format: results[clipboard_format] if clipboard_format in results else encoded[encoding]
+                for clipboard_format, encoding in self.image_payload_formats.items()}
+
+    def set_image_payloads(self, payloads: dict):
+        """
+        エンコード済みの画像をシステムクリップボードに設定する関数。
+
+        Args:
+            payloads (dict): encode_image_payloads() で作成した、形式をキーとする辞書。
+        """
+        raise NotImplementedError
+
+    def enumerate_formats(self):
+        """
+        システムクリップボードにある形式を列挙する関数。
+
+        Returns:
+            list: 形式のリスト。
+        """
+        raise NotImplementedError
+
+    def backup(self, formats=None):
+        """
+        システムクリップボードの内容をバックアップする関数。
+
+        Args:
+            formats (tuple or None): バックアップする形式。Noneの場合はすべての形式をバックアップします。
+
+        Returns:
+            dict: 形式をキーとするバックアップデータ。
+        """
+        raise NotImplementedError
+
+    def restore(self, clipboard_data: dict):
+        """
+        システムクリップボードの内容をバックアップから復元する関数。
+
+        Args:
+            clipboard_data (dict): backup() で取得したバックアップデータ。
+        """
+        raise NotImplementedError
+
+    def get_sequence_number(self):
+        """
+        システムクリップボードの内容が変わるたびに増加する番号を取得する関数。
+
+        Returns:
+            int: シーケンス番号。
+        """
+        raise NotImplementedError
+
+    def send_copy(self):
+        """
+        前面のアプリケーションにコピー操作（Ctrl+C）を送る関数。
+        """
+        raise NotImplementedError
+
+    def send_paste(self):
+        """
+        前面のアプリケーションにペースト操作（Ctrl+V）を送る関数。
+        """
+        raise NotImplementedError
+
+    def settle(self, seconds: float):
+        """
+        キー入力やクリップボードの変更が反映されるまで待つ関数。
+
+        Args:
+            seconds (float): 待つ時間（秒）。
+        """
+        time.sleep(seconds)
+
+    def wait_for_change(self, sequence_number: int, timeout=CHANGE_TIMEOUT):
+        """
+        シーケンス番号が指定した値から変わるまで待つ関数。既定ではシーケンス番号を短い間隔で確認します。
+
+        Args:
+            sequence_number (int): 待ち始める前に取得したシーケンス番号。
+            timeout (float): 待つ時間の上限（秒）。
+
+        Returns:
+            bool: 時間内に変わった場合はTrue。
+        """
+        deadline = time.perf_counter() + timeout
+        while self.get_sequence_number() == sequence_number:
+            if time.perf_counter() >= deadline:
+                return False
+            time.sleep(CHANGE_POLL_INTERVAL)
+        return True
+
+    def wait_for_ready(self, formats=None, timeout=CHANGE_TIMEOUT):
+        """
+        コピー操作でシーケンス番号が変わった後、コピー元のアプリケーションがデータを設定し終えるまで待つ関数。
+        シーケンス番号はコピー元がクリップボードを空にした時点で変わるため、その直後はまだデータが無い場合があります。
+        既定では、指定した形式のいずれかが読み取れるようになるまで短い間隔で確認します。
+
+        Args:
+            formats (tuple or None): 待つ形式。いずれか1つがあれば完了とします。省略時はselective_backup_formats。
+            timeout (float): 待つ時間の上限（秒）。
+
+        Returns:
+            bool: 時間内にデータが読み取れるようになった場合はTrue。
+        """
+        deadline = time.perf_counter() + timeout
+        while not self.has_formats(formats):
+            if time.perf_counter() >= deadline:
+                return False
+            time.sleep(CHANGE_POLL_INTERVAL)
+        return True
+
+    def has_formats(self, formats=None) -> bool:
+        """
+        指定した形式のいずれかがシステムクリップボードにあるか確認する関数。
+
+        Args:
+            formats (tuple or None): 確認する形式。省略時はselective_backup_formats、それも無い場合はすべての形式。
+
+        Returns:
+            bool: いずれかの形式がある場合はTrue。
+        """
+        if formats is None:
+            formats = self.selective_backup_formats
+        available = self.enumerate_formats()
+        if formats is None:
+            return bool(available)
+        return any(clipboard_format in available for clipboard_format in formats)
+
+    def wait_for_paste(self, timeout=CHANGE_TIMEOUT):
+        """
+        send_paste() で送ったペースト操作を、前面のアプリケーションが処理し終えるまで待つ関数。
+        クリップボードの読み取りは通知されないため、既定の実装は完了を確認せずにpaste_graceだけ待つ固定時間の待ちです。
+        読み取りを検知できるバックエンド（MemoryClipboardBackendなど）のみ、処理され次第戻ります。
+
+        Args:
+            timeout (float): 待つ時間の上限（秒）。
+
+        Returns:
+            bool: 時間内に処理された場合はTrue。
+        """
+        time.sleep(min(self.paste_grace, timeout))
+        return True
+
+
+class WindowsClipboardBackend(ClipboardBackend):
+    """
+    win32clipboardとpyperclip、キー入力のエミュレーションでWindowsのシステムクリップボードを操作するバックエンドクラス。
+    形式は数値のIDまたは登録済みの形式名（"PNG"など）で指定します。
+    """
+
+    selective_backup_formats = WINDOWS_BACKUP_FORMATS
+    image_payload_formats = {"PNG": ENCODING_PNG, CF_DIB: ENCODING_DIB}
+
+    def __init__(self, input_handler=input_handler, file_paste_method=FILE_PASTE_NATIVE, paste_grace=PASTE_GRACE,
+                 open_timeout=CLIPBOARD_OPEN_TIMEOUT):
+        """
+        WindowsClipboardBackendの初期化を行うコンストラクタ。
+
+        Args:
+            input_handler (InputHandler): キー入力を送るInputHandler。
+            file_paste_method (str): ファイルパスの設定方法。FILE_PASTE_NATIVE または FILE_PASTE_POWERSHELL。
+            paste_grace (float): ペースト操作を送ってから、アプリケーションが読み取り終えるまで待つ時間（秒）。
+            open_timeout (float): 他のアプリケーションがクリップボードを開いている間、開き直しを試みる時間の上限（秒）。
+        """
+        self.input_handler = input_handler
+        self.file_paste_method = file_paste_method
+        self.paste_grace = paste_grace
+        self.open_timeout = open_timeout
+
+    def open_clipboard(self, timeout=None):
+        """
+        クリップボードを開く関数。他のアプリケーションが開いている場合は、閉じられるまで開き直しを試みます。
+
+        Args:
+            timeout (float or None): 開き直しを試みる時間の上限（秒）。省略時はopen_timeout。
+
+        Raises:
+            pywintypes.error: 時間内に開けなかった場合。
+        """
+        deadline = time.perf_counter() + (self.open_timeout if timeout is None else timeout)
+        while True:
+            try:
+                win32clipboard.OpenClipboard()
+                return
+            except pywintypes.error:
+                if time.perf_counter() >= deadline:
+                    raise
+                time.sleep(CHANGE_POLL_INTERVAL)
+
+    def has_formats(self, formats=None):
+        if formats is None:
+            formats = self.selective_backup_formats
+        # コピー元がクリップボードを開いている間（データの設定中）は開けないため、待たずに未完了として扱う
+        try:
+            self.open_clipboard(timeout=0)
+        except pywintypes.error:
+            return False
+        try:
+            if formats is None:
+                return win32clipboard.CountClipboardFormats() > 0
+            for clipboard_format in formats:
+                format_id = win32clipboard.RegisterClipboardFormat(clipboard_format) if isinstance(clipboard_format, str) else clipboard_format
+                if win32clipboard.IsClipboardFormatAvailable(format_id):
+                    return True
+            return False
+        finally:
+            win32clipboard.CloseClipboard()
+
+    def get_text(self):
+        return pyperclip.paste()
+
+    def set_text(self, text: str):
+        pyperclip.copy(text)
+
+    def get_files(self):
+        self.open_clipboard()
+        try:
+            file_path = win32clipboard.GetClipboardData(win32con.CF_HDROP)
+        except TypeError:
+            file_path = None
+        win32clipboard.CloseClipboard()
+        return file_path
+
+    def set_files(self, files):
+        if self.file_paste_method == FILE_PASTE_POWERSHELL:
+            self.set_files_powershell(files)
+        else:
+            self.set_files_native(files)
+
+    def set_files_native(self, files):
+        """
+        DROPFILES構造体を作成し、プロセスを起動せずにファイルパスをクリップボードに設定する関数。
+        エクスプローラーでのペーストがコピーとして扱われるよう、"Preferred DropEffect" も設定します。
+
+        Args:
+            files (list): 設定するファイルパスのリスト。
+        """
+        self.open_clipboard()
+        try:
+            win32clipboard.EmptyClipboard()
+            win32clipboard.SetClipboardData(win32con.CF_HDROP, build_drop_files(files))
+            drop_effect_format = win32clipboard.RegisterClipboardFormat("Preferred DropEffect")
+            win32clipboard.SetClipboardData(drop_effect_format, struct.pack('<I', DROPEFFECT_COPY))
+        finally:
+            win32clipboard.CloseClipboard()
+
+    def set_files_powershell(self, files):
+        """
+        PowerShellのSet-Clipboardを起動してファイルパスをクリップボードに設定する関数。
+
+        Args:
+            files (list): 設定するファイルパスのリスト。
+        """
+        powershell_command = 'powershell -Command "& { Set-Clipboard -LiteralPath ' + ','.join(['"{}"'.format(file) for file in files]) + ' }"'
+        process = Popen(powershell_command, shell=True, stdout=PIPE, stderr=PIPE)
+        process.communicate()
+
+    def get_image(self):
+        self.open_clipboard()
+        # クリップボードにある最初のフォーマットを取得
+        format_id = win32clipboard.EnumClipboardFormats(0)
+
+        # クリップボード内のすべてのフォーマットを列挙
+        while format_id:
+            try:
+                # フォーマットIDに対応する名前を取得
+                format_name = win32clipboard.GetClipboardFormatName(format_id)
+                if format_name:
+                    print(f"Format ID: {format_id}, Format Name: {format_name}")
+                else:
+                    print(f"Format ID: {format_id}, Format Name: (Standard format)")
+
+                # 次のフォーマットIDを取得
+                format_id = win32clipboard.EnumClipboardFormats(format_id)
+            except Exception as e:
+                # print(f"Error in EnumClipboardFormats: {e}")
+                break
+
+        try:
+            # クリップボードのPNGフォーマットIDを使用してデータを取得
+            png_format = 49532  # 先ほど列挙したIDをここに指定
+
+            if win32clipboard.IsClipboardFormatAvailable(png_format):
+                data = win32clipboard.GetClipboardData(png_format)
+            else:
+            # PNGが取得できなければCF_DIB形式を試す
+                if win32clipboard.IsClipboardFormatAvailable(win32con.CF_DIB):
+                    data = win32clipboard.GetClipboardData(win32con.CF_DIB)
+                else:
+                    data = None # 画像データが見つからない場合はNoneを返す
+        except TypeError:
+            data = None
+        win32clipboard.CloseClipboard()
+
+        if data:
+            image = Image.open(io.BytesIO(data))
+            if image.mode == 'RGBA':
+                # BMP形式で透過情報を保持
+                return image.convert("RGBA")
+            else:
+                # 透過情報が無い場合
+                return image.convert("RGB")
+        return None
+
+    def set_image_payloads(self, payloads: dict):
+        # クリップボードを開いて内容をクリア
+        self.open_clipboard()
+        win32clipboard.EmptyClipboard()
+
+        try:
+            for clipboard_format, data in payloads.items():
+                # "PNG"などの形式名は登録済みの形式IDに変換して設定する
+                if isinstance(clipboard_format, str):
+                    clipboard_format = win32clipboard.RegisterClipboardFormat(clipboard_format)
+                win32clipboard.SetClipboardData(clipboard_format, data)
+
+        except Exception as e:
+            print(f"Failed to set clipboard data: {e}")
+        finally:
+            win32clipboard.CloseClipboard()
+
+    def enumerate_formats(self):
+        self.open_clipboard()
+        formats = []
+        try:
+            format_id = win32clipboard.EnumClipboardFormats(0)
+            while format_id:
+                formats.append(format_id)
+                format_id = win32clipboard.EnumClipboardFormats(format_id)
+        finally:
+            win32clipboard.CloseClipboard()
+        return formats
+
+    def backup(self, formats=None):
+        self.open_clipboard()
+        clipboard_data = {}
+        format_id = 0
+
+        try:
+            if formats is not None:
+                # 指定した形式のうち、クリップボードにあるものだけを読み取る
+                for clipboard_format in formats:
+                    format_id = win32clipboard.RegisterClipboardFormat(clipboard_format) if isinstance(clipboard_format, str) else clipboard_format
+                    if not win32clipboard.IsClipboardFormatAvailable(format_id):
+                        continue
+                    try:
+                        clipboard_data[format_id] = win32clipboard.GetClipboardData(format_id)
+                    except TypeError:
+                        pass
+                win32clipboard.CloseClipboard()
+                return clipboard_data
+
+            format_id = win32clipboard.EnumClipboardFormats(0)
+            while format_id:
+                try:
+                    data = win32clipboard.GetClipboardData(format_id)
+                    clipboard_data[format_id] = data
+                except TypeError:
+                    pass
+                format_id = win32clipboard.EnumClipboardFormats(format_id)
+
+            win32clipboard.CloseClipboard()
+        except Exception as e:
+            print(f"Error in backup_clipboard: {e}")
+            time.sleep(0.1)
+            win32clipboard.CloseClipboard()
+
+        return clipboard_data
+
+    def restore(self, clipboard_data: dict):
+        self.open_clipboard()
+        try:
+            win32clipboard.EmptyClipboard()
+
+            for format_id, data in clipboard_data.items():
+                try:
+                    if format_id == CF_HDROP and isinstance(data, (list, tuple)):
+                        # GetClipboardDataはCF_HDROPをパスのタプルで返すため、DROPFILES構造体に戻す
+                        data = build_drop_files(data)
+                    win32clipboard.SetClipboardData(format_id, data)
+                except Exception as e:
+                    print(f"Failed to restore format {format_id}: {e}")
+        finally:
+            win32clipboard.CloseClipboard()
+
+    def get_sequence_number(self):
+        return win32clipboard.GetClipboardSequenceNumber()
+
+    def send_copy(self):
+        self.input_handler.execute_action('ctrl+c')
+
+    def send_paste(self):
+        self.input_handler.execute_action('ctrl+v')
+
+
+class MemoryClipboardBackend(ClipboardBackend):
+    """
+    メモリ上でシステムクリップボードと前面のアプリケーションを模擬するバックエンドクラス。
+
+    Windows以外の環境での負荷試験やベンチマークに使用します。
+    send_copy() は selection に設定した内容をクリップボードにコピーし、
+    send_paste() はクリップボードの内容を pasted に記録します。
+    copy_delay、paste_delayを指定すると、アプリケーションがその時間だけ遅れて処理する状況を模擬します。
+    fill_delayを指定すると、コピー元がクリップボードを空にして（シーケンス番号が変わって）から
+    データを設定するまでに時間がかかる状況を模擬します。
+    """
+
+    selective_backup_formats = (FORMAT_TEXT, FORMAT_FILES, FORMAT_IMAGE, FORMAT_DIB)
+    image_payload_formats = {FORMAT_IMAGE: ENCODING_PNG, FORMAT_DIB: ENCODING_DIB}
+
+    def __init__(self, settle_scale=1.0, copy_delay=0.0, paste_delay=0.0, fill_delay=0.0):
+        """
+        MemoryClipboardBackendの初期化を行うコンストラクタ。
+
+        Args:
+            settle_scale (float): settle() で待つ時間の倍率。0の場合は待たずに処理します。
+            copy_delay (float): send_copy() からクリップボードが変わるまでの時間（秒）。
+            paste_delay (float): send_paste() からクリップボードが読み取られるまでの時間（秒）。
+            fill_delay (float): send_copy() でクリップボードを空にしてから、データを設定するまでの時間（秒）。
+
+        Attributes:
+            formats (dict): クリップボードの内容。形式（FORMAT_TEXT、FORMAT_FILES、FORMAT_IMAGE、FORMAT_DIB）をキーとする辞書。
+            selection (dict): 前面のアプリケーションで選択されている内容。formatsと同じ形式の辞書。
+            pasted (list): ペーストされた内容（formatsの複製）のリスト。
+            sequence_number (int): クリップボードの内容が変わるたびに増加する番号。
+        """
+        self.settle_scale = settle_scale
+        self.copy_delay = copy_delay
+        self.paste_delay = paste_delay
+        self.fill_delay = fill_delay
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.formats = {FORMAT_TEXT: ''}
+        self.selection = {}
+        self.pasted = []
+        self.sequence_number = 0
+        self.paste_requests = 0
+
+    def _replace(self, formats: dict):
+        """
+        クリップボードの内容を置き換え、シーケンス番号を進める関数。
+
+        Args:
+            formats (dict): 新しい内容。
+        """
+        with self.changed:
+            self.formats = dict(formats)
+            self.sequence_number += 1
+            self.changed.notify_all()
+
+    def get_text(self):
+        with self.lock:
+            return self.formats.get(FORMAT_TEXT, '')
+
+    def set_text(self, text: str):
+        self._replace({FORMAT_TEXT: text})
+
+    def get_files(self):
+        with self.lock:
+            return self.formats.get(FORMAT_FILES)
+
+    def set_files(self, files):
+        self._replace({FORMAT_FILES: tuple(files)})
+
+    def get_image(self):
+        with self.lock:
+            data = self.formats.get(FORMAT_IMAGE)
+        if data is None:
+            return None
+        image = Image.open(io.BytesIO(data))
+        return image.convert("RGBA" if image.mode == 'RGBA' else "RGB")
+
+    def set_image_payloads(self, payloads: dict):
+        # 実際のクリップボードと同様に、エンコードしたデータを保持する
+        self._replace(dict(payloads))
+
+    def enumerate_formats(self):
+        with self.lock:
+            return list(self.formats)
+
+    def backup(self, formats=None):
+        # 実際のクリップボードと同様に、読み取ったデータは複製する
+        with self.lock:
+            return {clipboard_format: _copy_data(data) for clipboard_format, data in self.formats.items()
+                    if formats is None or clipboard_format in formats}
+
+    def restore(self, clipboard_data: dict):
+        self._replace({clipboard_format: _copy_data(data) for clipboard_format, data in clipboard_data.items()})
+
+    def get_sequence_number(self):
+        with self.lock:
+            return self.sequence_number
+
+    def send_copy(self):
+        if self.selection:
+            if self.fill_delay > 0:
+                self._run_later(self.copy_delay, self._fill_later, dict(self.selection))
+            else:
+                self._run_later(self.copy_delay, self._replace, dict(self.selection))
+
+    def _fill_later(self, formats: dict):
+        """
+        コピー元のアプリケーションがクリップボードを空にし、fill_delay後にデータを設定する処理を模擬する関数。
+
+        Args:
+            formats (dict): 設定する内容。
+        """
+        self._replace({})
+        self._run_later(self.fill_delay, self._replace, formats)
+
+    def send_paste(self):
+        with self.lock:
+            self.paste_requests += 1
+        self._run_later(self.paste_delay, self._read_for_paste)
+
+    def _read_for_paste(self):
+        """
+        アプリケーションがペーストのためにクリップボードを読み取る処理を模擬する関数。
+        """
+        with self.changed:
+            self.pasted.append(dict(self.formats))
+            self.changed.notify_all()
+
+    def _run_later(self, delay: float, func, *args):
+        """
+        関数を指定した時間の後に別スレッドで実行する関数。0以下の場合はすぐに実行します。
+
+        Args:
+            delay (float): 遅らせる時間（秒）。
+            func (Callable): 実行する関数。
+            *args: 関数に渡す引数。
+        """
+        if delay > 0:
+            timer = threading.Timer(delay, func, args)
+            timer.daemon = True
+            timer.start()
+        else:
+            func(*args)
+
+    def settle(self, seconds: float):
+        if self.settle_scale > 0:
+            time.sleep(seconds * self.settle_scale)
+
+    def wait_for_change(self, sequence_number: int, timeout=CHANGE_TIMEOUT):
+        with self.changed:
+            return self.changed.wait_for(lambda: self.sequence_number != sequence_number, timeout)
+
+    def wait_for_ready(self, formats=None, timeout=CHANGE_TIMEOUT):
+        with self.changed:
+            return self.changed.wait_for(lambda: self._has_formats_locked(formats), timeout)
+
+    def has_formats(self, formats=None):
+        with self.lock:
+            return self._has_formats_locked(formats)
+
+    def _has_formats_locked(self, formats=None):
+        """
+        指定した形式のいずれかがクリップボードにあるか確認する関数（lockを取得した状態で呼び出す）。
+
+        Args:
+            formats (tuple or None): 確認する形式。省略時はselective_backup_formats。
+
+        Returns:
+            bool: いずれかの形式がある場合はTrue。
+        """
+        if formats is None:
+            formats = self.selective_backup_formats
+        return any(clipboard_format in self.formats for clipboard_format in formats)
+
+    def wait_for_paste(self, timeout=CHANGE_TIMEOUT):
+        with self.changed:
+            return self.changed.wait_for(lambda: len(self.pasted) >= self.paste_requests, timeout)
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    backend = MemoryClipboardBackend(settle_scale=0, copy_delay=0.02, paste_delay=0.02, fill_delay=0.02)
+    backend.set_text("original")
+    saved = backend.backup()
+    backend.selection = {FORMAT_TEXT: "selected"}
+    sequence = backend.get_sequence_number()
+    backend.send_copy()
+    # シーケンス番号はクリップボードを空にした時点で変わるため、データが設定されるまで待ってから読み取る
+    print(backend.wait_for_change(sequence), repr(backend.get_text()), backend.wait_for_ready(), backend.get_text())
+    backend.restore(saved)
+    backend.send_paste()
+    print(backend.wait_for_paste(), backend.pasted, backend.get_sequence_number())
@@ -0,0 +1,209 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# Clipboard ベンチマーク モジュール
+# MemoryClipboardBackendを使い、VirtualClipboardManagerのコピー・ペーストを繰り返して操作ごとの処理時間を計測します。
+# 固定時間の待ち（fixed）とシステムクリップボードの変化を待つ方式（sequence）を比較できます。
+# 使い方: python -m src.clipboard_benchmark --cycles 100 --copy-delay 0.01 --paste-delay 0.01
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import argparse
+from contextlib import redirect_stdout
+import os
+import tempfile
+
+## pypiライブラリ
+from PIL import Image
+
+## 自作モジュール
+from src.clipboard_backend import MemoryClipboardBackend, WindowsClipboardBackend, build_drop_files
+from src.clipboard_backend import FORMAT_TEXT, FORMAT_FILES, FORMAT_IMAGE, FILE_PASTE_NATIVE, FILE_PASTE_POWERSHELL
+from src.clipboard_manager import VirtualClipboardManager, WAIT_MODE_FIXED, WAIT_MODE_SEQUENCE, BACKUP_SELECTIVE_FORMATS
+from src.blob_store import BlobStore
+from src.latency_stats import LatencyRecorder
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+DEFAULT_CYCLES = 100  # 固定時間の待ちを含めて数分で終わる回数。sequenceのみなら --cycles 5000 なども可能
+DEFAULT_SLOTS = 10
+DEFAULT_IMAGE_SIZE = 512
+CONTENT_TYPES = ('text', 'file', 'image')
+WAIT_MODES = (WAIT_MODE_FIXED, WAIT_MODE_SEQUENCE)
+DEFAULT_APP_DELAY = 0.01  # 模擬するアプリケーションがコピー・ペーストを処理するまでの時間（秒）
+DEFAULT_FILE_COUNT = 20
+SYNTHESIZED_FORMAT = 'bitmap'  # Windowsが画像から自動で提供する形式（CF_BITMAPなど）を模擬する形式名
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+def create_selection(content_type: str, cycle: int, image_size: int):
+    """
+    前面のアプリケーションで選択されている内容を作成する関数。
+
+    Args:
+        content_type (str): 'text'、'file'、'image'のいずれか。
+        cycle (int): 繰り返しの番号。内容を毎回変えるために使用します。
+        image_size (int): 画像の一辺のサイズ（ピクセル）。
+
+    Returns:
+        dict: MemoryClipboardBackend.selection に設定する辞書。
+    """
+    if content_type == 'text':
+        return {FORMAT_TEXT: f"benchmark text {cycle}\n" * 8}
+    if content_type == 'file':
+        return {FORMAT_FILES: (f"C:\\bench\\file_{cycle}.txt", f"C:\\bench\\image_{cycle}.png")}
+    image = Image.new('RGB', (image_size, image_size), (cycle % 256, 128, 255 - cycle % 256))
+    backend = MemoryClipboardBackend(settle_scale=0)
+    backend.set_image(image)
+    return {FORMAT_IMAGE: backend.formats[FORMAT_IMAGE]}
+
+def run_benchmark(cycles=DEFAULT_CYCLES, num_slots=DEFAULT_SLOTS, content_types=CONTENT_TYPES,
+                  image_size=DEFAULT_IMAGE_SIZE, settle_scale=1.0, wait_modes=WAIT_MODES,
+                  copy_delay=DEFAULT_APP_DELAY, paste_delay=DEFAULT_APP_DELAY, recorder=None,
+                  user_clipboard_size=0, backup_formats=None, pastes_per_copy=1, encode_workers=None,
+                  fill_delay=0.0):
+    """
+    コピーとペーストを繰り返し、待ち方とコンテンツの種類ごとに処理時間を計測する関数。
+    操作名は "待ち方:操作_種類"（例: "sequence:paste_text"）として記録します。
+
+    Args:
+        cycles (int): コンテンツの種類ごとの繰り返し回数。
+        num_slots (int): 仮想クリップボードの数。
+        content_types (tuple): 計測するコンテンツの種類。
+        image_size (int): 画像の一辺のサイズ（ピクセル）。
+        settle_scale (float): 固定時間の待ちの倍率。1で実際の待ち時間、0で待たずに処理そのものの時間を計測します。
+        wait_modes (tuple): 計測する待ち方。
+        copy_delay (float): 模擬するアプリケーションがコピーを処理するまでの時間（秒）。
+        paste_delay (float): 模擬するアプリケーションがペーストを処理するまでの時間（秒）。
+        recorder (LatencyRecorder or None): 計測結果を記録するLatencyRecorder。省略時は新たに作成します。
+        user_clipboard_size (int): 開始時にシステムクリップボードに置いておく画像データのサイズ（バイト）。
+            自動で提供される形式として、その3倍のサイズのデータも置きます。
+        backup_formats (tuple, str or None): VirtualClipboardManagerに渡すバックアップする形式。Noneの場合はすべての形式（既定）。
+        pastes_per_copy (int): 1回のコピーごとに同じ内容をペーストする回数。2回目以降はエンコード済みの画像を再利用します。
+        encode_workers (int or None): ペースト用の画像を並行してエンコードするスレッド数。Noneの場合は既定値。
+        fill_delay (float): 模擬するアプリケーションがクリップボードを空にしてからデータを設定するまでの時間（秒）。
+
+    Returns:
+        LatencyRecorder: 計測結果。
+    """
+    recorder = recorder if recorder is not None else LatencyRecorder()
+    # ログ出力の時間を計測に含めないよう、標準出力を捨てる
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for wait_mode in wait_modes:
+            backend = MemoryClipboardBackend(settle_scale=settle_scale, copy_delay=copy_delay, paste_delay=paste_delay,
+                                             fill_delay=fill_delay)
+            options = {} if encode_workers is None else {"image_encode_workers": encode_workers}
+            manager = VirtualClipboardManager(num_slots, blob_store=BlobStore(remove_orphans=False), backend=backend, wait_mode=wait_mode,
+                                              backup_formats=backup_formats, **options)
+            if user_clipboard_size > 0:
+                backend.restore({FORMAT_IMAGE: bytes(user_clipboard_size), SYNTHESIZED_FORMAT: bytes(user_clipboard_size * 3)})
+            for content_type in content_types:
+                for cycle in range(cycles):
+                    index = cycle % num_slots
+                    backend.selection = create_selection(content_type, cycle, image_size)
+                    with recorder.measure(f"{wait_mode}:copy_{content_type}"):
+                        manager.copy_clipboard_auto(index)
+                    with recorder.measure(f"{wait_mode}:paste_{content_type}"):
+                        manager.paste_clipboard(index)
+                    for _ in range(pastes_per_copy - 1):
+                        with recorder.measure(f"{wait_mode}:repaste_{content_type}"):
+                            manager.paste_clipboard(index)
+    return recorder
+
+def run_file_paste_benchmark(cycles=DEFAULT_CYCLES, file_count=DEFAULT_FILE_COUNT, recorder=None):
+    """
+    ファイルパスをシステムクリップボードに設定する処理を、DROPFILES構造体を直接設定する方法と
+    PowerShellを起動する方法で比較する関数。
+    Windows以外の環境ではDROPFILES構造体の作成時間のみを計測します。
+
+    Args:
+        cycles (int): 方法ごとの繰り返し回数。
+        file_count (int): 設定するファイルの数。
+        recorder (LatencyRecorder or None): 計測結果を記録するLatencyRecorder。省略時は新たに作成します。
+
+    Returns:
+        LatencyRecorder: 計測結果。
+    """
+    recorder = recorder if recorder is not None else LatencyRecorder()
+    with tempfile.TemporaryDirectory() as directory:
+        # PowerShellのSet-Clipboardは存在するパスしか受け付けないため、実際にファイルを作成する
+        files = []
+        for i in range(file_count):
+            path = os.path.join(directory, f"file_{i}.txt")
+            with open(path, 'w') as f:
+                f.write(str(i))
+            files.append(path)
+
+        for cycle in range(cycles):
+            with recorder.measure(f"{FILE_PASTE_NATIVE}:build_drop_files"):
+                build_drop_files(files)
+
+        if os.name != 'nt':
+            print("Skipped set_files: the system clipboard is only available on Windows")
+            return recorder
+        for method in (FILE_PASTE_NATIVE, FILE_PASTE_POWERSHELL):
+            backend = WindowsClipboardBackend(file_paste_method=method)
+            try:
+                # 1回目は計測に含めず、使用できるかを確認する
+                backend.set_files(files)
+            except Exception as e:
+                print(f"Skipped {method}:set_files: {e}")
+                continue
+            for cycle in range(cycles):
+                with recorder.measure(f"{method}:set_files"):
+                    backend.set_files(files)
+    return recorder
+
+#######################################################################################
+# クラス
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="VirtualClipboardManagerのコピー・ペーストのベンチマーク")
+    parser.add_argument("--cycles", type=int, default=DEFAULT_CYCLES, help="コンテンツの種類ごとの繰り返し回数")
+    parser.add_argument("--slots", type=int, default=DEFAULT_SLOTS, help="仮想クリップボードの数")
+    parser.add_argument("--types", default=",".join(CONTENT_TYPES), help="計測するコンテンツの種類（カンマ区切り）")
+    parser.add_argument("--image-size", type=int, default=DEFAULT_IMAGE_SIZE, help="画像の一辺のサイズ（ピクセル）")
+    parser.add_argument("--settle-scale", type=float, default=1.0, help="固定の待ち時間の倍率（1で実際の待ち時間）")
+    parser.add_argument("--modes", default=",".join(WAIT_MODES), help="計測する待ち方（カンマ区切り）")
+    parser.add_argument("--copy-delay", type=float, default=DEFAULT_APP_DELAY, help="アプリケーションがコピーを処理するまでの時間（秒）")
+    parser.add_argument("--fill-delay", type=float, default=0.0, help="アプリケーションがクリップボードを空にしてからデータを設定するまでの時間（秒）")
+    parser.add_argument("--paste-delay", type=float, default=DEFAULT_APP_DELAY, help="アプリケーションがペーストを処理するまでの時間（秒）")
+    parser.add_argument("--histogram", action="store_true", help="操作ごとのヒストグラムを表示する")
+    parser.add_argument("--user-clipboard-mb", type=float, default=0, help="開始時にシステムクリップボードに置く画像のサイズ（MB）")
+    parser.add_argument("--selective-backup", action="store_true", help="バックエンドの選択した形式のみをバックアップする（比較用）")
+    parser.add_argument("--pastes-per-copy", type=int, default=1, help="1回のコピーごとに同じ内容をペーストする回数")
+    parser.add_argument("--encode-workers", type=int, default=None, help="ペースト用の画像を並行してエンコードするスレッド数（1で順に実行）")
+    parser.add_argument("--file-paste", action="store_true", help="ファイルパスの設定方法（native / powershell）を比較する")
+    parser.add_argument("--file-count", type=int, default=DEFAULT_FILE_COUNT, help="--file-paste で設定するファイルの数")
+    args = parser.parse_args()
+
+    if args.file_paste:
+        result = run_file_paste_benchmark(args.cycles, args.file_count)
+        print(result.format_table())
+        raise SystemExit
+
+    result = run_benchmark(args.cycles, args.slots, tuple(args.types.split(",")), args.image_size, args.settle_scale,
+                           tuple(args.modes.split(",")), args.copy_delay, args.paste_delay,
+                           user_clipboard_size=int(args.user_clipboard_mb * 1024 * 1024),
+                           backup_formats=BACKUP_SELECTIVE_FORMATS if args.selective_backup else None,
+                           pastes_per_copy=args.pastes_per_copy, encode_workers=args.encode_workers,
+                           fill_delay=args.fill_delay)
+    print(result.format_table())
+    if args.histogram:
+        for name in result.get_stats():
+            print(result.format_histogram(name))
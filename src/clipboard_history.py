@@ -0,0 +1,492 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# ClipboardHistory モジュール
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import base64
+from bisect import bisect_left, insort
+import json
+import os
+import re
+import threading
+import time
+
+## pypiライブラリ
+
+## 自作モジュール
+from src.action_executor import ActionExecutor
+from src.blob_store import BlobStore
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+HISTORY_DIR = './clipboard_history'
+HISTORY_FILE = 'history.jsonl'
+BLOB_SUBDIR = 'blobs'
+SEARCH_TEXT_LIMIT = 1024  # 検索用にメモリに保持するテキストの長さの上限（文字数）
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+HISTORY_MAX_ENTRIES = 5000  # 保持する項目数の上限。超えた分は古い順に削除する
+HISTORY_MAX_AGE = 30 * 24 * 60 * 60  # 項目を保持する期間（秒）
+HISTORY_COMPACT_MIN_LINES = 1000  # 削除済みの項目の行がこの数と保持している項目数を超えたら履歴ファイルを書き直す
+SEARCH_SUBSTRING = 'substring'
+SEARCH_PREFIX = 'prefix'
+TOKEN_PATTERN = re.compile(r'\w+')
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+def tokenize(text: str):
+    """
+    前方一致検索用に、テキストを小文字の単語に分割する関数。
+
+    Args:
+        text (str): 分割するテキスト。
+
+    Returns:
+        set: 単語の集合。
+    """
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+#######################################################################################
+# クラス
+class ClipboardHistory:
+    """
+    仮想クリップボードに設定されたすべての内容を記録し、検索できるようにする履歴クラス。
+
+    - メモリには各項目のメタデータと、検索用に切り詰めたテキストのみを保持します。
+    - 内容とサムネイルはディスク上のBlobStoreに保存し、HTTP（/blob/{digest}）で必要な時だけ取得します。
+    - テキストとファイル名の部分一致検索と、単語の前方一致検索（ソート済みの索引）に対応します。
+    - 結果は新しい順に、before（項目ID）を指定したページ単位で取得します。
+    - ディスクへの書き込みは専用のワーカースレッドで行います。
+    - 項目数と期間の上限を超えた項目は、内容とサムネイルのファイルごと古い順に削除します。
+    """
+
+    def __init__(self, directory=HISTORY_DIR, max_entries=HISTORY_MAX_ENTRIES, max_age=HISTORY_MAX_AGE):
+        """
+        ClipboardHistoryの初期化を行うコンストラクタ。
+
+        Args:
+            directory (str): 履歴と内容を保存するディレクトリ。
+            max_entries (int or None): 保持する項目数の上限。Noneの場合は制限しません。
+            max_age (float or None): 項目を保持する期間（秒）。Noneの場合は制限しません。
+
+        Attributes:
+            entries (list): 項目のメタデータの、項目IDの昇順のリスト。項目IDは履歴ファイルに保存され、再読み込み後も変わりません。
+            tokens (list): (単語, 項目ID) のソート済みリスト。前方一致検索の索引です。
+                削除した項目の単語は、その数が保持している単語の数を超えた時にまとめて取り除きます。
+            next_id (int): 次に追加する項目のID。
+            blob_store (BlobStore): 内容とサムネイルを保存するBlobStore。すべてディスクに書き出します。
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.history_path = os.path.join(directory, HISTORY_FILE)
+        self.lock = threading.Lock()
+        self.entries = []
+        self.tokens = []
+        self.next_id = 1
+        self.stale_tokens = 0
+        self.file_lines = 0
+        self.blob_store = BlobStore(os.path.join(directory, BLOB_SUBDIR), spill_threshold=0, remove_orphans=False)
+        self.writer = ActionExecutor("clipboard-history")
+        self.history_file = None
+
+    def load(self):
+        """
+        保存された履歴のメタデータを読み込み、索引を作成する関数。内容は読み込みません。
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        valid_length = 0
+        renumbered = False
+        try:
+            with open(self.history_path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 書き込み途中で終了した末尾の行は無視する
+                        break
+                    valid_length += len(line)
+                    # IDを保存していない古い形式の行や、順序が壊れた行には新しいIDを割り当てる
+                    entry_id = entry.get("id")
+                    if type(entry_id) is not int or entry_id < self.next_id:
+                        entry["id"] = self.next_id
+                        renumbered = True
+                    self.next_id = entry["id"] + 1
+                    self.file_lines += 1
+                    self._register_files(entry)
+                    self._add_entry(entry, sort_tokens=False)
+        except FileNotFoundError:
+            pass
+        # 読み込み時は1件ずつ挿入せず、最後にまとめてソートする
+        with self.lock:
+            self.tokens.sort()
+        self.history_file = open(self.history_path, "ab")
+        # 壊れた末尾の行の後ろに追記しないよう切り詰める
+        self.history_file.truncate(valid_length)
+        # 保持期間を過ぎた項目を削除し、削除した項目や新しく割り当てたIDがあれば履歴ファイルに反映する
+        if self.prune() or renumbered:
+            self._rewrite_file()
+        self._remove_orphan_files()
+        print(f"Loaded {len(self.entries)} clipboard history entries")
+
+    def record(self, index: int, clipboard: dict, data: bytes, mime: str):
+        """
+        仮想クリップボードに設定された内容を履歴に追加する関数。ディスクへの保存はワーカースレッドで行います。
+
+        Args:
+            index (int): 内容を設定したクリップボードのインデックス。
+            clipboard (dict): 仮想クリップボードの内容（type・label・content）。
+            data (bytes): 内容をエンコードしたデータ。
+            mime (str): データのMIMEタイプ。
+        """
+        content_type = clipboard['type']
+        entry = {
+            "timestamp": time.time(),
+            "slot": index,
+            "type": content_type,
+            "preview": clipboard['label'] if content_type != 'image' else '',
+            "mime": mime,
+            "size": len(data),
+        }
+        if content_type == 'text':
+            entry["search_text"] = str(clipboard['content'])[:SEARCH_TEXT_LIMIT]
+        elif content_type == 'file':
+            entry["search_text"] = ' '.join(file.split('\\')[-1] for file in clipboard['content'])[:SEARCH_TEXT_LIMIT]
+        else:
+            entry["search_text"] = ''
+        thumbnail = None
+        if content_type == 'image' and clipboard['label'].startswith('data:'):
+            # 画像のラベルはサムネイルのデータURLなので、デコードして別に保存する
+            header, _, encoded = clipboard['label'].partition(',')
+            thumbnail = (base64.b64decode(encoded), header[len('data:'):].split(';')[0])
+        self.writer.submit(self._store, entry, data, thumbnail)
+
+    def _store(self, entry: dict, data: bytes, thumbnail):
+        """
+        内容を保存し、履歴ファイルに追記してから索引に追加する関数（ワーカースレッドで実行）。
+
+        Args:
+            entry (dict): 項目のメタデータ。
+            data (bytes): 内容のデータ。
+            thumbnail (tuple or None): サムネイルのデータとMIMEタイプのタプル。
+        """
+        entry["blob"] = self.blob_store.put(data, entry["mime"])
+        entry["thumbnail"] = self.blob_store.put(*thumbnail) if thumbnail else None
+        entry["thumbnail_mime"] = thumbnail[1] if thumbnail else None
+        with self.lock:
+            entry["id"] = self.next_id
+            self.next_id += 1
+        self.history_file.write(json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.history_file.flush()
+        self.file_lines += 1
+        self._add_entry(entry)
+        self.prune()
+        # 削除した項目の行が溜まったら、保持している項目だけで書き直す
+        if self.file_lines - len(self.entries) > max(len(self.entries), HISTORY_COMPACT_MIN_LINES):
+            self._rewrite_file()
+
+    def prune(self) -> int:
+        """
+        項目数と期間の上限を超えた項目を古い順に削除し、参照されなくなった内容とサムネイルのファイルを削除する関数。
+
+        Returns:
+            int: 削除した項目数。
+        """
+        with self.lock:
+            count = 0
+            if self.max_entries is not None:
+                count = max(0, len(self.entries) - self.max_entries)
+            if self.max_age is not None:
+                cutoff = time.time() - self.max_age
+                while count < len(self.entries) and self.entries[count]["timestamp"] < cutoff:
+                    count += 1
+            if count == 0:
+                return 0
+            removed = self.entries[:count]
+            del self.entries[:count]
+            # 索引からは毎回取り除かず、削除した項目の単語が半分を超えたらまとめて取り除く
+            self.stale_tokens += sum(len(tokenize(entry["search_text"])) for entry in removed)
+            if self.stale_tokens * 2 > len(self.tokens):
+                first_id = self.entries[0]["id"] if self.entries else self.next_id
+                self.tokens = [token for token in self.tokens if token[1] >= first_id]
+                self.stale_tokens = 0
+        for entry in removed:
+            for key in ("blob", "thumbnail"):
+                if entry.get(key):
+                    self.blob_store.release(entry[key])
+        return count
+
+    def _rewrite_file(self):
+        """
+        保持している項目だけで履歴ファイルを書き直す関数。書き込み途中のファイルが読み込まれないよう、一時ファイルから置き換えます。
+        """
+        with self.lock:
+            entries = list(self.entries)
+        temp_path = f"{self.history_path}.tmp"
+        with open(temp_path, "wb") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.history_file.close()
+        os.replace(temp_path, self.history_path)
+        self.history_file = open(self.history_path, "ab")
+        self.file_lines = len(entries)
+
+    def _remove_orphan_files(self):
+        """
+        どの項目からも参照されていない内容とサムネイルのファイルを削除する関数。
+        項目を削除した後、ファイルを削除する前に終了した場合などに残ったファイルを片付けます。
+        """
+        try:
+            names = os.listdir(self.blob_store.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if self.blob_store.contains(name):
+                continue
+            try:
+                os.remove(os.path.join(self.blob_store.directory, name))
+            except OSError as e:
+                print(f"Failed to remove clipboard history file {name}: {e}")
+
+    def _register_files(self, entry: dict):
+        """
+        保存済みの内容とサムネイルのファイルを、読み込まずにBlobStoreに登録する関数。
+
+        Args:
+            entry (dict): 項目のメタデータ。
+        """
+        for key, mime in (("blob", entry["mime"]), ("thumbnail", entry.get("thumbnail_mime"))):
+            digest = entry.get(key)
+            if not digest:
+                continue
+            # 同じ内容を参照する項目ごとに参照数を増やし、最後の項目を削除した時にファイルを削除する
+            if self.blob_store.contains(digest):
+                self.blob_store.retain(digest)
+                continue
+            path = os.path.join(self.blob_store.directory, digest)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            self.blob_store.add_file(digest, path, size, mime, external=False)
+
+    def _add_entry(self, entry: dict, sort_tokens=True):
+        """
+        項目をメモリ上の一覧と前方一致検索の索引に追加する関数。
+
+        Args:
+            entry (dict): 項目のメタデータ。
+            sort_tokens (bool): 索引をソート済みに保つよう挿入する場合はTrue。Falseの場合は末尾に追加します。
+        """
+        entry["search_text"] = entry["search_text"].lower()
+        with self.lock:
+            self.entries.append(entry)
+            for token in tokenize(entry["search_text"]):
+                if sort_tokens:
+                    insort(self.tokens, (token, entry["id"]))
+                else:
+                    self.tokens.append((token, entry["id"]))
+
+    def get_entry(self, entry_id: int):
+        """
+        項目のメタデータを取得する関数。
+
+        Args:
+            entry_id (int): 項目ID。
+
+        Returns:
+            dict or None: 項目のメタデータ。無効なIDの場合はNone。
+        """
+        with self.lock:
+            return self._get_entry_locked(entry_id)
+
+    def _get_entry_locked(self, entry_id: int):
+        """
+        項目のメタデータを取得する関数。呼び出し側でlockを取得してください。
+
+        Args:
+            entry_id (int): 項目ID。
+
+        Returns:
+            dict or None: 項目のメタデータ。無効なIDの場合はNone。
+        """
+        position = self._position(entry_id)
+        if position < len(self.entries) and self.entries[position]["id"] == entry_id:
+            return self.entries[position]
+        return None
+
+    def _position(self, entry_id: int) -> int:
+        """
+        項目IDがentry_id以上の最初の項目の、一覧の位置を取得する関数。呼び出し側でlockを取得してください。
+
+        Args:
+            entry_id (int): 項目ID。
+
+        Returns:
+            int: 一覧の位置。該当する項目が無い場合は項目数。
+        """
+        return bisect_left(self.entries, entry_id, key=lambda entry: entry["id"])
+
+    def get_content(self, entry_id: int):
+        """
+        項目の内容をディスクから読み込む関数。
+
+        Args:
+            entry_id (int): 項目ID。
+
+        Returns:
+            bytes or None: 内容のデータ。無効なIDの場合や内容が無い場合はNone。
+        """
+        entry = self.get_entry(entry_id)
+        if entry is None:
+            return None
+        return self.blob_store.get(entry["blob"])
+
+    def query(self, text='', mode=SEARCH_SUBSTRING, content_type=None, before=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        履歴を新しい順に検索する関数。
+
+        Args:
+            text (str): 検索するテキスト。空の場合はすべての項目。
+            mode (str): SEARCH_SUBSTRING（部分一致）または SEARCH_PREFIX（単語の前方一致）。
+            content_type (str or None): 'text'、'file'、'image'のいずれかで絞り込みます。
+            before (int or None): このIDより古い項目を返します。Noneの場合は最新の項目から。
+            limit (int): 1ページの項目数。
+
+        Returns:
+            dict: 'entries'（項目のリスト）、'next_before'（次のページのbefore。無い場合はNone）、'total'（全項目数）を含む辞書。
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        text = text.lower().strip()
+        with self.lock:
+            start = len(self.entries) if before is None else self._position(int(before))
+            if text and mode == SEARCH_PREFIX:
+                candidates = self._prefix_candidates(text, before)
+            else:
+                candidates = (self.entries[position] for position in range(start - 1, -1, -1))
+            matches = []
+            for entry in candidates:
+                if content_type and entry["type"] != content_type:
+                    continue
+                if text and mode != SEARCH_PREFIX and text not in entry["search_text"]:
+                    continue
+                matches.append(entry)
+                # 次のページがあるかを判定するため、1件多く探す
+                if len(matches) > limit:
+                    break
+            total = len(self.entries)
+        next_before = matches[limit - 1]["id"] if len(matches) > limit else None
+        return {
+            "entries": [self._to_public(entry) for entry in matches[:limit]],
+            "next_before": next_before,
+            "total": total,
+        }
+
+    def _prefix_candidates(self, text: str, before=None):
+        """
+        すべての単語がいずれかの単語の前方に一致する項目を、新しい順に列挙するジェネレータ。呼び出し側でlockを取得してください。
+
+        Args:
+            text (str): 小文字にした検索テキスト。
+            before (int or None): このIDより古い項目のみを対象とします。Noneの場合はすべての項目。
+
+        Yields:
+            dict: 項目のメタデータ。
+        """
+        matched_ids = None
+        for prefix in tokenize(text):
+            ids = set()
+            position = bisect_left(self.tokens, (prefix, 0))
+            while position < len(self.tokens) and self.tokens[position][0].startswith(prefix):
+                ids.add(self.tokens[position][1])
+                position += 1
+            matched_ids = ids if matched_ids is None else matched_ids & ids
+        for entry_id in sorted(matched_ids or (), reverse=True):
+            if before is not None and entry_id >= int(before):
+                continue
+            entry = self._get_entry_locked(entry_id)
+            if entry is not None:
+                yield entry
+
+    def _to_public(self, entry: dict):
+        """
+        項目のメタデータをクライアントに送る形式に変換する関数。
+
+        Args:
+            entry (dict): 項目のメタデータ。
+
+        Returns:
+            dict: 項目ID・日時・種類・プレビュー・サイズ・内容とサムネイルのURLを含む辞書。
+        """
+        return {
+            "id": entry["id"],
+            "timestamp": entry["timestamp"],
+            "slot": entry["slot"],
+            "type": entry["type"],
+            "preview": entry["preview"],
+            "size": entry["size"],
+            "url": f"/blob/{entry['blob']}",
+            "thumbnail_url": f"/blob/{entry['thumbnail']}" if entry.get("thumbnail") else None,
+        }
+
+    def close(self):
+        """
+        書き込み待ちの項目を保存し、履歴ファイルを閉じる関数。
+        """
+        if self.history_file is None:
+            return
+        self.writer.submit(lambda: None).result()
+        self.history_file.close()
+        self.history_file = None
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        history = ClipboardHistory(directory, max_entries=None)
+        history.load()
+        start_time = time.perf_counter()
+        for i in range(20000):
+            text = f"entry {i} {'alpha' if i % 3 else 'beta'} report_{i % 100}"
+            history.record(i % 10, {'type': 'text', 'label': text, 'content': text}, text.encode('utf-8'), 'text/plain; charset=utf-8')
+        history.close()
+        print(f"Recorded 20000 entries in {time.perf_counter() - start_time:.2f}s")
+
+        # 書き込み途中で終了した行を模擬する。再読み込み時に切り詰められ、後から追記した項目は読み込める
+        with open(history.history_path, "ab") as f:
+            f.write(b'{"timestamp": 1')
+        history = ClipboardHistory(directory, max_entries=None)
+        history.load()
+        history.record(0, {'type': 'text', 'label': 'after crash', 'content': 'after crash'}, b'after crash', 'text/plain; charset=utf-8')
+        history.close()
+
+        # 上限を超えた古い項目は、読み込み時に内容のファイルごと削除される
+        reloaded = ClipboardHistory(directory, max_entries=HISTORY_MAX_ENTRIES)
+        start_time = time.perf_counter()
+        reloaded.load()
+        print(f"Loaded in {time.perf_counter() - start_time:.2f}s")
+        for query in ({"text": "beta"}, {"text": "repo", "mode": SEARCH_PREFIX}, {"text": "report_42", "limit": 3}):
+            start_time = time.perf_counter()
+            result = reloaded.query(**query)
+            elapsed = (time.perf_counter() - start_time) * 1000
+            print(query, len(result["entries"]), result["next_before"], f"{elapsed:.2f}ms")
+        print(reloaded.query("after crash")["entries"][0]["id"], reloaded.next_id, len(reloaded.entries), len(reloaded.tokens),
+              len(os.listdir(reloaded.blob_store.directory)))
+        reloaded.close()
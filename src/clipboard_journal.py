@@ -0,0 +1,308 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# ClipboardJournal モジュール
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import json
+import os
+import queue
+import threading
+import time
+
+## pypiライブラリ
+
+## 自作モジュール
+from src.blob_store import compute_digest
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+JOURNAL_DIR = './clipboard_journal'
+JOURNAL_FILE = 'journal.jsonl'
+SNAPSHOT_FILE = 'snapshot.json'
+BLOB_SUBDIR = 'blobs'
+FLUSH_INTERVAL = 0.5  # 書き込みをまとめてfsyncするまでの最大の待ち時間（秒）
+COMPACT_THRESHOLD = 100  # ジャーナルの行数がこれを超えたらスナップショットにまとめる
+INLINE_LIMIT = 64 * 1024  # これ以下のテキスト・ファイルリストはジャーナルに直接書き込む（バイト）
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+def _fsync_write(path: str, data: bytes):
+    """
+    データを一時ファイルに書き込んでfsyncし、指定したパスに置き換える関数。
+
+    Args:
+        path (str): 書き込み先のパス。
+        data (bytes): 書き込むデータ。
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+#######################################################################################
+# クラス
+class ClipboardJournal:
+    """
+    仮想クリップボードの内容を、追記型のジャーナルとスナップショットでディスクに保存するクラス。
+
+    - 変更はジャーナル（JSON Lines）に追記し、行数がcompact_thresholdを超えたらスナップショットにまとめます。
+    - 画像や大きなテキストはジャーナルに含めず、ハッシュ値をファイル名とする別ファイルに保存します。
+      blob_storeを設定した場合、保存したファイルをBlobStoreに渡し、同じ内容をディスクに2つ書き出さないようにします。
+    - 書き込みは専用スレッドでflush_intervalごとにまとめて行い、fsyncは1回にまとめます。
+    - 書き込み途中で終了した場合でも、壊れた末尾の行を無視して直前の状態から復元できます。
+    """
+
+    def __init__(self, directory=JOURNAL_DIR, flush_interval=FLUSH_INTERVAL, compact_threshold=COMPACT_THRESHOLD, blob_store=None):
+        """
+        ClipboardJournalの初期化を行うコンストラクタ。
+
+        Args:
+            directory (str): ジャーナル・スナップショット・データを保存するディレクトリ。
+            flush_interval (float): 書き込みをまとめてfsyncするまでの最大の待ち時間（秒）。
+            compact_threshold (int): スナップショットにまとめるジャーナルの行数。
+            blob_store (BlobStore or None): 保存したデータのファイルを渡すBlobStore。
+                BlobStoreが参照しているファイルは、レコードから参照されなくなっても削除しません。
+
+        Attributes:
+            persisted (dict): ディスクに書き込み済みの、インデックスをキーとするレコードの辞書。
+            journal_lines (int): ジャーナルの行数。
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.compact_threshold = compact_threshold
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.blob_directory = os.path.join(directory, BLOB_SUBDIR)
+        self.blob_store = blob_store
+        self.persisted = {}
+        self.journal_lines = 0
+        self.journal_file = None
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def blob_path(self, digest: str) -> str:
+        """
+        データを保存するファイルのパスを取得する関数。
+
+        Args:
+            digest (str): データのハッシュ値。
+
+        Returns:
+            str: ファイルのパス。
+        """
+        return os.path.join(self.blob_directory, digest)
+
+    def read_blob(self, digest: str):
+        """
+        保存したデータを読み込む関数。
+
+        Args:
+            digest (str): データのハッシュ値。
+
+        Returns:
+            bytes or None: データ。ファイルが無い場合はNone。
+        """
+        try:
+            with open(self.blob_path(digest), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def load(self):
+        """
+        スナップショットとジャーナルから仮想クリップボードのレコードを読み込み、書き込みスレッドを開始する関数。
+        画像などのデータ本体は読み込まず、レコード（メタデータ）のみを返します。
+
+        Returns:
+            dict: インデックスをキーとし、type・label・version・blob・mime・size・content（直接保存した場合）を含むレコードを値とする辞書。
+        """
+        os.makedirs(self.blob_directory, exist_ok=True)
+        records = {}
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                records = {int(index): record for index, record in json.load(f)["records"].items()}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error in loading clipboard snapshot: {e}")
+
+        valid_length = 0
+        self.journal_lines = 0
+        try:
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 書き込み途中で終了した末尾の行は無視する
+                        break
+                    valid_length += len(line)
+                    self.journal_lines += 1
+                    current = records.get(record["index"])
+                    # スナップショット作成後にジャーナルを消す前に終了した場合、同じレコードが両方にあるため、新しい方を採用する
+                    if current is None or record["version"] > current["version"]:
+                        records[record["index"]] = record
+        except FileNotFoundError:
+            pass
+
+        for index, record in list(records.items()):
+            if "content" not in record and not os.path.exists(self.blob_path(record["blob"])):
+                print(f"Missing clipboard data for slot {index}: {record['blob']}")
+                del records[index]
+
+        self.persisted = dict(records)
+        self.journal_file = open(self.journal_path, "ab")
+        # 壊れた末尾の行の後ろに追記しないよう切り詰める
+        self.journal_file.truncate(valid_length)
+        self.thread = threading.Thread(target=self._writer, name="clipboard-journal", daemon=True)
+        self.thread.start()
+        return records
+
+    def record(self, index: int, clipboard: dict, data: bytes, mime: str):
+        """
+        仮想クリップボードの変更を書き込み待ちにする関数。実際の書き込みは書き込みスレッドでまとめて行います。
+
+        Args:
+            index (int): クリップボードのインデックス。
+            clipboard (dict): 仮想クリップボードの内容（type・label・version・blob）。
+            data (bytes): 内容をエンコードしたデータ。
+            mime (str): データのMIMEタイプ。
+        """
+        record = {
+            "index": index,
+            "type": clipboard['type'],
+            "label": clipboard['label'],
+            "version": clipboard['version'],
+            "blob": clipboard['blob'] or compute_digest(data),
+            "mime": mime,
+            "size": len(data),
+        }
+        if clipboard['type'] != 'image' and len(data) <= INLINE_LIMIT:
+            record["content"] = clipboard['content'] if clipboard['type'] == 'text' else list(clipboard['content'])
+            data = None
+        self.queue.put((record, data))
+
+    def close(self):
+        """
+        書き込み待ちの変更をすべて書き込み、書き込みスレッドを終了する関数。
+        """
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.journal_file.close()
+
+    def _writer(self):
+        """
+        書き込み待ちの変更をまとめてディスクに書き込むスレッドの処理。
+        最初の変更からflush_intervalの間に届いた変更を1回の書き込みとfsyncにまとめます。
+        """
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self._write_batch(batch)
+                if self.journal_lines > self.compact_threshold:
+                    self.compact()
+            except Exception as e:
+                print(f"Error in writing clipboard journal: {e}")
+
+    def _write_batch(self, batch):
+        """
+        変更をまとめてディスクに書き込む関数。データのファイルを先に書き込み、その後でジャーナルに追記します。
+
+        Args:
+            batch (list): (レコード, データ) のタプルのリスト。
+        """
+        # 同じインデックスへの変更は最新のものだけを書き込む
+        latest = {}
+        for record, data in batch:
+            latest[record["index"]] = (record, data)
+        for record, data in latest.values():
+            if data is not None and not os.path.exists(self.blob_path(record["blob"])):
+                _fsync_write(self.blob_path(record["blob"]), data)
+        for record, _ in latest.values():
+            self.journal_file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.persisted[record["index"]] = record
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.journal_lines += len(latest)
+        if self.blob_store is not None:
+            # BlobStoreがメモリに保持している内容は、書き込んだファイルから読み出すように切り替える
+            for record, data in latest.values():
+                if data is not None:
+                    self.blob_store.adopt_file(record["blob"], self.blob_path(record["blob"]))
+
+    def compact(self):
+        """
+        書き込み済みのレコードをスナップショットにまとめ、ジャーナルを空にする関数。
+        どのレコードからも参照されなくなったデータのファイルも削除します。ただし、BlobStoreがまだ参照しているファイルは残します。
+        """
+        snapshot = {"records": {str(index): record for index, record in self.persisted.items()}}
+        _fsync_write(self.snapshot_path, json.dumps(snapshot, ensure_ascii=False).encode("utf-8"))
+        self.journal_file.truncate(0)
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.journal_lines = 0
+
+        referenced = {record["blob"] for record in self.persisted.values() if "content" not in record}
+        for name in os.listdir(self.blob_directory):
+            if name not in referenced and not (self.blob_store is not None and self.blob_store.contains(name)):
+                try:
+                    os.remove(os.path.join(self.blob_directory, name))
+                except OSError as e:
+                    print(f"Failed to remove clipboard data {name}: {e}")
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        journal = ClipboardJournal(directory, flush_interval=0.1, compact_threshold=3)
+        print(journal.load())
+        for version in range(1, 6):
+            clipboard = {'type': 'text', 'label': f'text {version}', 'content': f'text {version}', 'version': version, 'blob': None}
+            journal.record(version % 2, clipboard, clipboard['content'].encode('utf-8'), 'text/plain; charset=utf-8')
+        image = {'type': 'image', 'label': 'Image', 'content': None, 'version': 6, 'blob': None}
+        journal.record(2, image, b'\x89PNG fake image', 'image/png')
+        journal.close()
+
+        reloaded = ClipboardJournal(directory)
+        for index, record in sorted(reloaded.load().items()):
+            print(index, record)
+        reloaded.close()
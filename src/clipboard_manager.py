@@ -6,32 +6,44 @@
 #######################################################################################
 # import処理
 ## 標準ライブラリ
-from subprocess import Popen, PIPE  # subprocessをインポート
+from concurrent.futures import ThreadPoolExecutor
 import time
 import threading
 import io
 
 ## pypiライブラリ
-import pyperclip
-import keyboard
 from PIL import Image, ImageOps
 import base64
 
 ## 自作モジュール
-from src.keyboard_handler import InputHandler
+from src.clipboard_backend import WindowsClipboardBackend, CHANGE_TIMEOUT, ENCODING_PNG
+from src.image_pipeline import ImagePipeline
+from src.lru_cache import LRUCache
+from src.thumbnail import encode_thumbnail, THUMBNAIL_MAX_SIZE, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY, THUMBNAIL_MIME_TYPES
 
 ## その他
-import clr
-import win32clipboard
-import win32con
 
 #######################################################################################
 # 定数
-
+THUMBNAIL_CACHE_SIZE = 64  # キャッシュするサムネイルの数
+WAIT_MODE_SEQUENCE = 'sequence'  # クリップボードのシーケンス番号の変化を待って次の処理に進む
+WAIT_MODE_FIXED = 'fixed'  # 固定時間だけ待って次の処理に進む（比較用）
+# コピー操作でシステムクリップボードが変わるのを待つ時間の上限（秒）。何も選択されていない場合はこの時間だけ
+# アクション実行スレッドを占有するため、change_timeoutより短くする（以前の固定の待ち時間と同じ）
+COPY_TIMEOUT = 0.2
+BACKUP_SELECTIVE_FORMATS = 'selective'  # バックエンドのselective_backup_formatsのみをバックアップする（高速だが他の形式は失われる）
+# 画像はこれらの形式であればエンコードされたまま保持し、それ以外はPNGに変換して保持する
+ENCODED_IMAGE_MIME_TYPES = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'GIF': 'image/gif', 'WEBP': 'image/webp', 'BMP': 'image/bmp'}
+DECODED_IMAGE_CACHE_SIZE = 4  # デコードした画像をキャッシュする数
+DECODED_IMAGE_CACHE_BYTES = 256 * 1024 * 1024  # デコードした画像のキャッシュの合計サイズの上限（バイト）
+EXIF_ORIENTATION = 0x0112
+IMAGE_PAYLOAD_CACHE_SIZE = 8  # ペースト用にエンコードした画像（PNG・DIBなど）をキャッシュする数
+IMAGE_PAYLOAD_CACHE_BYTES = 256 * 1024 * 1024  # ペースト用にエンコードした画像のキャッシュの合計サイズの上限（バイト）
+IMAGE_ENCODE_WORKERS = 2  # ペースト用の各形式のエンコードを並行して行うスレッド数
 
 #######################################################################################
 # 変数
-input_handler = InputHandler()
+
 
 #######################################################################################
 # 関数
@@ -42,13 +54,29 @@ def load_base64_image(base64_image: str) -> Image.Image:
     :param base64_image: Base64 エンコードされた画像データの文字列
     :return: Pillow の Image オブジェクト
     """
+    return load_image_bytes(decode_base64_data(base64_image))
+
+def decode_base64_data(base64_data: str) -> bytes:
+    """
+    Base64 エンコードされたデータ（データURLも可）をバイト列にデコードします。
+
+    :param base64_data: Base64 エンコードされたデータの文字列
+    :return: デコードしたバイト列
+    """
     # プレフィックス 'data:image/jpeg;base64,' のような部分を取り除く
-    if ',' in base64_image:
-        base64_image = base64_image.split(',')[1]
+    if ',' in base64_data:
+        base64_data = base64_data.split(',')[1]
 
     # base64 文字列をバイナリデータにデコード
-    image_data = base64.b64decode(base64_image)
+    return base64.b64decode(base64_data)
 
+def load_image_bytes(image_data: bytes) -> Image.Image:
+    """
+    エンコードされた画像のバイト列を読み込み、Pillow の Image オブジェクトとして返します。
+
+    :param image_data: PNGやJPEGなどでエンコードされた画像のバイト列
+    :return: Pillow の Image オブジェクト
+    """
     # バイナリデータを io.BytesIO オブジェクトに変換
     image_stream = io.BytesIO(image_data)
 
@@ -56,6 +84,88 @@ def load_base64_image(base64_image: str) -> Image.Image:
     image = Image.open(image_stream)
     return image
 
+def decode_image(image_data: bytes, max_size=None) -> Image.Image:
+    """
+    エンコードされた画像をデコードし、EXIFの向きを反映した Pillow の Image オブジェクトとして返します。
+
+    :param image_data: PNGやJPEGなどでエンコードされた画像のバイト列
+    :param max_size: 必要な長辺のサイズ（ピクセル）。指定した場合、JPEGは縮小した解像度で直接デコードします
+    :return: Pillow の Image オブジェクト
+    """
+    image = load_image_bytes(image_data)
+    if max_size is not None:
+        image.draft(None, (max_size, max_size))
+    image.load()
+    if image.getexif().get(EXIF_ORIENTATION, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+    return image
+
+def prepare_image_data(image_data: bytes):
+    """
+    アップロードされた画像のバイト列を、仮想クリップボードに保持する形式にします。
+    ヘッダのみを読み込んで形式を判別し、ブラウザで表示できる形式はデコードせずにそのまま返します。
+
+    :param image_data: エンコードされた画像のバイト列
+    :return: 保持する画像のバイト列とMIMEタイプのタプル
+    """
+    with load_image_bytes(image_data) as image:
+        mime = ENCODED_IMAGE_MIME_TYPES.get(image.format)
+        if mime is not None:
+            return image_data, mime
+        return encode_image(image, 'PNG'), 'image/png'
+
+def image_memory_size(image: Image.Image) -> int:
+    """
+    デコードした画像が使用するメモリのおおよそのサイズを求めます。
+
+    :param image: Pillow の Image オブジェクト
+    :return: サイズ（バイト）
+    """
+    return image.width * image.height * len(image.getbands())
+
+def encode_image(image: Image.Image, image_format='PNG') -> bytes:
+    """
+    Pillow の Image オブジェクトを指定した形式のバイト列にエンコードします。
+
+    :param image: Pillow の Image オブジェクト
+    :param image_format: エンコード形式（'PNG' など）
+    :return: エンコードされた画像のバイト列
+    """
+    with io.BytesIO() as output:
+        image.save(output, format=image_format)
+        return output.getvalue()
+
+def decode_content(data: bytes, content_type: str):
+    """
+    エンコードされた内容をデコードします（VirtualClipboardManager.encode_content の逆変換）。
+
+    :param data: エンコードされた内容のバイト列
+    :param content_type: コンテンツの種類（'text'、'file'、'image'）
+    :return: テキスト、ファイルパスのリスト、または Pillow の Image オブジェクト
+    """
+    if content_type == 'image':
+        return decode_image(data)
+    elif content_type == 'file':
+        return data.decode('utf-8').split('\n')
+    return data.decode('utf-8')
+
+def create_image_label(content, image_size: int, thumbnail_format=THUMBNAIL_FORMAT, thumbnail_quality=THUMBNAIL_QUALITY) -> str:
+    """
+    画像を縮小したサムネイルのデータURLを作成します（ImagePipelineのワーカーで実行）。
+
+    :param content: エンコードされた画像のバイト列、または Pillow の Image オブジェクト
+    :param image_size: サムネイルの長辺の最大サイズ（ピクセル）
+    :param thumbnail_format: サムネイルの形式（'WEBP'、'JPEG'、'PNG'）
+    :param thumbnail_quality: サムネイルの品質
+    :return: サムネイルのデータURL
+    """
+    # バイト列の場合、JPEGはサムネイルに必要な解像度までしか展開しない
+    image = decode_image(content, image_size) if isinstance(content, (bytes, bytearray)) else content
+    # 縮小したサムネイルをエンコードしてBase64変換
+    thumbnail = encode_thumbnail(image, image_size, thumbnail_format, thumbnail_quality)
+    base64_data = base64.b64encode(thumbnail).decode('utf-8')
+    return f'data:{THUMBNAIL_MIME_TYPES[thumbnail_format]};base64,{base64_data}'
+
 #######################################################################################
 # クラス
 class VirtualClipboardManager:
@@ -71,23 +181,99 @@ class VirtualClipboardManager:
     - コンテンツの種類に基づいて自動でラベルを設定。
     - 操作中にシステムクリップボードの内容をバックアップおよび復元。
     - テキスト、ファイルパス、画像データに対応。
+    - BlobStoreを指定した場合、内容をハッシュ値で管理されるデータとしても保存（HTTPで配信可能）。
+    - 内容を設定するたびに単調増加するバージョン番号を付与し、変更のあった仮想クリップボードを整数比較で判別可能。
+    - EventBusを指定した場合、内容を設定するたびに "clipboard_info" イベントを発行。
+    - システムクリップボードの操作はClipboardBackendに委譲（既定はWindowsClipboardBackend）。
+    - コピー・ペーストは固定時間ではなく、システムクリップボードの変化を待って完了（wait_mode）。
+    - 操作前のバックアップは指定した形式のみとし、シーケンス番号が変わっていなければ前回のバックアップを再利用。
+      操作でシステムクリップボードが変わらなかった場合は復元を省略。
+    - ClipboardJournalを指定した場合、内容をディスクに保存し、起動時に復元（画像などの本体は必要になった時に読み込み）。
+    - ClipboardHistoryを指定した場合、設定されたすべての内容を検索可能な履歴に記録。
+    - 画像はエンコードされたバイト列（アップロードされたJPEGなどは元のまま）で保持し、
+      ペーストなどでビットマップが必要になった時だけデコード（デコードした画像は少数のみキャッシュ）。
+    - ペースト用の画像の各形式（PNG・DIBなど）は初回にスレッドプールで並行してエンコードし、内容ごとにキャッシュ。
+      保持しているデータがPNGの場合はPNGを再エンコードしない。
     """
 
-    def __init__(self, num_clipboards=5):
+    def __init__(self, num_clipboards=5, blob_store=None, thumbnail_size=THUMBNAIL_MAX_SIZE,
+                 thumbnail_format=THUMBNAIL_FORMAT, thumbnail_quality=THUMBNAIL_QUALITY,
+                 thumbnail_cache_size=THUMBNAIL_CACHE_SIZE, event_bus=None, backend=None,
+                 wait_mode=WAIT_MODE_SEQUENCE, change_timeout=CHANGE_TIMEOUT, copy_timeout=COPY_TIMEOUT, backup_formats=None,
+                 journal=None, history=None, decoded_image_cache_size=DECODED_IMAGE_CACHE_SIZE,
+                 decoded_image_cache_bytes=DECODED_IMAGE_CACHE_BYTES, image_payload_cache_size=IMAGE_PAYLOAD_CACHE_SIZE,
+                 image_payload_cache_bytes=IMAGE_PAYLOAD_CACHE_BYTES, image_encode_workers=IMAGE_ENCODE_WORKERS,
+                 image_pipeline=None):
         """
         VirtualClipboardManagerの初期化を行うコンストラクタ。
 
         Args:
             num_clipboards (int): 管理する仮想クリップボードの数。デフォルトは5。
+            blob_store (BlobStore or None): 内容を保存するBlobStore。省略可能。
+            thumbnail_size (int): 画像ラベル用サムネイルの長辺の最大サイズ（ピクセル）。
+            thumbnail_format (str): 画像ラベル用サムネイルの形式。'WEBP'、'JPEG'、'PNG'のいずれか。
+            thumbnail_quality (int): 画像ラベル用サムネイルの品質。
+            thumbnail_cache_size (int): 内容のハッシュ値ごとにキャッシュするサムネイルの数。
+            event_bus (EventBus or None): 内容の変更を通知するEventBus。省略可能。
+            backend (ClipboardBackend or None): システムクリップボードを操作するバックエンド。省略時はWindowsClipboardBackend。
+            wait_mode (str): コピー・ペーストの完了の待ち方。WAIT_MODE_SEQUENCE または WAIT_MODE_FIXED。
+            change_timeout (float): WAIT_MODE_SEQUENCEでシステムクリップボードの変化を待つ時間の上限（秒）。
+            copy_timeout (float): WAIT_MODE_SEQUENCEで、コピー操作によりシステムクリップボードが変わるのを待つ時間の上限（秒）。
+                何も選択されていない場合はこの時間だけ待ちます。
+            backup_formats (tuple, str or None): 操作前にバックアップする形式。省略時（None）はすべての形式をバックアップし、
+                HTMLやアプリケーション独自の形式も含めて元のクリップボードを復元します。
+                BACKUP_SELECTIVE_FORMATSの場合はバックエンドのselective_backup_formatsのみをバックアップします。
+            journal (ClipboardJournal or None): 内容を保存・復元するClipboardJournal。省略可能。
+            history (ClipboardHistory or None): 設定された内容を記録するClipboardHistory。省略可能。
+            decoded_image_cache_size (int): デコードした画像をキャッシュする数。
+            decoded_image_cache_bytes (int or None): デコードした画像のキャッシュの合計サイズの上限（バイト）。
+            image_payload_cache_size (int): ペースト用にエンコードした画像をキャッシュする数。
+            image_payload_cache_bytes (int or None): ペースト用にエンコードした画像のキャッシュの合計サイズの上限（バイト）。
+            image_encode_workers (int): ペースト用の各形式のエンコードを並行して行うスレッド数。1以下の場合は順に実行します。
+            image_pipeline (ImagePipeline or None): 画像ラベル用サムネイルの作成を実行するImagePipeline。省略時は新たに作成します。
         
         Attributes:
             clipboards (list): 仮想クリップボードの内容を保持する辞書のリスト。
+                画像の'content'は常にNoneで、エンコードされたデータはBlobStore（無い場合は'data'）に保持します。
+            image_cache (LRUCache): デコードした画像のキャッシュ。
+            image_payload_cache (LRUCache): ペースト用にエンコードした画像（形式をキーとする辞書）のキャッシュ。
             current_clipboard_index (int): 現在のクリップボードのインデックス。デフォルトは0。
             monitoring (bool): クリップボードの監視状態を示すフラグ。
+            version (int): 最後に内容を設定した時のバージョン番号。
         """
-        self.clipboards = [{'label': f'', 'content': '', 'type': 'text'} for i in range(num_clipboards)]
+        self.clipboards = [{'label': f'', 'content': '', 'type': 'text', 'blob': None, 'data': None, 'version': 0} for i in range(num_clipboards)]
+        self.version = 0
+        self.version_lock = threading.Lock()
         self.current_clipboard_index = 0
         self.monitoring = False
+        self.blob_store = blob_store
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_format = thumbnail_format
+        self.thumbnail_quality = thumbnail_quality
+        self.thumbnail_cache = LRUCache(max_entries=thumbnail_cache_size)
+        self.image_cache = LRUCache(max_entries=decoded_image_cache_size, max_bytes=decoded_image_cache_bytes,
+                                    size_func=image_memory_size)
+        self.image_payload_cache = LRUCache(max_entries=image_payload_cache_size, max_bytes=image_payload_cache_bytes,
+                                            size_func=lambda payloads: sum(len(data) for data in payloads.values()))
+        self.image_encoder = ThreadPoolExecutor(max_workers=image_encode_workers, thread_name_prefix='image-encoder') \
+            if image_encode_workers > 1 else None
+        self.image_pipeline = image_pipeline if image_pipeline is not None else ImagePipeline()
+        self.event_bus = event_bus
+        self.backend = backend if backend is not None else WindowsClipboardBackend()
+        self.wait_mode = wait_mode
+        self.change_timeout = change_timeout
+        self.copy_timeout = copy_timeout
+        if backup_formats == BACKUP_SELECTIVE_FORMATS:
+            backup_formats = self.backend.selective_backup_formats
+        self.backup_formats = backup_formats
+        self.last_backup = None
+        self.journal = journal
+        self.history = history
+        if journal is not None and journal.blob_store is None:
+            # ジャーナルが書き込んだファイルをBlobStoreでも使い、大きな内容をディスクに2回書き出さないようにする
+            journal.blob_store = blob_store
+        if journal is not None:
+            self.restore_from_journal()
 
     def get_clipboard(self, index):
         """
@@ -100,9 +286,97 @@ class VirtualClipboardManager:
             内容を返します。インデックスが無効な場合はNoneを返します。
         """
         if 0 <= index < len(self.clipboards):
-            return self.clipboards[index]['content']
+            return self.load_content(index)
         return None
 
+    def get_clipboard_image_bytes(self, index, image_format='PNG'):
+        """
+        画像の仮想クリップボードの内容をエンコードしたバイト列として取得する関数。
+
+        Args:
+            index (int): クリップボードのインデックス。
+            image_format (str): エンコード形式。デフォルトは'PNG'。
+
+        Returns:
+            bytes: エンコードされた画像。画像以外または無効なインデックスの場合はNoneを返します。
+        """
+        if 0 <= index < len(self.clipboards) and self.clipboards[index]['type'] == 'image':
+            blob = self.clipboards[index]['blob']
+            # 読み出し中に内容が差し替えられてもデータが削除されないよう、参照を保持してから読み出す
+            lease = self.blob_store.acquire(blob) if blob else None
+            if lease is not None:
+                try:
+                    if lease.info['mime'] == ENCODED_IMAGE_MIME_TYPES.get(image_format):
+                        return self.blob_store.get(blob)
+                finally:
+                    lease.release()
+            return encode_image(self.load_content(index), image_format)
+        return None
+
+    def get_clipboard_blob(self, index):
+        """
+        仮想クリップボードの内容を保存したBlobStore上のハッシュ値を取得する関数。
+
+        Args:
+            index (int): クリップボードのインデックス。
+
+        Returns:
+            str: ハッシュ値を返します。保存されていない場合や無効なインデックスの場合はNoneを返します。
+        """
+        if 0 <= index < len(self.clipboards):
+            return self.clipboards[index]['blob']
+        return None
+
+    def get_version(self):
+        """
+        最新のバージョン番号を取得する関数。
+
+        Returns:
+            int: 最後に内容を設定した時のバージョン番号。
+        """
+        return self.version
+
+    def get_clipboard_version(self, index):
+        """
+        仮想クリップボードのバージョン番号を取得する関数。
+
+        Args:
+            index (int): クリップボードのインデックス。
+
+        Returns:
+            int: バージョン番号を返します。無効なインデックスの場合はNoneを返します。
+        """
+        if 0 <= index < len(self.clipboards):
+            return self.clipboards[index]['version']
+        return None
+
+    def get_num_clipboards(self):
+        """
+        仮想クリップボードの数を取得する関数。
+
+        Returns:
+            int: 仮想クリップボードの数。
+        """
+        return len(self.clipboards)
+
+    def get_changed_indices(self, since_version=0, indices=None):
+        """
+        指定したバージョンより後に内容が設定された仮想クリップボードのインデックスを取得する関数。
+
+        Args:
+            since_version (int): 基準となるバージョン番号。0以下の場合は全てのインデックスを返します。
+            indices (iterable or None): 対象とするインデックス（例: 表示中のページの範囲）。Noneの場合は全てのインデックス。
+
+        Returns:
+            list: 変更のあった仮想クリップボードのインデックスのリスト。
+        """
+        count = len(self.clipboards)
+        if indices is None:
+            indices = range(count)
+        if since_version <= 0:
+            return [i for i in indices if 0 <= i < count]
+        return [i for i in indices if 0 <= i < count and self.clipboards[i]['version'] > since_version]
+
     def get_clipboard_type(self, index):
         """
         仮想クリップボードのコンテンツタイプを取得する関数。
@@ -117,46 +391,230 @@ class VirtualClipboardManager:
             return self.clipboards[index]['type']
         return None
 
-    def set_clipboard(self, index, content, content_type='text', label=None):
+    def set_clipboard(self, index, content, content_type='text', label=None, data=None, mime=None):
         """
         仮想クリップボードに内容を設定する関数。
 
         Args:
             index (int): クリップボードのインデックス。
-            content: 設定する内容（テキスト、ファイル、画像）。
+            content: 設定する内容（テキスト、ファイル、画像）。dataを指定した画像の場合はNoneでも構いません。
             content_type (str): コンテンツの種類。'text'、'file'、'image'のいずれか。
             label (str or None): クリップボードのラベル。省略可能。
+            data (bytes or None): エンコード済みの内容。指定した場合は再エンコードせずにそのまま保持します。
+            mime (str or None): dataのMIMEタイプ。
         """
         if 0 <= index < len(self.clipboards):
-            self.clipboards[index]['content'] = content
-            self.clipboards[index]['type'] = content_type
+            clipboard = self.clipboards[index]
+            clipboard['content'] = content
+            clipboard['type'] = content_type
+            if data is None and (content_type == 'image' or self.blob_store is not None or
+                                 self.journal is not None or self.history is not None):
+                data, mime = self.encode_content(index)
+            self.store_blob(index, data, mime)
+            if content_type == 'image':
+                # 画像はデコードした状態では保持しない
+                clipboard['content'] = None
+                clipboard['data'] = data if self.blob_store is None else None
+            else:
+                clipboard['data'] = None
             if label:
-                self.clipboards[index]['label'] = label
+                clipboard['label'] = label
+            elif content_type == 'image':
+                clipboard['label'] = self.generate_label(content if content is not None else data, content_type, key=clipboard['blob'])
+            else:
+                clipboard['label'] = self.generate_label(content, content_type, key=clipboard['blob'])
+            # 全ての内容を設定し終えてからバージョンを進める
+            with self.version_lock:
+                self.version += 1
+                clipboard['version'] = self.version
+                version = self.version
+            if content_type == 'image' and content is not None:
+                # 既にデコードされている画像（システムクリップボードからのコピー）はそのままキャッシュする
+                self.image_cache.put(self.image_cache_key(index), content)
+            if self.journal is not None:
+                self.journal.record(index, clipboard, data, mime)
+            if self.history is not None:
+                self.history.record(index, clipboard, data, mime)
+            if self.event_bus is not None:
+                self.event_bus.publish("clipboard_info", {"index": index, "version": version})
+            print(f'Set content to virtual clipboard {index}: {content if content is not None else mime}')
+
+    def encode_content(self, index):
+        """
+        仮想クリップボードの内容をバイト列にエンコードする関数。
+        テキストとファイルリストはUTF-8のテキスト、画像はPNGとしてエンコードします。
+
+        Args:
+            index (int): クリップボードのインデックス。
+
+        Returns:
+            tuple: エンコードしたデータとMIMEタイプのタプル。
+        """
+        clipboard = self.clipboards[index]
+        if clipboard['type'] == 'image':
+            return encode_image(clipboard['content'], 'PNG'), 'image/png'
+        elif clipboard['type'] == 'file':
+            return '\n'.join(clipboard['content']).encode('utf-8'), 'text/plain; charset=utf-8'
+        return str(clipboard['content']).encode('utf-8'), 'text/plain; charset=utf-8'
+
+    def store_blob(self, index, data=None, mime=None):
+        """
+        仮想クリップボードの内容をBlobStoreに保存し、以前の内容の参照を解放する関数。
+
+        Args:
+            index (int): クリップボードのインデックス。
+            data (bytes or None): エンコード済みのデータ。省略時はencode_content()でエンコードします。
+            mime (str or None): データのMIMEタイプ。
+        """
+        if self.blob_store is None:
+            return
+        clipboard = self.clipboards[index]
+        if data is None:
+            data, mime = self.encode_content(index)
+        previous_blob = clipboard['blob']
+        # ジャーナルがある場合は、ジャーナルが書き込んだファイルを後から受け取るため、ここでは書き出さない
+        clipboard['blob'] = self.blob_store.put(data, mime, spill=self.journal is None or self.journal.blob_store is not self.blob_store)
+        if previous_blob:
+            self.blob_store.release(previous_blob)
+
+    def image_cache_key(self, index):
+        """
+        デコードした画像をキャッシュするためのキーを取得する関数。
+
+        Args:
+            index (int): クリップボードのインデックス。
+
+        Returns:
+            キャッシュのキー。BlobStoreに保存されている場合は内容のハッシュ値。
+        """
+        clipboard = self.clipboards[index]
+        return clipboard['blob'] or (index, clipboard['version'])
+
+    def read_data(self, index):
+        """
+        仮想クリップボードのエンコードされた内容を読み込む関数。
+
+        Args:
+            index (int): クリップボードのインデックス。
+
+        Returns:
+            bytes: エンコードされた内容。読み込めない場合はNoneを返します。
+        """
+        clipboard = self.clipboards[index]
+        if clipboard['data'] is not None:
+            return clipboard['data']
+        if not clipboard['blob']:
+            return None
+        data = self.blob_store.get(clipboard['blob']) if self.blob_store is not None else None
+        if data is None and self.journal is not None:
+            data = self.journal.read_blob(clipboard['blob'])
+        return data
+
+    def load_content(self, index):
+        """
+        仮想クリップボードの内容を取得する関数。
+        画像と、ジャーナルから復元してまだ読み込まれていない内容は、保存したデータを読み込んでデコードします。
+        デコードした画像はimage_cacheにのみ保持します。
+
+        Args:
+            index (int): クリップボードのインデックス。
+
+        Returns:
+            内容（テキスト、ファイルパスのリスト、画像）。読み込めない場合はNoneを返します。
+        """
+        clipboard = self.clipboards[index]
+        if clipboard['type'] == 'image':
+            def load_image():
+                data = self.read_data(index)
+                if data is None:
+                    print(f'Failed to load content of virtual clipboard {index}')
+                    return None
+                return decode_image(data)
+
+            return self.image_cache.get_or_create(self.image_cache_key(index), load_image)
+        if clipboard['content'] is not None or not clipboard['blob']:
+            return clipboard['content']
+        data = self.read_data(index)
+        if data is None:
+            print(f'Failed to load content of virtual clipboard {index}')
+            return None
+        clipboard['content'] = decode_content(data, clipboard['type'])
+        return clipboard['content']
+
+    def get_image_payloads(self, index):
+        """
+        画像の仮想クリップボードの内容を、システムクリップボードに設定する各形式にエンコードしたものを取得する関数。
+        初回は各形式をスレッドプールで並行してエンコードし、内容ごとにキャッシュします。
+        保持しているデータがPNGの場合はそのまま使い、他の形式が必要な場合のみデコードします。
+
+        Args:
+            index (int): クリップボードのインデックス。
+
+        Returns:
+            dict: 形式をキーとし、エンコードしたデータを値とする辞書。
+        """
+        def create_payloads():
+            encoded = {}
+            blob = self.clipboards[index]['blob']
+            info = self.blob_store.get_info(blob) if blob and self.blob_store is not None else None
+            mime = info['mime'] if info is not None else None
+            if mime == 'image/png':
+                encoded[ENCODING_PNG] = self.read_data(index)
+            missing = any(encoding not in encoded for encoding in self.backend.image_payload_formats.values())
+            image = self.load_content(index) if missing else None
+            return self.backend.encode_image_payloads(image, self.image_encoder, encoded)
+
+        return self.image_payload_cache.get_or_create(self.image_cache_key(index), create_payloads)
+
+    def restore_from_journal(self):
+        """
+        ClipboardJournalから仮想クリップボードのラベル・種類・バージョンを復元する関数。
+        ジャーナルに直接保存したテキストとファイルリスト以外の内容は、必要になった時にload_content()で読み込みます。
+        """
+        for index, record in self.journal.load().items():
+            if not 0 <= index < len(self.clipboards):
+                continue
+            clipboard = self.clipboards[index]
+            clipboard['type'] = record['type']
+            clipboard['label'] = record['label']
+            clipboard['version'] = record['version']
+            clipboard['content'] = record.get('content')
+            if 'content' in record:
+                clipboard['blob'] = None
+                self.store_blob(index)
             else:
-                self.clipboards[index]['label'] = self.generate_label(content, content_type)
-            print(f'Set content to virtual clipboard {index}: {content}')
+                clipboard['blob'] = record['blob']
+                if self.blob_store is not None:
+                    self.blob_store.add_file(record['blob'], self.journal.blob_path(record['blob']), record['size'], record['mime'])
+            self.version = max(self.version, record['version'])
 
-    def generate_label(self, content, content_type, image_size=128):
+    def generate_label(self, content, content_type, image_size=None, key=None):
         """
         コンテンツに基づいてラベルを生成する関数。
+        画像の場合は縮小したサムネイルのデータURLをラベルとし、内容のハッシュ値ごとにキャッシュします。
+        元の画像はBlobStore経由で必要な時だけ取得します。
 
         Args:
-            content: 設定する内容（テキスト、ファイル、画像）。
+            content: 設定する内容（テキスト、ファイル、画像）。画像はエンコードされたバイト列でも構いません。
             content_type (str): コンテンツの種類。'text'、'file'、'image'のいずれか。
-            image_size (int): ラベル用画像のサイズ（ピクセル）。デフォルトは128。
+            image_size (int or None): ラベル用画像の長辺の最大サイズ（ピクセル）。省略時はthumbnail_size。
+            key (str or None): サムネイルをキャッシュするためのキー（内容のハッシュ値）。省略時はキャッシュしません。
 
         Returns:
             str: 生成されたラベルを返します。
         """
         if content_type == 'image':
-            
-            # png形式でエンコードしてBase64変換
-            output = io.BytesIO()
-            content.save(output, format='PNG', compress_level=9)
-            base64_data = base64.b64encode(output.getvalue()).decode('utf-8')
-            output.close()
+            image_size = image_size or self.thumbnail_size
+
+            def create_label():
+                # 縮小とエンコードはImagePipelineのワーカーで行い、同時に実行する画像処理の数を抑える
+                return self.image_pipeline.run_sync("clipboard_label", create_image_label, content, image_size,
+                                                    self.thumbnail_format, self.thumbnail_quality)
 
-            return f'data:image/png;base64,{base64_data}'
+            if key is None:
+                return create_label()
+            cache_key = (key, image_size, self.thumbnail_format, self.thumbnail_quality)
+            return self.thumbnail_cache.get_or_create(cache_key, create_label)
 
         elif content_type == 'text':
             return content.lstrip().replace('\n', ' ').replace('\r', '').replace(',', '，')[:120]
@@ -179,6 +637,61 @@ class VirtualClipboardManager:
             return self.clipboards[index]['label']
         return None
 
+    def wait_for_clipboard_change(self, sequence_number, fixed_delay):
+        """
+        システムクリップボードの内容が変わるまで待つ関数。
+        WAIT_MODE_FIXEDの場合はfixed_delayだけ待ちます。
+
+        Args:
+            sequence_number (int): 変更前に取得したシーケンス番号。
+            fixed_delay (float): WAIT_MODE_FIXEDで待つ時間（秒）。
+
+        Returns:
+            bool: 内容が変わった場合（WAIT_MODE_FIXEDでは常に）True。
+        """
+        if self.wait_mode == WAIT_MODE_FIXED:
+            self.backend.settle(fixed_delay)
+            return True
+        return self.backend.wait_for_change(sequence_number, self.change_timeout)
+
+    def wait_for_copy(self, sequence_number, fixed_delay, timeout=None):
+        """
+        コピー操作でシステムクリップボードの内容が変わり、コピー元がデータを設定し終えるまで待つ関数。
+        シーケンス番号はコピー元がクリップボードを空にした時点で変わるため、その後データを読み取れるようになるまで待ちます。
+        内容が変わるまではtimeout（何も選択されていない場合はその時間だけ待つ）、変わった後はchange_timeoutを上限とします。
+        WAIT_MODE_FIXEDの場合はfixed_delayだけ待ちます。
+
+        Args:
+            sequence_number (int): コピー操作を送る前に取得したシーケンス番号。
+            fixed_delay (float): WAIT_MODE_FIXEDで待つ時間（秒）。
+            timeout (float or None): 内容が変わるのを待つ時間の上限（秒）。省略時はcopy_timeout。
+
+        Returns:
+            bool: データを読み取れるようになった場合（WAIT_MODE_FIXEDでは常に）True。
+        """
+        if self.wait_mode == WAIT_MODE_FIXED:
+            self.backend.settle(fixed_delay)
+            return True
+        if not self.backend.wait_for_change(sequence_number, self.copy_timeout if timeout is None else timeout):
+            return False
+        return self.backend.wait_for_ready(timeout=self.change_timeout)
+
+    def wait_for_paste(self, fixed_delay):
+        """
+        ペースト操作が前面のアプリケーションで処理されるまで待つ関数。
+        WAIT_MODE_FIXEDの場合はfixed_delayだけ待ちます。
+
+        Args:
+            fixed_delay (float): WAIT_MODE_FIXEDで待つ時間（秒）。
+
+        Returns:
+            bool: 処理された場合（WAIT_MODE_FIXEDでは常に）True。
+        """
+        if self.wait_mode == WAIT_MODE_FIXED:
+            self.backend.settle(fixed_delay)
+            return True
+        return self.backend.wait_for_paste(self.change_timeout)
+
     def monitor_clipboard(self, index):
         """
         指定した仮想クリップボードにシステムクリップボードの変更を監視して保存する関数。
@@ -187,20 +700,20 @@ class VirtualClipboardManager:
             index (int): クリップボードのインデックス。
         """
         def monitor():
-            original_content = pyperclip.paste()
-            input_handler.execute_action('ctrl+c')
-            time.sleep(0.1)
+            original_content = self.backend.get_text()
+            self.backend.send_copy()
+            self.backend.settle(0.1)
             previous_content = original_content
 
             while self.monitoring:
-                current_content = pyperclip.paste()
+                current_content = self.backend.get_text()
                 if current_content != previous_content:
                     self.set_clipboard(index, current_content)
                     previous_content = current_content
                     break
-                time.sleep(0.1)
+                self.backend.settle(0.1)
             
-            pyperclip.copy(original_content)
+            self.backend.set_text(original_content)
 
         self.monitoring = True
         threading.Thread(target=monitor, daemon=True).start()
@@ -222,27 +735,28 @@ class VirtualClipboardManager:
         if 0 <= index < len(self.clipboards):
             # クリップボードの内容をバックアップ
             clipboard_backup = self.backup_clipboard()
-            time.sleep(0.1)
+            if self.wait_mode == WAIT_MODE_FIXED:
+                self.backend.settle(0.1)
             try:
-                # 仮想クリップボードの内容をシステムクリップボードにコピー
+                # 仮想クリップボードの内容をシステムクリップボードにコピーし、反映されてからペーストする
+                sequence_number = self.backend.get_sequence_number()
+                content = self.load_content(index) if self.clipboards[index]['type'] != 'image' else None
                 if self.clipboards[index]['type'] == 'text':
-                    pyperclip.copy(self.clipboards[index]['content'])
-                    time.sleep(0.1)
-                    input_handler.execute_action('ctrl+v')
-                    time.sleep(0.1)
+                    self.backend.set_text(content)
+                    self.wait_for_clipboard_change(sequence_number, 0.1)
+                    self.backend.send_paste()
+                    self.wait_for_paste(0.1)
                 elif self.clipboards[index]['type'] == 'file':
-                    powershell_command = 'powershell -Command "& { Set-Clipboard -LiteralPath ' + ','.join(['"{}"'.format(file) for file in self.clipboards[index]['content']]) + ' }"'
-                    process = Popen(powershell_command, shell=True, stdout=PIPE, stderr=PIPE)
-                    process.communicate()
-                    time.sleep(0.2)
-                    input_handler.execute_action('ctrl+v')
-                    time.sleep(0.2)
+                    self.backend.set_files(content)
+                    self.wait_for_clipboard_change(sequence_number, 0.2)
+                    self.backend.send_paste()
+                    self.wait_for_paste(0.2)
                     print('Pasted from virtual clipboard')
                 elif self.clipboards[index]['type'] == 'image':
-                    self.set_system_clipboard_image(self.clipboards[index]['content'])
-                    time.sleep(0.1)
-                    input_handler.execute_action('ctrl+v')
-                    time.sleep(0.1)
+                    self.backend.set_image_payloads(self.get_image_payloads(index))
+                    self.wait_for_clipboard_change(sequence_number, 0.1)
+                    self.backend.send_paste()
+                    self.wait_for_paste(0.1)
 
                 print(f'Pasted from virtual clipboard {index}.')
 
@@ -259,12 +773,15 @@ class VirtualClipboardManager:
             index (int): クリップボードのインデックス。
         """
         if 0 <= index < len(self.clipboards):
-            original_content = pyperclip.paste()
-            input_handler.execute_action('ctrl+c')
-            time.sleep(0.1)
-            new_content = pyperclip.paste()
+            original_content = self.backend.get_text()
+            sequence_number = self.backend.get_sequence_number()
+            self.backend.send_copy()
+            if not self.wait_for_copy(sequence_number, 0.1):
+                print(f'Nothing was copied to virtual clipboard {index}.')
+                return
+            new_content = self.backend.get_text()
             self.set_clipboard(index, new_content)
-            pyperclip.copy(original_content)
+            self.backend.set_text(original_content)
             print(f'Copied to virtual clipboard {index} and restored original clipboard.')
 
     def set_system_clipboard_file(self, file_path):
@@ -274,10 +791,7 @@ class VirtualClipboardManager:
         Args:
             file_path (str): 設定するファイルパス。
         """
-        win32clipboard.OpenClipboard()
-        win32clipboard.EmptyClipboard()
-        win32clipboard.SetClipboardData(win32con.CF_HDROP, file_path)
-        win32clipboard.CloseClipboard()
+        self.backend.set_files(file_path if isinstance(file_path, (list, tuple)) else [file_path])
 
     def get_system_clipboard_file(self):
         """
@@ -286,13 +800,7 @@ class VirtualClipboardManager:
         Returns:
             str: ファイルパスを返します。クリップボードにファイルがない場合はNoneを返します。
         """
-        win32clipboard.OpenClipboard()
-        try:
-            file_path = win32clipboard.GetClipboardData(win32con.CF_HDROP)
-        except TypeError:
-            file_path = None
-        win32clipboard.CloseClipboard()
-        return file_path
+        return self.backend.get_files()
 
     def copy_file_clipboard(self, index):
         """
@@ -310,51 +818,35 @@ class VirtualClipboardManager:
 
     def backup_clipboard(self):
         """
-        クリップボードの内容をすべての形式でバックアップする関数。
+        クリップボードの内容をbackup_formatsの形式でバックアップする関数。
+        前回のバックアップからシステムクリップボードが変わっていない場合は、読み取らずに前回のバックアップを返します。
         
         Returns:
             dict: バックアップされたクリップボードのデータ。
         """
-        win32clipboard.OpenClipboard()
-        clipboard_data = {}
-        format_id = 0
-
-        try:
-            format_id = win32clipboard.EnumClipboardFormats(0)
-            while format_id:
-                try:
-                    data = win32clipboard.GetClipboardData(format_id)
-                    clipboard_data[format_id] = data
-                except TypeError:
-                    pass
-                format_id = win32clipboard.EnumClipboardFormats(format_id)
-            
-            win32clipboard.CloseClipboard()
-        except Exception as e:
-            print(f"Error in backup_clipboard: {e}")
-            time.sleep(0.1)
-            win32clipboard.CloseClipboard()
-
+        sequence_number = self.backend.get_sequence_number()
+        if self.last_backup is not None and self.last_backup[0] == sequence_number:
+            return self.last_backup[1]
+        clipboard_data = self.backend.backup(self.backup_formats)
+        self.last_backup = (sequence_number, clipboard_data)
         return clipboard_data
     
     def restore_clipboard(self, clipboard_data):
         """
         クリップボードの内容をバックアップから復元する関数。
+        直前のバックアップからシステムクリップボードが変わっていない場合は復元を省略します。
 
         Args:
             clipboard_data (dict): バックアップされたクリップボードのデータ。
         """
-        win32clipboard.OpenClipboard()
-        try:
-            win32clipboard.EmptyClipboard()
-            
-            for format_id, data in clipboard_data.items():
-                try:
-                    win32clipboard.SetClipboardData(format_id, data)
-                except Exception as e:
-                    print(f"Failed to restore format {format_id}: {e}")
-        finally:
-            win32clipboard.CloseClipboard()
+        if self.last_backup is not None and self.last_backup[1] is clipboard_data:
+            if self.backend.get_sequence_number() == self.last_backup[0]:
+                return
+            self.backend.restore(clipboard_data)
+            # 復元した内容はバックアップと同じなので、次の操作ではバックアップを再利用できる
+            self.last_backup = (self.backend.get_sequence_number(), clipboard_data)
+            return
+        self.backend.restore(clipboard_data)
 
     def set_system_clipboard_image(self, image):
         """
@@ -363,34 +855,7 @@ class VirtualClipboardManager:
         Args:
             image (PIL.Image.Image): 設定する画像オブジェクト。
         """
-        # 画像をPNG形式でバイナリデータに変換
-        png_output = io.BytesIO()
-        image.save(png_output, 'PNG')
-        png_data = png_output.getvalue()
-        png_output.close()
-
-        # 画像をDIB(BMP)形式でバイナリデータに変換
-        bmp_output = io.BytesIO()
-        image.save(bmp_output, 'BMP')
-        bmp_data = bmp_output.getvalue()[14:]  # BMPヘッダを除去
-        bmp_output.close()
-
-        # クリップボードを開いて内容をクリア
-        win32clipboard.OpenClipboard()
-        win32clipboard.EmptyClipboard()
-
-        try:
-            # PNG形式をクリップボードに設定
-            png_format_id = win32clipboard.RegisterClipboardFormat("PNG")
-            win32clipboard.SetClipboardData(png_format_id, png_data)
-            
-            # DIB形式をクリップボードに設定
-            win32clipboard.SetClipboardData(win32con.CF_DIB, bmp_data)
-
-        except Exception as e:
-            print(f"Failed to set clipboard data: {e}")
-        finally:
-            win32clipboard.CloseClipboard()
+        self.backend.set_image(image)
 
     def get_system_clipboard_image(self):
         """
@@ -399,51 +864,7 @@ class VirtualClipboardManager:
         Returns:
             PIL.Image.Image: 画像オブジェクトを返します。クリップボードに画像がない場合はNoneを返します。
         """
-        win32clipboard.OpenClipboard()
-        # クリップボードにある最初のフォーマットを取得
-        format_id = win32clipboard.EnumClipboardFormats(0)
-        
-        # クリップボード内のすべてのフォーマットを列挙
-        while format_id:
-            try:
-                # フォーマットIDに対応する名前を取得
-                format_name = win32clipboard.GetClipboardFormatName(format_id)
-                if format_name:
-                    print(f"Format ID: {format_id}, Format Name: {format_name}")
-                else:
-                    print(f"Format ID: {format_id}, Format Name: (Standard format)")
-                
-                # 次のフォーマットIDを取得
-                format_id = win32clipboard.EnumClipboardFormats(format_id)
-            except Exception as e:
-                # print(f"Error in EnumClipboardFormats: {e}")
-                break
-
-        try:
-            # クリップボードのPNGフォーマットIDを使用してデータを取得
-            png_format = 49532  # 先ほど列挙したIDをここに指定
-            
-            if win32clipboard.IsClipboardFormatAvailable(png_format):
-                data = win32clipboard.GetClipboardData(png_format)
-            else:
-            # PNGが取得できなければCF_DIB形式を試す
-                if win32clipboard.IsClipboardFormatAvailable(win32con.CF_DIB):
-                    data = win32clipboard.GetClipboardData(win32con.CF_DIB)
-                else:
-                    data = None # 画像データが見つからない場合はNoneを返す
-        except TypeError:
-            data = None
-        win32clipboard.CloseClipboard()
-
-        if data:
-            image = Image.open(io.BytesIO(data))
-            if image.mode == 'RGBA':
-                # BMP形式で透過情報を保持
-                return image.convert("RGBA")
-            else:
-                # 透過情報が無い場合
-                return image.convert("RGB")
-        return None
+        return self.backend.get_image()
 
     def copy_image_clipboard(self, index):
         """
@@ -464,22 +885,20 @@ class VirtualClipboardManager:
 
         Args:
             index (int): クリップボードのインデックス。
-            content: コピーするコンテンツ。
-            type (str): コンテンツの種類。'text'、'file'、'image'のいずれか。
+            new_content (dict): コピーするコンテンツ。'type'にはコンテンツの種類（'text'または'image'）、
+                'content'にはテキスト、画像のデータURL、またはバイナリフレームや分割アップロードで受信した画像のバイト列を格納します。
         """
         if new_content["type"] == 'text':
             self.set_clipboard(index, new_content["content"], 'text', new_content["content"].lstrip().replace('\n', ' ').replace('\r', '').replace(',', '，')[:120])
             print(f'Copied text to virtual clipboard {index}')
         elif new_content["type"] == 'image':
-            image = load_base64_image(new_content["content"])
-            # # bmp形式に変換し、pillowで読み込む
-            # output = io.BytesIO()
-            # image.save(output, 'BMP')
-            # data = output.getvalue()[14:]  # BMPヘッダを除去
-            # output.close()
-            # image = Image.open(io.BytesIO(data))
-            
-            self.set_clipboard(index, image, 'image')
+            if isinstance(new_content["content"], (bytes, bytearray)):
+                data = bytes(new_content["content"])
+            else:
+                data = decode_base64_data(new_content["content"])
+            # デコードせずに形式だけを確認し、エンコードされたまま保持する
+            data, mime = prepare_image_data(data)
+            self.set_clipboard(index, None, 'image', data=data, mime=mime)
             print(f'Copied image to virtual clipboard {index}')
 
     def copy_clipboard_auto(self, index):
@@ -494,10 +913,15 @@ class VirtualClipboardManager:
             # クリップボードの内容をバックアップ
             clipboard_backup = self.backup_clipboard()
 
-            input_handler.execute_action('ctrl+c')
-            time.sleep(0.2)
+            sequence_number = self.backend.get_sequence_number()
+            self.backend.send_copy()
+            copied = self.wait_for_copy(sequence_number, 0.2)
 
             try:
+                if not copied:
+                    print(f'Nothing was copied to virtual clipboard {index}.')
+                    return
+
                 # ファイルの内容を確認
                 file_path = self.get_system_clipboard_file()
                 if file_path:
@@ -516,7 +940,7 @@ class VirtualClipboardManager:
                     return
 
                 # テキストの内容にデフォルト設定
-                new_content = pyperclip.paste()
+                new_content = self.backend.get_text()
                 self.set_clipboard(index, new_content, 'text', new_content.lstrip().replace('\n', ' ').replace('\r', '').replace(',', '，')[:120])
                 print(f'Copied text to virtual clipboard {index}')
 
@@ -0,0 +1,99 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# EventBus モジュール
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import threading
+
+## pypiライブラリ
+
+## 自作モジュール
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+
+
+#######################################################################################
+# クラス
+class EventBus:
+    """
+    トピック単位でイベントを配信する、アプリ内部のpub/subクラス。
+
+    publish() はどのスレッドからでも呼び出せます。購読者のコールバックは発行したスレッドで
+    同期的に呼び出されるため、イベントループ上で処理したい購読者は call_soon_threadsafe などで受け渡してください。
+    """
+
+    def __init__(self):
+        """
+        EventBusの初期化を行うコンストラクタ。
+
+        Attributes:
+            subscribers (dict): トピック名をキーとし、コールバックのリストを値とする辞書。
+        """
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def subscribe(self, topic: str, callback):
+        """
+        トピックを購読する関数。
+
+        Args:
+            topic (str): トピック名。
+            callback (Callable): callback(topic, data) の形で呼び出される関数。
+        """
+        with self.lock:
+            self.subscribers.setdefault(topic, []).append(callback)
+
+    def unsubscribe(self, topic: str, callback):
+        """
+        トピックの購読を解除する関数。
+
+        Args:
+            topic (str): トピック名。
+            callback (Callable): 購読時に指定した関数。
+        """
+        with self.lock:
+            if callback in self.subscribers.get(topic, []):
+                self.subscribers[topic].remove(callback)
+
+    def publish(self, topic: str, data=None):
+        """
+        イベントを発行し、トピックの購読者に通知する関数。
+
+        Args:
+            topic (str): トピック名。
+            data: イベントに付随するデータ。省略可能。
+        """
+        with self.lock:
+            callbacks = list(self.subscribers.get(topic, []))
+        for callback in callbacks:
+            try:
+                callback(topic, data)
+            except Exception as e:
+                print(f"Error in event subscriber for {topic}: {e}")
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    bus = EventBus()
+    bus.subscribe("clipboard_info", lambda topic, data: print(f"{topic}: {data}"))
+    bus.publish("clipboard_info", {"index": 0, "version": 1})
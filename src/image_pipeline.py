@@ -0,0 +1,215 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# ImagePipeline モジュール
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import asyncio
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import threading
+import time
+
+## pypiライブラリ
+
+## 自作モジュール
+from src.latency_stats import LatencyRecorder
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+PIPELINE_MODE_THREAD = 'thread'  # スレッドプールで実行する（PillowはGILを解放するため多くの処理はこれで並列化できる）
+PIPELINE_MODE_PROCESS = 'process'  # プロセスプールで実行する（関数と引数はpickle可能である必要がある）
+IMAGE_PIPELINE_MODE = PIPELINE_MODE_THREAD
+IMAGE_PIPELINE_WORKERS = 2  # 画像処理を並行して行うワーカーの数
+IMAGE_PIPELINE_STATS_SAMPLES = 1024  # 処理の種類ごとに統計用に保持する直近の待ち時間・実行時間の数
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+def _timed_call(func, args):
+    """
+    関数を実行し、戻り値と実行時間を返す関数（ワーカーで実行）。
+
+    Args:
+        func (Callable): 実行する関数。
+        args (tuple): 関数に渡す位置引数。
+
+    Returns:
+        tuple: 関数の戻り値と実行時間（秒）のタプル。
+    """
+    started_at = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started_at
+
+#######################################################################################
+# クラス
+class ImagePipeline:
+    """
+    画像のデコード・縮小・エンコードなどのCPU負荷の高い処理を、スレッドプールまたはプロセスプールで実行するクラス。
+
+    asyncioのイベントループからは run() を await することで、ループをブロックせずに結果を待てます。
+    処理の種類（name）ごとに、キューで待機した時間と実行時間を記録します。
+    プロセスプールを使用する場合、関数はモジュールの最上位で定義したものを渡してください。
+    """
+
+    def __init__(self, mode=IMAGE_PIPELINE_MODE, workers=IMAGE_PIPELINE_WORKERS):
+        """
+        ImagePipelineの初期化を行うコンストラクタ。ワーカーは最初の処理を追加した時に開始します。
+
+        Args:
+            mode (str): PIPELINE_MODE_THREADまたはPIPELINE_MODE_PROCESS。
+            workers (int): 処理を並行して行うワーカーの数。
+
+        Attributes:
+            run_times (LatencyRecorder): 処理の種類ごとの実行時間（直近IMAGE_PIPELINE_STATS_SAMPLES件）。
+            wait_times (LatencyRecorder): 処理の種類ごとのキューで待機した時間（直近IMAGE_PIPELINE_STATS_SAMPLES件）。
+
+        Raises:
+            ValueError: modeが不正な場合。
+        """
+        if mode not in (PIPELINE_MODE_THREAD, PIPELINE_MODE_PROCESS):
+            raise ValueError(f"Unknown image pipeline mode: {mode}")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.executor = None
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.failed = 0
+        # プロセスの終了まで使い続けるため、統計用のサンプルは直近のものだけを保持する
+        self.run_times = LatencyRecorder(max_samples=IMAGE_PIPELINE_STATS_SAMPLES)
+        self.wait_times = LatencyRecorder(max_samples=IMAGE_PIPELINE_STATS_SAMPLES)
+
+    def _get_executor(self):
+        """
+        処理を実行するExecutorを取得する関数。無い場合は作成します。
+
+        Returns:
+            Executor: ThreadPoolExecutorまたはProcessPoolExecutor。
+        """
+        with self.lock:
+            if self.executor is None:
+                if self.mode == PIPELINE_MODE_PROCESS:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-pipeline')
+            return self.executor
+
+    def submit(self, name: str, func, *args) -> Future:
+        """
+        処理をワーカーに追加する関数。
+
+        Args:
+            name (str): 統計に記録する処理の種類。
+            func (Callable): 実行する関数。
+            *args: 関数に渡す位置引数。
+
+        Returns:
+            Future: 処理結果を受け取るためのFutureオブジェクト。
+        """
+        future = Future()
+        queued_at = time.perf_counter()
+        with self.lock:
+            self.pending += 1
+
+        def on_done(inner):
+            elapsed = time.perf_counter() - queued_at
+            with self.lock:
+                self.pending -= 1
+            try:
+                result, run_time = inner.result()
+            except BaseException as e:
+                print(f"Error in image pipeline ({name}): {e}")
+                with self.lock:
+                    self.failed += 1
+                future.set_exception(e)
+                return
+            self.run_times.record(name, run_time)
+            self.wait_times.record(name, max(0.0, elapsed - run_time))
+            future.set_result(result)
+
+        self._get_executor().submit(_timed_call, func, args).add_done_callback(on_done)
+        return future
+
+    async def run(self, name: str, func, *args):
+        """
+        処理をワーカーに追加し、イベントループをブロックせずに完了を待つ非同期関数。
+
+        Args:
+            name (str): 統計に記録する処理の種類。
+            func (Callable): 実行する関数。
+            *args: 関数に渡す位置引数。
+
+        Returns:
+            関数の戻り値を返します。
+        """
+        return await asyncio.wrap_future(self.submit(name, func, *args))
+
+    def run_sync(self, name: str, func, *args):
+        """
+        処理をワーカーに追加し、完了を待つ関数。イベントループ以外のスレッドから呼び出してください。
+
+        Args:
+            name (str): 統計に記録する処理の種類。
+            func (Callable): 実行する関数。
+            *args: 関数に渡す位置引数。
+
+        Returns:
+            関数の戻り値を返します。
+        """
+        return self.submit(name, func, *args).result()
+
+    def get_stats(self):
+        """
+        実行中・待機中の処理数と、処理の種類ごとの待ち時間・実行時間の統計を取得する関数。
+
+        Returns:
+            dict: 統計情報を格納した辞書（時間はミリ秒）。
+        """
+        with self.lock:
+            pending, failed = self.pending, self.failed
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "pending": pending,
+            "failed": failed,
+            "run": self.run_times.get_stats(),
+            "wait": self.wait_times.get_stats(),
+        }
+
+    def close(self):
+        """
+        実行中の処理の完了を待ち、ワーカーを終了する関数。
+        """
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    from PIL import Image
+    from src.thumbnail import encode_thumbnail
+
+    for mode in (PIPELINE_MODE_THREAD, PIPELINE_MODE_PROCESS):
+        pipeline = ImagePipeline(mode)
+
+        async def main():
+            images = [Image.new('RGB', (1600, 1200), (i * 30, 128, 255 - i * 30)) for i in range(8)]
+            return await asyncio.gather(*[pipeline.run("thumbnail", encode_thumbnail, image) for image in images])
+
+        print(mode, [len(thumbnail) for thumbnail in asyncio.run(main())])
+        print(pipeline.get_stats())
+        pipeline.close()
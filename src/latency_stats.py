@@ -0,0 +1,198 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# LatencyStats モジュール
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+from collections import deque
+from contextlib import contextmanager
+import threading
+import time
+
+## pypiライブラリ
+
+## 自作モジュール
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+PERCENTILES = (50, 95, 99)
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # ヒストグラムの各区間の上限（ミリ秒）
+HISTOGRAM_WIDTH = 40  # ヒストグラムの棒の最大の長さ（文字数）
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+def percentile(sorted_samples, percent):
+    """
+    ソート済みのサンプルから指定したパーセンタイルの値を求める関数（最近傍法）。
+
+    Args:
+        sorted_samples (list): 昇順にソートされたサンプル。
+        percent (float): パーセンタイル（0〜100）。
+
+    Returns:
+        float: パーセンタイルの値。サンプルが無い場合は0.0。
+    """
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, round(percent / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+#######################################################################################
+# クラス
+class LatencyRecorder:
+    """
+    操作ごとの処理時間を記録し、平均・パーセンタイル・最大値を集計するスレッドセーフなクラス。
+
+    ベンチマークでは全てのサンプルを保持します。常駐するプロセスで使う場合はmax_samplesを指定し、
+    操作ごとに直近のサンプルのみを保持してください（回数は全期間の値、それ以外は直近のサンプルから集計します）。
+    """
+
+    def __init__(self, max_samples=None):
+        """
+        LatencyRecorderの初期化を行うコンストラクタ。
+
+        Args:
+            max_samples (int or None): 操作ごとに保持するサンプル数の上限。Noneの場合は全てのサンプルを保持します。
+
+        Attributes:
+            samples (dict): 操作名をキーとし、処理時間（秒）のリスト（max_samplesを指定した場合はdeque）を値とする辞書。
+            counts (dict): 操作名をキーとし、記録した回数を値とする辞書。
+        """
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.counts = {}
+
+    def record(self, name: str, seconds: float):
+        """
+        処理時間を記録する関数。
+
+        Args:
+            name (str): 操作名。
+            seconds (float): 処理時間（秒）。
+        """
+        with self.lock:
+            values = self.samples.get(name)
+            if values is None:
+                values = self.samples[name] = [] if self.max_samples is None else deque(maxlen=self.max_samples)
+            values.append(seconds)
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    @contextmanager
+    def measure(self, name: str):
+        """
+        with文のブロックの処理時間を記録するコンテキストマネージャ。
+
+        Args:
+            name (str): 操作名。
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def get_stats(self):
+        """
+        操作ごとの統計情報を取得する関数。
+
+        Returns:
+            dict: 操作名をキーとし、回数・平均・パーセンタイル・最大値（ミリ秒）を含む辞書を値とする辞書。
+                max_samplesを指定した場合、回数以外は直近のサンプルの値です。
+        """
+        with self.lock:
+            samples = {name: sorted(values) for name, values in self.samples.items()}
+            counts = dict(self.counts)
+        stats = {}
+        for name, values in samples.items():
+            entry = {"count": counts[name], "mean_ms": sum(values) / len(values) * 1000}
+            for percent in PERCENTILES:
+                entry[f"p{percent}_ms"] = percentile(values, percent) * 1000
+            entry["max_ms"] = values[-1] * 1000
+            stats[name] = entry
+        return stats
+
+    def format_table(self):
+        """
+        統計情報を表形式の文字列に整形する関数。
+
+        Returns:
+            str: 整形した統計情報。
+        """
+        columns = ["count", "mean_ms"] + [f"p{percent}_ms" for percent in PERCENTILES] + ["max_ms"]
+        lines = [f"{'operation':<24}" + "".join(f"{column:>12}" for column in columns)]
+        for name, entry in self.get_stats().items():
+            cells = [f"{entry['count']:>12d}"] + [f"{entry[column]:>12.3f}" for column in columns[1:]]
+            lines.append(f"{name:<24}" + "".join(cells))
+        return "\n".join(lines)
+
+    def get_histogram(self, name: str, buckets_ms=HISTOGRAM_BUCKETS_MS):
+        """
+        操作の処理時間のヒストグラムを取得する関数。
+
+        Args:
+            name (str): 操作名。
+            buckets_ms (tuple): 各区間の上限（ミリ秒）。最後の上限を超えたものは最後の区間の次にまとめます。
+
+        Returns:
+            list: (区間の上限（ミリ秒）またはNone, 件数) のタプルのリスト。Noneは最後の上限を超えた区間を表します。
+        """
+        with self.lock:
+            values = list(self.samples.get(name, []))
+        counts = [0] * (len(buckets_ms) + 1)
+        for value in values:
+            value_ms = value * 1000
+            for i, bound in enumerate(buckets_ms):
+                if value_ms <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return list(zip(list(buckets_ms) + [None], counts))
+
+    def format_histogram(self, name: str, buckets_ms=HISTOGRAM_BUCKETS_MS):
+        """
+        操作の処理時間のヒストグラムを文字列に整形する関数。
+
+        Args:
+            name (str): 操作名。
+            buckets_ms (tuple): 各区間の上限（ミリ秒）。
+
+        Returns:
+            str: 整形したヒストグラム。
+        """
+        histogram = self.get_histogram(name, buckets_ms)
+        peak = max([count for _, count in histogram] + [1])
+        lines = [name]
+        for bound, count in histogram:
+            label = f"<= {bound} ms" if bound is not None else f"> {buckets_ms[-1]} ms"
+            lines.append(f"  {label:>12} {count:>8d} {'#' * round(count / peak * HISTOGRAM_WIDTH)}")
+        return "\n".join(lines)
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    recorder = LatencyRecorder()
+    for i in range(100):
+        recorder.record("sample", i / 1000)
+    print(recorder.format_table())
+    print(recorder.format_histogram("sample"))
+    # 直近のサンプルのみを保持する場合、メモリ使用量は記録した回数によらず一定
+    bounded = LatencyRecorder(max_samples=10)
+    for i in range(100):
+        bounded.record("sample", i / 1000)
+    print(len(bounded.samples["sample"]), bounded.get_stats())
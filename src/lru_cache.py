@@ -0,0 +1,207 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# LRUCache モジュール
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+from collections import OrderedDict
+import threading
+
+## pypiライブラリ
+
+## 自作モジュール
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+
+
+#######################################################################################
+# クラス
+class LRUCache:
+    """
+    最近使われていない項目から削除する、スレッドセーフなキャッシュクラス。
+
+    項目数と合計サイズ（バイト）の上限を設定でき、ヒット数・ミス数を統計として取得できます。
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None, size_func=len, on_evict=None):
+        """
+        LRUCacheの初期化を行うコンストラクタ。
+
+        Args:
+            max_entries (int): 保持する項目数の上限。
+            max_bytes (int or None): 保持する合計サイズの上限。Noneの場合は制限しません。
+            size_func (Callable): 値のサイズを計算する関数。max_bytesを指定した場合に使用します。
+            on_evict (Callable or None): 上限を超えて削除した値、置き換えた値、clear() で削除した値を
+                (キー, 値) として受け取る関数。値が保持している資源の解放に使用します。
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_func = size_func
+        self.on_evict = on_evict
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def get(self, key, default=None):
+        """
+        キーに対応する値を取得する関数。取得した項目は最近使われたものとして扱います。
+
+        Args:
+            key: キャッシュのキー。
+            default: キーが無い場合に返す値。
+
+        Returns:
+            キャッシュされた値。キーが無い場合はdefaultを返します。
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+        値をキャッシュに追加する関数。上限を超えた場合は古い項目から削除します。
+
+        Args:
+            key: キャッシュのキー。
+            value: キャッシュする値。
+        """
+        size = self.size_func(value) if self.max_bytes is not None else 0
+        removed = []
+        with self.lock:
+            if key in self.entries:
+                replaced, replaced_size = self.entries.pop(key)
+                self.total_bytes -= replaced_size
+                if replaced is not value:
+                    removed.append((key, replaced))
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or
+                                    (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+                evicted_key, (evicted, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+                removed.append((evicted_key, evicted))
+        self._notify_evicted(removed)
+
+    def get_or_create(self, key, factory):
+        """
+        キーに対応する値を取得し、無い場合は作成してキャッシュに追加する関数。
+
+        Args:
+            key: キャッシュのキー。
+            factory (Callable): 値を作成する引数なしの関数。
+
+        Returns:
+            キャッシュされた値、または作成した値。
+        """
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def pop(self, key, default=None):
+        """
+        キーに対応する項目を削除する関数。
+
+        Args:
+            key: キャッシュのキー。
+            default: キーが無い場合に返す値。
+
+        Returns:
+            削除した値。キーが無い場合はdefaultを返します。
+        """
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value, size = self.entries.pop(key)
+            self.total_bytes -= size
+            return value
+
+    def clear(self):
+        """
+        キャッシュを空にする関数。
+        """
+        with self.lock:
+            removed = [(key, value) for key, (value, _) in self.entries.items()]
+            self.entries.clear()
+            self.total_bytes = 0
+        self._notify_evicted(removed)
+
+    def _notify_evicted(self, removed):
+        """
+        キャッシュから外れた値をon_evictに渡す関数。ロックの外で呼び出します。
+
+        Args:
+            removed (list): (キー, 値) のタプルのリスト。
+        """
+        if self.on_evict is None:
+            return
+        for key, value in removed:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                print(f"Error in LRU cache eviction callback: {e}")
+
+    def get_stats(self):
+        """
+        キャッシュの統計情報を取得する関数。
+
+        Returns:
+            dict: 項目数、合計サイズ、ヒット数、ミス数、ヒット率、削除数を含む辞書。
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    print("b" in cache, "a" in cache, cache.get_stats())
@@ -0,0 +1,487 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# MediaBackend モジュール
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import asyncio
+import io
+import threading
+import time
+
+## pypiライブラリ
+from PIL import Image
+
+# Windows専用のライブラリ（インストールされていない環境ではFakeMediaBackendのみ使用可能）
+try:
+    from winsdk.windows.media.control import GlobalSystemMediaTransportControlsSessionManager as MediaManager
+    from winsdk.windows.media.control import GlobalSystemMediaTransportControlsSessionPlaybackStatus as PlaybackStatus
+    from winsdk.windows.storage.streams import DataReader, Buffer, InputStreamOptions
+except Exception:
+    pass
+
+## 自作モジュール
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+MIN_THUMBNAIL_BUFFER_SIZE = 256 * 1024  # 最初に確保するサムネイル読み込み用バッファのサイズ（バイト）
+FAKE_THUMBNAIL_SIZE = 1200  # FakeMediaBackendが返すサムネイルの一辺のサイズ（ピクセル）
+FAKE_TRACK_DURATION = 180.0  # FakeMediaBackendの最初の曲の長さ（秒）。以降の曲は10秒ずつ長くなる
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+def create_fake_thumbnail(seed: int, size=FAKE_THUMBNAIL_SIZE) -> bytes:
+    """
+    FakeMediaBackendで使用するサムネイル（JPEG）を作成する関数。
+
+    Args:
+        seed (int): 色を決めるための番号。
+        size (int): 一辺のサイズ（ピクセル）。
+
+    Returns:
+        bytes: JPEGのバイト列。
+    """
+    image = Image.new('RGB', (size, size), ((seed * 67) % 256, (seed * 131) % 256, (seed * 29) % 256))
+    with io.BytesIO() as output:
+        image.save(output, format='JPEG', quality=90)
+        return output.getvalue()
+
+#######################################################################################
+# クラス
+class MediaBackend:
+    """
+    再生中のメディアの情報を取得するバックエンドの基底クラス。
+
+    MediaInfoManagerはこのインターフェースを通してのみメディア情報を取得するため、
+    実装を差し替えることでWindows以外の環境でもサムネイルの作成などの処理を実行できます。
+    watch() に対応するバックエンドでは、MediaWatcherがポーリングせずに変化の通知を受けた時だけ情報を取得します。
+    """
+
+    async def get_media_properties(self):
+        """
+        再生中のメディアの情報を取得する非同期関数。
+
+        Returns:
+            dict or None: artist・title・album_title・album_artist・track_number・thumbnail・timelineを含む辞書。
+                thumbnailはread_thumbnail() に渡すサムネイルの参照（無い場合はNone）。
+                timelineは position（last_updated時点の再生位置、秒）・duration（秒）・playback_rate・playing・
+                last_updated（UNIX時間、秒）を含む辞書（取得できない場合はNone）。再生中のメディアが無い場合はNone。
+        """
+        raise NotImplementedError
+
+    async def read_thumbnail(self, thumbnail):
+        """
+        サムネイルのデータを読み込む非同期関数。
+
+        Args:
+            thumbnail: get_media_properties() で取得したサムネイルの参照。
+
+        Returns:
+            bytes or bytearray or None: エンコードされたサムネイル画像。読み込めない場合はNone。
+        """
+        raise NotImplementedError
+
+    async def watch(self, callback):
+        """
+        再生中のセッションやメディアの情報が変化した時に通知を受ける関数を登録する非同期関数。
+
+        Args:
+            callback (Callable or None): 引数なしで呼び出される関数。どのスレッドから呼び出されるかは実装によります。
+                Noneの場合は登録を解除します。
+
+        Returns:
+            bool: 通知に対応している場合はTrue。Falseの場合、呼び出し元はポーリングで変化を確認してください。
+        """
+        return False
+
+    def close(self):
+        """
+        バックエンドが使用しているリソースを解放する関数。
+        """
+        pass
+
+
+class WinsdkMediaBackend(MediaBackend):
+    """
+    winsdkのGlobalSystemMediaTransportControlsSessionManagerでWindowsの再生中のメディアの情報を取得するバックエンドクラス。
+
+    サムネイルのストリームは専用スレッドで動作し続けるイベントループで読み込みます。
+    読み込み用のBufferはストリームのサイズに合わせて確保し、次の読み込みでも再利用します。
+    watch() を呼び出すとセッションマネージャーを保持し続け、再生中のセッションの切り替えと
+    メディア情報の変化のイベントを購読します（以降の取得でもrequest_async() を呼び出しません）。
+    """
+
+    def __init__(self):
+        """
+        WinsdkMediaBackendの初期化を行うコンストラクタ。サムネイルを読み込むスレッドを開始します。
+
+        Attributes:
+            buffer (Buffer or None): サムネイルの読み込みに再利用するバッファ。
+            buffer_allocations (int): バッファを確保した回数。
+            session_manager (MediaManager or None): watch() で取得し、保持し続けるセッションマネージャー。
+            session (Session or None): メディア情報の変化を購読している再生中のセッション。
+        """
+        self.buffer = None
+        self.buffer_allocations = 0
+        self.session_manager = None
+        self.session = None
+        self.session_changed_token = None
+        self.properties_changed_token = None
+        self.timeline_changed_token = None
+        self.playback_changed_token = None
+        self.watch_lock = threading.Lock()
+        self.watch_callback = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="media-thumbnail", daemon=True)
+        self.thread.start()
+
+    async def get_media_properties(self):
+        sessions = self.session_manager if self.session_manager is not None else await MediaManager.request_async()
+        current_session = sessions.get_current_session()
+        if not current_session:
+            return None
+        info = await current_session.try_get_media_properties_async()
+        return {
+            "artist": info.artist,
+            "title": info.title,
+            "album_title": info.album_title,
+            "album_artist": info.album_artist,
+            "track_number": info.track_number,
+            "thumbnail": info.thumbnail,
+            "timeline": self.get_timeline(current_session),
+        }
+
+    def get_timeline(self, session):
+        """
+        セッションの再生位置と再生状態を取得する関数。
+
+        Args:
+            session (Session): 再生中のセッション。
+
+        Returns:
+            dict or None: position・duration・playback_rate・playing・last_updatedを含む辞書。取得できない場合はNone。
+        """
+        try:
+            timeline = session.get_timeline_properties()
+            playback = session.get_playback_info()
+            duration = (timeline.end_time - timeline.start_time).total_seconds()
+            if duration <= 0:
+                return None
+            return {
+                "position": (timeline.position - timeline.start_time).total_seconds(),
+                "duration": duration,
+                "playback_rate": playback.playback_rate or 1.0,
+                "playing": playback.playback_status == PlaybackStatus.PLAYING,
+                "last_updated": timeline.last_updated_time.timestamp(),
+            }
+        except Exception as e:
+            print(f"Error in getting media timeline: {e}")
+            return None
+
+    async def read_thumbnail(self, thumbnail):
+        if not thumbnail:
+            return None
+        # 読み込みは専用スレッドのイベントループで1つずつ行い、呼び出し元のイベントループはブロックしない
+        future = asyncio.run_coroutine_threadsafe(self._read_stream(thumbnail), self.loop)
+        return await asyncio.wrap_future(future)
+
+    async def watch(self, callback):
+        self.watch_callback = callback
+        if callback is None or self.session_manager is not None:
+            return True
+        # イベントの購読は専用スレッドのイベントループで行い、セッションマネージャーを保持し続ける
+        future = asyncio.run_coroutine_threadsafe(self._subscribe(), self.loop)
+        try:
+            await asyncio.wrap_future(future)
+        except Exception as e:
+            print(f"Error in watching media sessions: {e}")
+            self.watch_callback = None
+            return False
+        return True
+
+    async def _subscribe(self):
+        """
+        セッションマネージャーを取得し、再生中のセッションの切り替えのイベントを購読する非同期関数（専用スレッドのイベントループで実行）。
+        """
+        self.session_manager = await MediaManager.request_async()
+        self.session_changed_token = self.session_manager.add_current_session_changed(self._on_session_changed)
+        self._subscribe_session()
+
+    def _subscribe_session(self):
+        """
+        再生中のセッションのメディア情報・再生位置・再生状態の変化のイベントを購読し直す関数。以前のセッションの購読は解除します。
+        """
+        with self.watch_lock:
+            self._unsubscribe_session()
+            self.session = self.session_manager.get_current_session()
+            if self.session is not None:
+                self.properties_changed_token = self.session.add_media_properties_changed(self._on_properties_changed)
+                self.timeline_changed_token = self.session.add_timeline_properties_changed(self._on_properties_changed)
+                self.playback_changed_token = self.session.add_playback_info_changed(self._on_properties_changed)
+
+    def _unsubscribe_session(self):
+        """
+        再生中のセッションのイベントの購読を解除する関数。watch_lockを取得してから呼び出してください。
+        """
+        if self.session is not None:
+            try:
+                if self.properties_changed_token is not None:
+                    self.session.remove_media_properties_changed(self.properties_changed_token)
+                if self.timeline_changed_token is not None:
+                    self.session.remove_timeline_properties_changed(self.timeline_changed_token)
+                if self.playback_changed_token is not None:
+                    self.session.remove_playback_info_changed(self.playback_changed_token)
+            except Exception as e:
+                print(f"Error in unsubscribing media session: {e}")
+        self.session = None
+        self.properties_changed_token = None
+        self.timeline_changed_token = None
+        self.playback_changed_token = None
+
+    def _on_session_changed(self, sender, args):
+        """
+        再生中のセッションが切り替わった時に呼び出される関数（WinRTのスレッドで実行）。
+        """
+        self._subscribe_session()
+        self._notify()
+
+    def _on_properties_changed(self, sender, args):
+        """
+        再生中のセッションのメディア情報・再生位置・再生状態が変化した時に呼び出される関数（WinRTのスレッドで実行）。
+        """
+        self._notify()
+
+    def _notify(self):
+        """
+        watch() で登録された関数を呼び出す関数。
+        """
+        callback = self.watch_callback
+        if callback is not None:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in media change callback: {e}")
+
+    def get_buffer(self, size: int):
+        """
+        サムネイルの読み込みに使用するバッファを取得する関数。容量が足りない場合のみ確保し直します。
+
+        Args:
+            size (int): 必要なサイズ（バイト）。
+
+        Returns:
+            Buffer: バッファ。
+        """
+        if self.buffer is None or self.buffer.capacity < size:
+            capacity = MIN_THUMBNAIL_BUFFER_SIZE
+            while capacity < size:
+                capacity *= 2
+            self.buffer = Buffer(capacity)
+            self.buffer_allocations += 1
+        return self.buffer
+
+    async def _read_stream(self, stream_ref):
+        """
+        ストリームをバッファに読み込み、バイト列として取得する非同期関数（専用スレッドのイベントループで実行）。
+
+        Args:
+            stream_ref: 読み込み元のストリーム参照。
+
+        Returns:
+            bytearray or None: 読み込んだデータ。失敗した場合はNone。
+        """
+        try:
+            readable_stream = await stream_ref.open_read_async()
+            try:
+                size = readable_stream.size
+                buffer = self.get_buffer(size)
+                await readable_stream.read_async(buffer, size, InputStreamOptions.READ_AHEAD)
+                data = bytearray(buffer.length)
+                DataReader.from_buffer(buffer).read_bytes(data)
+                return data
+            finally:
+                readable_stream.close()
+        except Exception as e:
+            print(f"Error reading stream: {e}")
+            return None
+
+    def close(self):
+        self.watch_callback = None
+        if self.session_manager is not None and self.session_changed_token is not None:
+            self.session_manager.remove_current_session_changed(self.session_changed_token)
+        with self.watch_lock:
+            self._unsubscribe_session()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class FakeMediaBackend(MediaBackend):
+    """
+    再生中のメディアを模擬するバックエンドクラス。Windows以外の環境での負荷試験やベンチマークに使用します。
+    next_track() で曲を切り替え、stop() で再生を停止した状態にします。
+    pause()・play()・seek() で再生位置と再生状態を変更できます（再生中の位置は時刻から計算します）。
+    watch() で登録した関数には、これらの操作のたびに呼び出し元のスレッドで通知します。
+    """
+
+    def __init__(self, track_count=10, thumbnail_size=FAKE_THUMBNAIL_SIZE, read_delay=0.0):
+        """
+        FakeMediaBackendの初期化を行うコンストラクタ。
+
+        Args:
+            track_count (int): 模擬する曲の数。
+            thumbnail_size (int): サムネイルの一辺のサイズ（ピクセル）。
+            read_delay (float): サムネイルの読み込みにかかる時間（秒）。
+
+        Attributes:
+            tracks (list): 曲の情報の辞書のリスト。"thumbnail"はサムネイルのJPEGのバイト列、"duration"は曲の長さ（秒）。
+            current (int or None): 再生中の曲のインデックス。停止中はNone。
+            position (float): last_updated時点の再生位置（秒）。
+            playing (bool): 再生中かどうか。
+            playback_rate (float): 再生速度。
+            last_updated (float): 再生位置を更新した時刻（UNIX時間、秒）。
+            thumbnail_reads (int): サムネイルを読み込んだ回数。
+            property_reads (int): メディアの情報を取得した回数。
+        """
+        self.tracks = [{
+            "artist": f"Artist {i % 3}",
+            "title": f"Track {i}",
+            "album_title": f"Album {i % 3}",
+            "album_artist": f"Artist {i % 3}",
+            "track_number": i + 1,
+            "thumbnail": create_fake_thumbnail(i, thumbnail_size),
+            "duration": FAKE_TRACK_DURATION + i * 10,
+        } for i in range(track_count)]
+        self.read_delay = read_delay
+        self.current = 0
+        self.position = 0.0
+        self.playing = True
+        self.playback_rate = 1.0
+        self.last_updated = time.time()
+        self.thumbnail_reads = 0
+        self.property_reads = 0
+        self.watch_callback = None
+
+    def next_track(self):
+        """
+        次の曲に切り替える関数。停止中の場合は最初の曲を再生します。
+        """
+        self.current = 0 if self.current is None else (self.current + 1) % len(self.tracks)
+        self.playing = True
+        self._set_position(0.0)
+
+    def stop(self):
+        """
+        再生を停止した状態にする関数。
+        """
+        self.current = None
+        self._notify()
+
+    def get_position(self) -> float:
+        """
+        現在の再生位置を取得する関数。
+
+        Returns:
+            float: 再生位置（秒）。
+        """
+        if not self.playing:
+            return self.position
+        return self.position + (time.time() - self.last_updated) * self.playback_rate
+
+    def pause(self):
+        """
+        現在の再生位置で一時停止する関数。
+        """
+        self._set_position(self.get_position())
+        self.playing = False
+        self._notify()
+
+    def play(self):
+        """
+        一時停止した位置から再生を再開する関数。
+        """
+        self._set_position(self.get_position(), notify=False)
+        self.playing = True
+        self._notify()
+
+    def seek(self, position: float):
+        """
+        再生位置を変更する関数。
+
+        Args:
+            position (float): 再生位置（秒）。
+        """
+        self._set_position(position)
+
+    def _set_position(self, position: float, notify=True):
+        """
+        再生位置を設定し、再生位置の更新時刻を現在の時刻にする関数。
+
+        Args:
+            position (float): 再生位置（秒）。
+            notify (bool): watch() で登録された関数に通知するかどうか。
+        """
+        self.position = position
+        self.last_updated = time.time()
+        if notify:
+            self._notify()
+
+    def _notify(self):
+        """
+        watch() で登録された関数を呼び出す関数。
+        """
+        if self.watch_callback is not None:
+            self.watch_callback()
+
+    async def watch(self, callback):
+        self.watch_callback = callback
+        return True
+
+    async def get_media_properties(self):
+        self.property_reads += 1
+        if self.current is None:
+            return None
+        properties = dict(self.tracks[self.current])
+        properties["timeline"] = {
+            "position": self.position,
+            "duration": properties.pop("duration"),
+            "playback_rate": self.playback_rate,
+            "playing": self.playing,
+            "last_updated": self.last_updated,
+        }
+        return properties
+
+    async def read_thumbnail(self, thumbnail):
+        if not thumbnail:
+            return None
+        if self.read_delay > 0:
+            await asyncio.sleep(self.read_delay)
+        self.thumbnail_reads += 1
+        return thumbnail
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    async def main():
+        backend = FakeMediaBackend(track_count=2, thumbnail_size=64)
+        for _ in range(3):
+            properties = await backend.get_media_properties()
+            data = await backend.read_thumbnail(properties["thumbnail"])
+            print(properties["title"], len(data))
+            backend.next_track()
+
+    asyncio.run(main())
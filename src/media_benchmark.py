@@ -0,0 +1,142 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# Media ベンチマーク モジュール
+# FakeMediaBackendを使い、MediaInfoManagerのメディア情報の取得（曲の切り替え時のサムネイル作成を含む）の処理時間を計測します。
+# --mode watch では、MediaWatcherが曲の切り替えの通知を受けてから "audio_info" イベントを発行するまでの時間を計測します。
+# 使い方: python -m src.media_benchmark --cycles 200 --thumbnail-size 1200 --mode watch
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import argparse
+import asyncio
+
+## pypiライブラリ
+
+## 自作モジュール
+from src.audio_info import MediaInfoManager
+from src.event_bus import EventBus
+from src.image_pipeline import ImagePipeline, IMAGE_PIPELINE_MODE, IMAGE_PIPELINE_WORKERS, PIPELINE_MODE_THREAD, PIPELINE_MODE_PROCESS
+from src.latency_stats import LatencyRecorder
+from src.media_backend import FakeMediaBackend, FAKE_THUMBNAIL_SIZE
+from src.media_watcher import MediaWatcher, MEDIA_CHANGE_DEBOUNCE
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+DEFAULT_CYCLES = 200
+DEFAULT_TRACKS = 10
+DEFAULT_POLLS_PER_TRACK = 4  # 1曲あたりの取得回数。2回目以降は曲が変わっていない状態の取得になる
+MODE_POLL = 'poll'  # 一定間隔で取得する（1曲あたりpolls_per_track回）
+MODE_WATCH = 'watch'  # MediaWatcherが変化の通知を受けた時だけ取得する
+WATCH_TIMEOUT = 5.0  # watchモードでイベントの発行を待つ時間の上限（秒）
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+async def run_benchmark_async(cycles=DEFAULT_CYCLES, track_count=DEFAULT_TRACKS, thumbnail_size=FAKE_THUMBNAIL_SIZE,
+                              polls_per_track=DEFAULT_POLLS_PER_TRACK, read_delay=0.0, recorder=None,
+                              pipeline_mode=IMAGE_PIPELINE_MODE, pipeline_workers=IMAGE_PIPELINE_WORKERS,
+                              mode=MODE_POLL, debounce=MEDIA_CHANGE_DEBOUNCE):
+    """
+    曲の切り替えとメディア情報の取得を繰り返し、処理時間を計測する非同期関数。
+    pollモードでは曲が変わった直後の取得を "track_changed"、それ以外を "same_track" として記録します。
+    watchモードでは曲を切り替えてから "audio_info" イベントが発行されるまでの時間を "watch_track_changed" として記録します。
+
+    Args:
+        cycles (int): 曲を切り替える回数。
+        track_count (int): 模擬する曲の数。
+        thumbnail_size (int): 元のサムネイルの一辺のサイズ（ピクセル）。
+        polls_per_track (int): 1曲あたりのメディア情報の取得回数。
+        read_delay (float): サムネイルの読み込みにかかる時間（秒）。
+        recorder (LatencyRecorder or None): 計測結果を記録するLatencyRecorder。省略時は新たに作成します。
+        pipeline_mode (str): サムネイルを作成するImagePipelineの実行方法（'thread' または 'process'）。
+        pipeline_workers (int): ImagePipelineのワーカーの数。
+        mode (str): MODE_POLLまたはMODE_WATCH。
+        debounce (float): watchモードでMediaWatcherが通知をまとめる時間（秒）。
+
+    Returns:
+        LatencyRecorder: 計測結果。
+    """
+    recorder = recorder if recorder is not None else LatencyRecorder()
+    backend = FakeMediaBackend(track_count, thumbnail_size, read_delay)
+    pipeline = ImagePipeline(pipeline_mode, pipeline_workers)
+    event_bus = EventBus()
+    manager = MediaInfoManager(event_bus=event_bus, backend=backend, image_pipeline=pipeline)
+    if mode == MODE_WATCH:
+        # イベントはイベントループ上のMediaWatcherの取得処理から発行される
+        changed = asyncio.Event()
+        event_bus.subscribe("audio_info", lambda topic, data: changed.set())
+        watcher = MediaWatcher(manager, debounce=debounce, media_options={"quality": 60})
+        await watcher.start()
+        await asyncio.wait_for(changed.wait(), WATCH_TIMEOUT)
+        for cycle in range(cycles):
+            changed.clear()
+            with recorder.measure("watch_track_changed"):
+                backend.next_track()
+                await asyncio.wait_for(changed.wait(), WATCH_TIMEOUT)
+        await watcher.stop()
+        print(f"Watcher: {watcher.get_stats()}")
+    else:
+        for cycle in range(cycles):
+            backend.next_track()
+            for poll in range(polls_per_track):
+                with recorder.measure("track_changed" if poll == 0 else "same_track"):
+                    await manager.get_media_info_async(quality=60)
+    print(f"Property reads: {backend.property_reads}")
+    print(f"Thumbnail reads: {backend.thumbnail_reads}")
+    print(f"Thumbnail cache: {manager.get_thumbnail_stats()}")
+    pipeline_stats = pipeline.get_stats()
+    for name, entry in pipeline_stats["run"].items():
+        print(f"Image pipeline ({pipeline_mode}) {name}: run mean {entry['mean_ms']:.3f} ms, "
+              f"wait mean {pipeline_stats['wait'][name]['mean_ms']:.3f} ms")
+    pipeline.close()
+    return recorder
+
+def run_benchmark(*args, **kwargs):
+    """
+    run_benchmark_async() を新しいイベントループで実行する関数。
+
+    Returns:
+        LatencyRecorder: 計測結果。
+    """
+    return asyncio.run(run_benchmark_async(*args, **kwargs))
+
+#######################################################################################
+# クラス
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="MediaInfoManagerのメディア情報取得のベンチマーク")
+    parser.add_argument("--cycles", type=int, default=DEFAULT_CYCLES, help="曲を切り替える回数")
+    parser.add_argument("--tracks", type=int, default=DEFAULT_TRACKS, help="模擬する曲の数")
+    parser.add_argument("--thumbnail-size", type=int, default=FAKE_THUMBNAIL_SIZE, help="元のサムネイルの一辺のサイズ（ピクセル）")
+    parser.add_argument("--polls", type=int, default=DEFAULT_POLLS_PER_TRACK, help="1曲あたりのメディア情報の取得回数")
+    parser.add_argument("--read-delay", type=float, default=0.0, help="サムネイルの読み込みにかかる時間（秒）")
+    parser.add_argument("--mode", choices=[MODE_POLL, MODE_WATCH], default=MODE_POLL, help="メディア情報の取得方法")
+    parser.add_argument("--debounce", type=float, default=MEDIA_CHANGE_DEBOUNCE, help="watchモードで通知をまとめる時間（秒）")
+    parser.add_argument("--pipeline-mode", choices=[PIPELINE_MODE_THREAD, PIPELINE_MODE_PROCESS], default=IMAGE_PIPELINE_MODE,
+                        help="サムネイルを作成するImagePipelineの実行方法")
+    parser.add_argument("--pipeline-workers", type=int, default=IMAGE_PIPELINE_WORKERS, help="ImagePipelineのワーカーの数")
+    parser.add_argument("--histogram", action="store_true", help="操作ごとのヒストグラムを表示する")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.cycles, args.tracks, args.thumbnail_size, args.polls, args.read_delay,
+                           pipeline_mode=args.pipeline_mode, pipeline_workers=args.pipeline_workers,
+                           mode=args.mode, debounce=args.debounce)
+    print(result.format_table())
+    if args.histogram:
+        for name in result.get_stats():
+            print(result.format_histogram(name))
@@ -0,0 +1,204 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# MediaWatcher モジュール
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import asyncio
+import threading
+
+## pypiライブラリ
+
+## 自作モジュール
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+MEDIA_CHANGE_DEBOUNCE = 0.1  # 変化の通知を受けてから情報を取得するまでの時間（秒）。続けて届く通知を1回の取得にまとめる
+THUMBNAIL_VERIFY_DELAY = 1.5  # 曲が変わってからサムネイルの元画像を確認し直すまでの時間（秒）
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+
+
+#######################################################################################
+# クラス
+class MediaWatcher:
+    """
+    MediaBackendの変化の通知を受けた時だけMediaInfoManagerの情報を更新するクラス。
+
+    - 通知はどのスレッドから届いても構いません。イベントループに受け渡し、debounceの間に届いた通知は1回の取得にまとめます。
+    - 情報が実際に変化した場合のみ、MediaInfoManagerが "audio_info" イベントを発行します。
+    - 曲の切り替え直後は前の曲のサムネイルが返ることがあるため、verify_delay後にサムネイルを確認し直します。
+    - バックエンドが通知に対応していない場合、start() はFalseを返します。呼び出し元は refresh() でポーリングしてください。
+    """
+
+    def __init__(self, manager, debounce=MEDIA_CHANGE_DEBOUNCE, verify_delay=THUMBNAIL_VERIFY_DELAY, media_options=None):
+        """
+        MediaWatcherの初期化を行うコンストラクタ。
+
+        Args:
+            manager (MediaInfoManager): 情報を更新するMediaInfoManager。
+            debounce (float): 変化の通知を受けてから情報を取得するまでの時間（秒）。
+            verify_delay (float): 曲が変わってからサムネイルを確認し直すまでの時間（秒）。
+            media_options (dict or None): get_media_info_async() に渡す引数（image_sizes・lossless・quality）。
+
+        Attributes:
+            watching (bool): バックエンドから変化の通知を受けているかどうか。
+            notifications (int): 受けた変化の通知の数。
+            refreshes (int): 情報を取得した回数。
+        """
+        self.manager = manager
+        self.debounce = debounce
+        self.verify_delay = verify_delay
+        self.media_options = dict(media_options or {})
+        self.loop = None
+        self.started = False
+        self.watching = False
+        self.refresh_handle = None
+        self.verify_handle = None
+        self.refresh_lock = None
+        self.tasks = set()
+        self.stats_lock = threading.Lock()
+        self.notifications = 0
+        self.refreshes = 0
+
+    async def start(self) -> bool:
+        """
+        バックエンドの変化の通知の購読を開始し、現在の情報を取得する非同期関数。2回目以降の呼び出しでは何もしません。
+
+        Returns:
+            bool: 変化の通知を受けている場合はTrue。Falseの場合は refresh() でポーリングしてください。
+        """
+        if self.started:
+            return self.watching
+        self.started = True
+        self.loop = asyncio.get_running_loop()
+        self.refresh_lock = asyncio.Lock()
+        self.watching = await self.manager.backend.watch(self.notify)
+        if self.watching:
+            self.schedule_refresh(0)
+        return self.watching
+
+    def notify(self):
+        """
+        バックエンドから変化の通知を受ける関数。どのスレッドからでも呼び出せます。
+        """
+        with self.stats_lock:
+            self.notifications += 1
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.schedule_refresh, self.debounce)
+
+    def schedule_refresh(self, delay: float):
+        """
+        情報の取得を予約する関数（イベントループで実行）。既に予約されている場合はまとめます。
+
+        Args:
+            delay (float): 取得するまでの時間（秒）。
+        """
+        if self.refresh_handle is None:
+            self.refresh_handle = self.loop.call_later(delay, self._start_refresh, False)
+
+    def _start_refresh(self, verify: bool):
+        """
+        予約した時間になった時に情報の取得を開始する関数（イベントループで実行）。
+
+        Args:
+            verify (bool): サムネイルを確認し直すかどうか。
+        """
+        if verify:
+            self.verify_handle = None
+        else:
+            self.refresh_handle = None
+        task = self.loop.create_task(self.refresh(verify))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def refresh(self, verify=False):
+        """
+        現在の情報を取得する非同期関数。変化した場合はMediaInfoManagerがイベントを発行します。
+
+        Args:
+            verify (bool): 曲が変わっていない場合も、サムネイルの元画像が変わっていないか確認するかどうか。
+
+        Returns:
+            dict or None: 現在のメディア情報。
+        """
+        try:
+            async with self.refresh_lock:
+                previous = self.manager.get_current_media_info()
+                info, _ = await self.manager.get_media_info_async(verify_thumbnail=verify, **self.media_options)
+                with self.stats_lock:
+                    self.refreshes += 1
+        except Exception as e:
+            print(f"Error in refreshing media info: {e}")
+            return None
+        if self.watching and info is not None and (previous is None or previous["title"] != info["title"]):
+            if self.verify_handle is not None:
+                self.verify_handle.cancel()
+            self.verify_handle = self.loop.call_later(self.verify_delay, self._start_refresh, True)
+        return info
+
+    async def stop(self):
+        """
+        変化の通知の購読を解除し、予約した取得を取り消す非同期関数。
+        """
+        if self.watching:
+            await self.manager.backend.watch(None)
+        for handle in (self.refresh_handle, self.verify_handle):
+            if handle is not None:
+                handle.cancel()
+        self.refresh_handle = None
+        self.verify_handle = None
+        self.started = False
+        self.watching = False
+
+    def get_stats(self):
+        """
+        受けた通知の数と情報を取得した回数を取得する関数。
+
+        Returns:
+            dict: 統計情報を格納した辞書。
+        """
+        with self.stats_lock:
+            return {"watching": self.watching, "notifications": self.notifications, "refreshes": self.refreshes}
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    from src.audio_info import MediaInfoManager
+    from src.event_bus import EventBus
+    from src.media_backend import FakeMediaBackend
+
+    async def main():
+        event_bus = EventBus()
+        event_bus.subscribe("audio_info", lambda topic, data: print(topic, manager.get_current_media_info()))
+        backend = FakeMediaBackend(track_count=3, thumbnail_size=64)
+        manager = MediaInfoManager(event_bus=event_bus, backend=backend)
+        watcher = MediaWatcher(manager, verify_delay=0.2)
+        print("watching:", await watcher.start())
+        await asyncio.sleep(0.3)
+        # 続けて届いた通知は1回の取得にまとめられる
+        backend.next_track()
+        backend.next_track()
+        await asyncio.sleep(0.5)
+        backend.stop()
+        await asyncio.sleep(0.3)
+        print(watcher.get_stats(), "property reads:", backend.property_reads)
+        await watcher.stop()
+        manager.image_pipeline.close()
+
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# Thumbnail モジュール
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import io
+
+## pypiライブラリ
+from PIL import Image
+
+## 自作モジュール
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+THUMBNAIL_MAX_SIZE = 128  # サムネイルの長辺の最大サイズ（ピクセル）
+THUMBNAIL_FORMAT = 'WEBP'
+THUMBNAIL_QUALITY = 70
+THUMBNAIL_MIME_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg', 'PNG': 'image/png'}
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+def resize_to_fit(image: Image.Image, max_size: int) -> Image.Image:
+    """
+    アスペクト比を保ったまま、長辺がmax_size以下になるよう縮小する関数。
+    元の画像がmax_size以下の場合はそのまま返します。
+
+    Args:
+        image (PIL.Image.Image): 縮小する画像。
+        max_size (int): 長辺の最大サイズ（ピクセル）。
+
+    Returns:
+        PIL.Image.Image: 縮小した画像。
+    """
+    scale = min(max_size / image.width, max_size / image.height)
+    if scale >= 1:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    # reducing_gapにより、大きな画像は先に整数倍で縮小してからLANCZOSで仕上げる
+    return image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+def encode_thumbnail(image: Image.Image, max_size=THUMBNAIL_MAX_SIZE, image_format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY) -> bytes:
+    """
+    画像を縮小し、サムネイルとしてエンコードする関数。
+
+    Args:
+        image (PIL.Image.Image): 元の画像。
+        max_size (int): 長辺の最大サイズ（ピクセル）。
+        image_format (str): エンコード形式。'WEBP'、'JPEG'、'PNG'のいずれか。
+        quality (int): 非可逆圧縮の品質。
+
+    Returns:
+        bytes: エンコードされたサムネイル。
+    """
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    thumbnail = resize_to_fit(image, max_size)
+    if image_format == 'JPEG' and thumbnail.mode == 'RGBA':
+        # JPEGは透過に対応しないため白背景に合成する
+        background = Image.new('RGB', thumbnail.size, (255, 255, 255))
+        background.paste(thumbnail, mask=thumbnail.getchannel('A'))
+        thumbnail = background
+    with io.BytesIO() as output:
+        if image_format == 'PNG':
+            thumbnail.save(output, format=image_format)
+        else:
+            thumbnail.save(output, format=image_format, quality=quality)
+        return output.getvalue()
+
+#######################################################################################
+# クラス
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    sample = Image.new('RGB', (1920, 1080), (0, 128, 255))
+    data = encode_thumbnail(sample)
+    print(f"Thumbnail: {len(data)} bytes, {Image.open(io.BytesIO(data)).size}")
@@ -0,0 +1,269 @@
+#! /usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+# UploadManager モジュール
+#
+# 分割アップロードの手順:
+#   1. upload_init   : サイズ・MIMEタイプ・（任意で）SHA-256を送り、upload_idとチャンクサイズを受け取る
+#   2. upload_chunk  : offsetを付けてチャンクを順に送る。受信のたびに upload_progress で受信済みのサイズを返す
+#   3. upload_commit : 全て送り終えたら確定する。サイズとハッシュ値を検証した一時ファイルのパスを処理に渡す
+
+#######################################################################################
+# import処理
+## 標準ライブラリ
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+## pypiライブラリ
+
+## 自作モジュール
+
+## その他
+# 疑似グローバル変数管理モジュール
+try:
+    from global_value_handler import g
+except Exception:
+    pass
+
+#######################################################################################
+# 定数
+MAX_UPLOAD_SIZE = 64 * 1024 * 1024  # 1回のアップロードで受け付ける最大サイズ（バイト）
+CHUNK_SIZE = 512 * 1024  # クライアントに指定するチャンクのサイズ（バイト）
+UPLOAD_TIMEOUT = 300  # チャンクが届かなくなったアップロードを破棄するまでの時間（秒）
+TEMP_PREFIX = 'upload-'
+
+#######################################################################################
+# 変数
+
+
+#######################################################################################
+# 関数
+
+
+#######################################################################################
+# クラス
+class UploadManager:
+    """
+    大きなファイルを分割して受信し、一時ファイルに書き込むクラス。
+
+    - 受信したチャンクはメモリに溜めずに一時ファイルへ追記し、SHA-256を逐次計算します。
+    - チャンクはoffsetの順に受け付けます。受信済みの範囲の再送は無視し、欠けがある場合はエラーとします。
+    - max_sizeを超えるアップロードは開始時と受信中の両方で拒否します。
+    - UPLOAD_TIMEOUTの間チャンクが届かないアップロードは、次のアップロードの開始時に破棄します。
+    """
+
+    def __init__(self, directory=None, max_size=MAX_UPLOAD_SIZE, chunk_size=CHUNK_SIZE, timeout=UPLOAD_TIMEOUT):
+        """
+        UploadManagerの初期化を行うコンストラクタ。
+
+        Args:
+            directory (str or None): 一時ファイルを作成するディレクトリ。Noneの場合はOSの一時ディレクトリ。
+            max_size (int): 1回のアップロードで受け付ける最大サイズ（バイト）。
+            chunk_size (int): クライアントに指定するチャンクのサイズ（バイト）。
+            timeout (float): チャンクが届かなくなったアップロードを破棄するまでの時間（秒）。
+
+        Attributes:
+            uploads (dict): upload_idをキーとし、受信中のアップロードの状態を値とする辞書。
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def begin(self, size: int, mime: str, sha256=None, metadata=None) -> dict:
+        """
+        アップロードを開始し、書き込み先の一時ファイルを作成する関数。
+
+        Args:
+            size (int): アップロードするデータのサイズ（バイト）。
+            mime (str): データのMIMEタイプ。
+            sha256 (str or None): データのSHA-256（16進数）。指定した場合は確定時に検証します。
+            metadata (dict or None): 確定時にそのまま返す、アップロードに付随する情報。
+
+        Returns:
+            dict: "upload_id"・"chunk_size"・"received"・"size" を含む辞書。
+
+        Raises:
+            ValueError: サイズが不正、またはmax_sizeを超える場合。
+        """
+        size = int(size)
+        if size <= 0:
+            raise ValueError("Upload size must be positive")
+        if size > self.max_size:
+            raise ValueError(f"Upload size {size} exceeds the limit of {self.max_size} bytes")
+        self.expire()
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.directory)
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.uploads[upload_id] = {
+                "path": path,
+                "file": os.fdopen(fd, "wb"),
+                "size": size,
+                "mime": mime,
+                "sha256": sha256.lower() if sha256 else None,
+                "hash": hashlib.sha256(),
+                "received": 0,
+                "metadata": metadata or {},
+                "updated_at": time.monotonic(),
+            }
+        return {"upload_id": upload_id, "chunk_size": self.chunk_size, "received": 0, "size": size}
+
+    def write_chunk(self, upload_id: str, offset: int, data: bytes) -> dict:
+        """
+        チャンクを一時ファイルに追記する関数。
+
+        Args:
+            upload_id (str): begin() で取得したアップロードのID。
+            offset (int): チャンクの先頭の位置（バイト）。
+            data (bytes): チャンクのデータ。
+
+        Returns:
+            dict: "upload_id"・"received"（受信済みのサイズ）・"size" を含む辞書。
+
+        Raises:
+            KeyError: アップロードが存在しない場合。
+            ValueError: offsetが受信済みのサイズと一致しない、またはサイズを超える場合。
+        """
+        upload = self._get(upload_id)
+        offset = int(offset)
+        if offset + len(data) <= upload["received"]:
+            # 受信済みの範囲の再送は無視する
+            return self._progress(upload_id, upload)
+        if offset != upload["received"]:
+            raise ValueError(f"Unexpected offset {offset} (expected {upload['received']})")
+        if offset + len(data) > upload["size"]:
+            self.abort(upload_id)
+            raise ValueError(f"Upload exceeds the declared size of {upload['size']} bytes")
+        upload["file"].write(data)
+        upload["hash"].update(data)
+        upload["received"] += len(data)
+        upload["updated_at"] = time.monotonic()
+        return self._progress(upload_id, upload)
+
+    def commit(self, upload_id: str):
+        """
+        アップロードを確定する関数。サイズとハッシュ値を検証し、一時ファイルを閉じます。
+        一時ファイルは呼び出し元が処理した後に discard() で削除してください。
+
+        Args:
+            upload_id (str): begin() で取得したアップロードのID。
+
+        Returns:
+            tuple: 一時ファイルのパス、MIMEタイプ、begin() に渡したmetadataのタプル。
+
+        Raises:
+            KeyError: アップロードが存在しない場合。
+            ValueError: 受信したサイズまたはハッシュ値が一致しない場合。
+        """
+        with self.lock:
+            upload = self.uploads.pop(upload_id, None)
+        if upload is None:
+            raise KeyError(f"Unknown upload: {upload_id}")
+        upload["file"].close()
+        try:
+            if upload["received"] != upload["size"]:
+                raise ValueError(f"Received {upload['received']} of {upload['size']} bytes")
+            if upload["sha256"] is not None and upload["hash"].hexdigest() != upload["sha256"]:
+                raise ValueError("SHA-256 mismatch")
+        except ValueError:
+            self.discard(upload["path"])
+            raise
+        return upload["path"], upload["mime"], upload["metadata"]
+
+    def abort(self, upload_id: str):
+        """
+        受信中のアップロードを中止し、一時ファイルを削除する関数。存在しない場合は何もしません。
+
+        Args:
+            upload_id (str): アップロードのID。
+        """
+        with self.lock:
+            upload = self.uploads.pop(upload_id, None)
+        if upload is not None:
+            upload["file"].close()
+            self.discard(upload["path"])
+
+    def expire(self):
+        """
+        timeoutの間チャンクが届かなかったアップロードを中止する関数。
+        """
+        now = time.monotonic()
+        with self.lock:
+            expired = [upload_id for upload_id, upload in self.uploads.items() if now - upload["updated_at"] > self.timeout]
+        for upload_id in expired:
+            print(f"Upload {upload_id} expired.")
+            self.abort(upload_id)
+
+    def discard(self, path: str):
+        """
+        確定したアップロードの一時ファイルを削除する関数。
+
+        Args:
+            path (str): commit() で取得した一時ファイルのパス。
+        """
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Failed to remove upload file {path}: {e}")
+
+    def _get(self, upload_id: str) -> dict:
+        """
+        受信中のアップロードの状態を取得する関数。
+
+        Args:
+            upload_id (str): アップロードのID。
+
+        Returns:
+            dict: アップロードの状態。
+
+        Raises:
+            KeyError: アップロードが存在しない場合。
+        """
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+        if upload is None:
+            raise KeyError(f"Unknown upload: {upload_id}")
+        return upload
+
+    def _progress(self, upload_id: str, upload: dict) -> dict:
+        """
+        アップロードの進捗を表す辞書を作成する関数。
+
+        Args:
+            upload_id (str): アップロードのID。
+            upload (dict): アップロードの状態。
+
+        Returns:
+            dict: "upload_id"・"received"・"size" を含む辞書。
+        """
+        return {"upload_id": upload_id, "received": upload["received"], "size": upload["size"]}
+
+
+#######################################################################################
+# モジュールテスト用処理
+if __name__ == '__main__':
+    data = os.urandom(CHUNK_SIZE * 2 + 100)
+    uploads = UploadManager(max_size=len(data) * 2)
+    started = uploads.begin(len(data), 'application/octet-stream', hashlib.sha256(data).hexdigest(), {"id": 0})
+    upload_id = started["upload_id"]
+    for offset in range(0, len(data), started["chunk_size"]):
+        print(uploads.write_chunk(upload_id, offset, data[offset:offset + started["chunk_size"]]))
+    # 再送されたチャンクは無視される
+    print(uploads.write_chunk(upload_id, 0, data[:started["chunk_size"]]))
+    path, mime, metadata = uploads.commit(upload_id)
+    with open(path, 'rb') as f:
+        print(path, mime, metadata, f.read() == data)
+    uploads.discard(path)
+
+    try:
+        uploads.begin(len(data) * 3, 'application/octet-stream')
+    except ValueError as e:
+        print(e)
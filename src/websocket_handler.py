@@ -7,23 +7,30 @@
 # import処理
 # 標準ライブラリ
 import asyncio
+from collections import deque
 import sys
 # import nest_asyncio
 # nest_asyncio.apply()
 import base64
 import json
+import math
 import os
 from pathlib import Path
 import threading
 import uuid
 
 # pypiライブラリ
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 import uvicorn
 
 # 自作モジュール
+from src.action_executor import ActionExecutor
+from src.binary_frame import BinaryFrame, unpack_message
+from src.blob_store import parse_range_header
+from src.upload_manager import UploadManager
 
 # その他
 # 疑似グローバル変数管理モジュール
@@ -34,7 +41,15 @@ except Exception:
 
 #######################################################################################
 # 定数
-SEND_INTERVAL = 2  # ループの実行間隔（秒）
+SEND_INTERVAL = 10  # 生存確認（ハートビート）メッセージの送信間隔（秒）
+SAMPLE_INTERVAL = 0.5  # 共有サンプラー（ポーリングが必要な情報の取得）の実行間隔（秒）
+PUSH_DEBOUNCE = 0.05  # イベントをまとめてから送信するまでの待ち時間（秒）
+SEND_QUEUE_SIZE = 32  # クライアントごとの送信待ちメッセージ数の上限
+SEND_TIMEOUT = 10  # 1メッセージの送信にかかる時間の上限（秒）。超えたクライアントは切断する
+COALESCE_TOPICS = {"system_info", "audio_info", "heartbeat"}  # 最新の内容だけを送れば良いトピック
+BLOB_CACHE_CONTROL = "private, max-age=31536000, immutable"  # ハッシュ値で識別するため内容は変化しない
+WS_MAX_SIZE = 16 * 1024 * 1024  # 受信する1メッセージの最大サイズ（バイト）。大きなファイルは分割アップロードで受信する
+UPLOAD_MESSAGE_TYPES = {"upload_init", "upload_chunk", "upload_commit", "upload_abort"}
 
 #######################################################################################
 # クラス
@@ -42,92 +57,493 @@ SEND_INTERVAL = 2  # ループの実行間隔（秒）
 class WebSocketConnectionManager:
     """
     WebSocket接続を管理し、クライアントごとの通信を処理するクラス。
-    クライアントごとの定期タスクを管理します。
+    各情報はトピックとして登録され、EventBusでトピックのイベントを受け取ると、
+    短い待ち時間でまとめた上で、そのトピックを購読しているクライアントに配信します。
+    クライアントはトピックごとに購読の有無と最小送信間隔を指定でき、間隔内の変化はまとめて後から送信します。
+    同じメッセージのシリアライズは配信先の数に関わらず1回だけ行います。
+    送信はクライアントごとの上限付きキューと送信タスクで行うため、遅いクライアントが他のクライアントへの配信を遅らせません。
+    COALESCE_TOPICSのメッセージは未送信の古いものを新しいもので置き換え、キューがあふれた場合は古いものから破棄します。
+    それでも送信が追いつかない、または送信が止まったクライアントは切断します。
+    ポーリングが必要な情報は全クライアントで共有する1つのサンプラータスクで、購読者が居るトピックのみ取得します。
+    バイナリフレームの利用は接続ごとにネゴシエーションし、利用しない接続にはJSONで送信します。
     """
 
     def __init__(self):
         """
         クラスの初期化処理。接続中のWebSocketを管理するためのリストを初期化します。
+
+        Attributes:
+            topic_builders (dict): トピック名をキーとし、builder(state) の形でメッセージを作成する関数を値とする辞書。
+                stateはクライアント・トピックごとの送信状態を保持する辞書で、空の辞書を渡すと全体のメッセージを作成します。
+                送信する内容が無い場合はNoneを返します。
+            client_states (dict): WebSocketをキーとし、購読内容（subscriptions）、トピックごとの送信状態（topic_states）、
+                最終送信時刻（last_sent）、遅延送信用のタイマー（timers）、送信キュー（queue）と送信タスク（writer）を保持する辞書。
         """
         self.active_connections: list[WebSocket] = []
+        self.binary_connections: set[WebSocket] = set()
+        self.client_states: dict[WebSocket, dict] = {}
+        self.sampler_task = None
+        self.flush_task = None
+        self.loop = None
+        self.topic_builders = {}
+        self.dirty_topics = set()
+        self.dropped_messages = 0
+        self.evicted_clients = 0
+
+    def register_topics(self, event_bus, topic_builders: dict):
+        """
+        トピックを登録し、EventBusのイベントを購読します。
+
+        Args:
+            event_bus (EventBus): イベントを受け取るEventBus。
+            topic_builders (dict): トピック名をキーとし、メッセージを作成する関数を値とする辞書。
+        """
+        self.topic_builders.update(topic_builders)
+        for topic in topic_builders:
+            event_bus.subscribe(topic, self.on_event)
+
+    def on_event(self, topic, data=None):
+        """
+        EventBusからイベントを受け取る関数。どのスレッドから呼び出されてもイベントループ上で処理します。
+
+        Args:
+            topic (str): トピック名。
+            data: イベントに付随するデータ（未使用）。
+        """
+        if self.loop is None or not self.active_connections:
+            return
+        self.loop.call_soon_threadsafe(self.mark_dirty, topic)
+
+    def mark_dirty(self, topic):
+        """
+        トピックを送信待ちとし、送信タスクが動作していなければ開始します。
+
+        Args:
+            topic (str): トピック名。
+        """
+        self.dirty_topics.add(topic)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.flush_topics())
+
+    async def flush_topics(self):
+        """
+        送信待ちのトピックを購読しているクライアントに配信します。
+        少し待ってから送信することで、短時間に連続したイベントを1回の送信にまとめます。
+        """
+        try:
+            while self.dirty_topics:
+                await asyncio.sleep(PUSH_DEBOUNCE)
+                topics, self.dirty_topics = self.dirty_topics, set()
+                encoded_cache = {}
+                for topic in topics:
+                    for websocket in list(self.active_connections):
+                        await self.push_topic(websocket, topic, encoded_cache)
+        except Exception as e:
+            print(f"Error in pushing topics: {e}")
+
+    def subscribe(self, websocket: WebSocket, topics: dict):
+        """
+        クライアントが購読するトピックと最小送信間隔を設定します。
+
+        Args:
+            websocket (WebSocket): 対象のWebSocket接続。
+            topics (dict): トピック名をキーとする辞書。値が {"interval": 秒} の場合は購読し（0または省略時は変化のたびに送信）、
+                False または None の場合は購読を解除します。登録されていないトピックは無視します。
+                "interval" 以外のキー（例: {"page": 0, "page_size": 20}）はトピックのオプションとして、
+                メッセージを作成する関数に state["options"] として渡します。
+
+        Returns:
+            list: 新たに購読を開始したトピックと、オプションが変わったトピックのリスト。
+
+        Raises:
+            ValueError: topics が辞書でない場合や、"interval" が0以上の数値でない場合。購読内容は変更しません。
+        """
+        client = self.client_states.get(websocket)
+        if client is None:
+            return []
+        if not isinstance(topics, dict):
+            raise ValueError("topics must be an object")
+        # 途中で失敗して購読内容が中途半端に変わらないよう、先にすべての送信間隔を検証する
+        intervals = {}
+        for topic, options in topics.items():
+            if topic in self.topic_builders and isinstance(options, dict):
+                intervals[topic] = self._parse_interval(topic, options.get("interval"))
+        added_topics = []
+        for topic, options in topics.items():
+            if topic not in self.topic_builders:
+                continue
+            if options is None or options is False:
+                client["subscriptions"].pop(topic, None)
+                client["topic_states"].pop(topic, None)
+                timer = client["timers"].pop(topic, None)
+                if timer is not None:
+                    timer.cancel()
+                continue
+            options = options if isinstance(options, dict) else {}
+            topic_options = {key: value for key, value in options.items() if key != "interval"}
+            current = client["subscriptions"].get(topic)
+            if current is None or current["options"] != topic_options:
+                added_topics.append(topic)
+                # 新たに購読したトピックや、表示するページなどのオプションが変わったトピックは全体を送信する
+                client["topic_states"][topic] = {}
+                client["last_sent"].pop(topic, None)
+            client["subscriptions"][topic] = {"interval": intervals.get(topic, 0.0), "options": topic_options}
+        return added_topics
+
+    @staticmethod
+    def _parse_interval(topic: str, value) -> float:
+        """
+        クライアントが指定した送信間隔を検証し、秒数に変換します。
+
+        Args:
+            topic (str): エラーメッセージに含めるトピック名。
+            value: クライアントが指定した "interval" の値。None は 0（変化のたびに送信）として扱います。
+
+        Returns:
+            float: 送信間隔（秒）。
+
+        Raises:
+            ValueError: 数値（または数値の文字列）でない場合や、負の値・無限大・NaN の場合。
+        """
+        if value is None:
+            return 0.0
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError(f"Invalid interval for topic {topic!r}: {value!r}")
+        try:
+            interval = float(value)
+        except ValueError:
+            raise ValueError(f"Invalid interval for topic {topic!r}: {value!r}") from None
+        if not math.isfinite(interval) or interval < 0:
+            raise ValueError(f"Invalid interval for topic {topic!r}: {value!r}")
+        return interval
+
+    def get_subscriptions(self, websocket: WebSocket) -> dict:
+        """
+        クライアントの購読内容を取得します。
+
+        Args:
+            websocket (WebSocket): 対象のWebSocket接続。
+
+        Returns:
+            dict: トピック名をキーとし、{"interval": 秒, "options": オプションの辞書} を値とする辞書。
+        """
+        client = self.client_states.get(websocket)
+        return dict(client["subscriptions"]) if client is not None else {}
+
+    def get_topic_intervals(self) -> dict:
+        """
+        購読者が居るトピックと、購読者が要求する最小送信間隔のうち最も短いものを取得します。
+        サンプラーはこれを元に、誰も購読していない情報の取得を省略します。
+
+        Returns:
+            dict: トピック名をキーとし、最小送信間隔（秒、0は変化のたび）を値とする辞書。
+        """
+        intervals = {}
+        for client in self.client_states.values():
+            for topic, subscription in client["subscriptions"].items():
+                intervals[topic] = min(intervals.get(topic, subscription["interval"]), subscription["interval"])
+        return intervals
+
+    async def push_topic(self, websocket: WebSocket, topic: str, encoded_cache=None):
+        """
+        トピックのメッセージを作成してクライアントに送信します。
+        購読していない場合は送信せず、最小送信間隔内の場合は間隔が経過した時点で送信するよう予約します。
+
+        Args:
+            websocket (WebSocket): 送信先のWebSocket接続。
+            topic (str): トピック名。
+            encoded_cache (dict or None): シリアライズ済みのメッセージを共有するための辞書。
+        """
+        client = self.client_states.get(websocket)
+        if client is None or topic not in client["subscriptions"]:
+            return
+        now = self.loop.time()
+        elapsed = now - client["last_sent"].get(topic, float("-inf"))
+        interval = client["subscriptions"][topic]["interval"]
+        if elapsed < interval:
+            if topic not in client["timers"]:
+                client["timers"][topic] = self.loop.call_later(interval - elapsed, self.on_client_timer, websocket, topic)
+            return
+        state = client["topic_states"].setdefault(topic, {})
+        state["options"] = client["subscriptions"][topic]["options"]
+        message = self.topic_builders[topic](state)
+        if message is None:
+            return
+        client["last_sent"][topic] = now
+        self.enqueue_message(websocket, message, encoded_cache, topic)
+
+    def on_client_timer(self, websocket: WebSocket, topic: str):
+        """
+        最小送信間隔の経過後に、予約していたトピックを送信します。
+
+        Args:
+            websocket (WebSocket): 送信先のWebSocket接続。
+            topic (str): トピック名。
+        """
+        client = self.client_states.get(websocket)
+        if client is None:
+            return
+        client["timers"].pop(topic, None)
+        asyncio.create_task(self.push_topic(websocket, topic))
 
     async def connect(self, websocket: WebSocket):
         """
         クライアントからの接続を受け入れ、アクティブな接続としてリストに追加します。
+        接続直後は全てのトピックを変化のたびに受信する設定とし、現在の状態を一括送信します。
+        共有サンプラーが停止していれば開始します。
 
         Args:
             websocket (WebSocket): クライアントからのWebSocket接続。
         """
-        self.is_first = True
         await websocket.accept()
+        self.loop = asyncio.get_running_loop()
         self.active_connections.append(websocket)
-        asyncio.create_task(self.periodic_task(websocket))
+        self.client_states[websocket] = {
+            "subscriptions": {},
+            "topic_states": {},
+            "last_sent": {},
+            "timers": {},
+            "queue": deque(),
+            "queue_event": asyncio.Event(),
+            "writer": asyncio.create_task(self.writer_loop(websocket)),
+        }
+        self.subscribe(websocket, {topic: {} for topic in self.topic_builders})
+        asyncio.create_task(self.send_initial_state(websocket))
+        self.start_sampler()
 
     def disconnect(self, websocket: WebSocket):
         """
         クライアントからの接続を切断し、アクティブな接続リストから削除します。
+        既に削除済みの接続に対して呼び出しても何もしません。
 
         Args:
             websocket (WebSocket): 切断されたWebSocket接続。
         """
-        self.active_connections.remove(websocket)
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        self.binary_connections.discard(websocket)
+        client = self.client_states.pop(websocket, None)
+        if client is not None:
+            for timer in client["timers"].values():
+                timer.cancel()
+            if client["writer"] is not asyncio.current_task():
+                client["writer"].cancel()
+
+    def negotiate(self, websocket: WebSocket, options: dict) -> bool:
+        """
+        クライアントから要求された通信方式を設定します。
+        暗号化が有効な場合、バイナリフレームは利用しません。
 
-    async def send_personal_message(self, message, websocket: WebSocket):
+        Args:
+            websocket (WebSocket): 対象のWebSocket接続。
+            options (dict): クライアントから受信したネゴシエーションメッセージ。
+
+        Returns:
+            bool: バイナリフレームを利用するかどうか。
         """
-        特定のクライアントにメッセージを送信します。
+        if options.get("binary_frames") and key_manager is None:
+            self.binary_connections.add(websocket)
+            return True
+        self.binary_connections.discard(websocket)
+        return False
+
+    def encode_message(self, message, binary: bool):
+        """
+        メッセージを送信用の形式に変換します。
 
         Args:
-            message (str): 送信するメッセージ。
-            websocket (WebSocket): メッセージを送信するWebSocket接続。
+            message (str, dict or BinaryFrame): 送信するメッセージ。
+            binary (bool): バイナリフレームとして送信するかどうか。
+
+        Returns:
+            bytes or str: バイナリフレーム、またはJSON文字列（暗号化が有効な場合は暗号化済み）。
         """
-        if key_manager is not None:
-            message = key_manager.encrypt(message.encode())
+        if binary:
+            return message.to_bytes()
+        if isinstance(message, BinaryFrame):
+            message = message.to_json_message()
         if type(message) == dict:
             message = json.dumps(message)
-        await websocket.send_text(message)
+        if key_manager is not None:
+            message = key_manager.encrypt(message.encode())
+        return message
 
-    async def broadcast(self, message: str):
+    def enqueue_message(self, websocket: WebSocket, message, encoded_cache=None, topic=None):
         """
-        接続中の全てのクライアントにメッセージをブロードキャストします。
+        メッセージをクライアントの送信キューに追加します。encoded_cacheを指定した場合、同じメッセージのシリアライズ結果を共有します。
+        COALESCE_TOPICSのメッセージは未送信の同じトピックのメッセージを置き換えます。
+        キューがあふれた場合は置き換え可能な古いメッセージを破棄し、破棄できるものが無い場合はクライアントを切断します。
 
         Args:
-            message (str): 送信するメッセージ。
+            websocket (WebSocket): 送信先のWebSocket接続。
+            message (str, dict or BinaryFrame): 送信するメッセージ。
+            encoded_cache (dict or None): シリアライズ済みのメッセージを共有するための辞書。
+            topic (str or None): メッセージのトピック。
         """
-        if key_manager is not None:
-            message = key_manager.encrypt(message.encode())
-        for connection in self.active_connections:
-            await connection.send_text(message)
+        client = self.client_states.get(websocket)
+        if client is None:
+            return
+        binary = isinstance(message, BinaryFrame) and websocket in self.binary_connections
+        if encoded_cache is None:
+            data = self.encode_message(message, binary)
+        else:
+            key = (id(message), binary)
+            if key not in encoded_cache:
+                # idが再利用されないよう、メッセージ自体も保持しておく
+                encoded_cache[key] = (message, self.encode_message(message, binary))
+            data = encoded_cache[key][1]
+
+        queue = client["queue"]
+        if topic in COALESCE_TOPICS:
+            for i, (queued_topic, _, _) in enumerate(queue):
+                if queued_topic == topic:
+                    # 未送信の古い内容を最新の内容で置き換える
+                    queue[i] = (topic, data, binary)
+                    self.dropped_messages += 1
+                    return
+        if len(queue) >= SEND_QUEUE_SIZE:
+            for i, (queued_topic, _, _) in enumerate(queue):
+                if queued_topic in COALESCE_TOPICS:
+                    del queue[i]
+                    self.dropped_messages += 1
+                    break
+            else:
+                asyncio.create_task(self.evict(websocket, "send queue is full"))
+                return
+        queue.append((topic, data, binary))
+        client["queue_event"].set()
+
+    async def writer_loop(self, websocket: WebSocket):
+        """
+        クライアントの送信キューからメッセージを取り出して順番に送信するループ。
+        1メッセージの送信がSEND_TIMEOUTを超えた場合はクライアントを切断します。
 
-    async def periodic_task(self, websocket: WebSocket):
+        Args:
+            websocket (WebSocket): 送信先のWebSocket接続。
+        """
+        try:
+            while True:
+                client = self.client_states.get(websocket)
+                if client is None:
+                    return
+                if not client["queue"]:
+                    client["queue_event"].clear()
+                    await client["queue_event"].wait()
+                    continue
+                _, data, binary = client["queue"].popleft()
+                if binary:
+                    await asyncio.wait_for(websocket.send_bytes(data), SEND_TIMEOUT)
+                else:
+                    await asyncio.wait_for(websocket.send_text(data), SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            await self.evict(websocket, "send timed out")
+        except Exception as e:
+            print(f"Error in sending to {websocket.client}: {e}")
+            self.disconnect(websocket)
+
+    async def evict(self, websocket: WebSocket, reason: str):
+        """
+        送信が追いつかないクライアントを切断します。
+
+        Args:
+            websocket (WebSocket): 切断するWebSocket接続。
+            reason (str): 切断の理由。
+        """
+        if websocket not in self.client_states:
+            return
+        print(f"Evicting slow client {websocket.client}: {reason}")
+        self.evicted_clients += 1
+        self.disconnect(websocket)
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def get_stats(self):
+        """
+        接続ごとの送信キューの状況と、破棄・切断の統計を取得します。
+
+        Returns:
+            dict: 接続数、クライアントごとのキューの長さ、破棄したメッセージ数、切断したクライアント数を含む辞書。
+        """
+        return {
+            "connections": len(self.active_connections),
+            "queue_lengths": {str(websocket.client): len(client["queue"]) for websocket, client in self.client_states.items()},
+            "dropped_messages": self.dropped_messages,
+            "evicted_clients": self.evicted_clients,
+        }
+
+    async def send_personal_message(self, message, websocket: WebSocket):
         """
-        クライアントごとに一定時間おきに実行するループ。
+        特定のクライアントにメッセージを送信します（送信キューに追加します）。
+
+        Args:
+            message (str, dict or BinaryFrame): 送信するメッセージ。
+            websocket (WebSocket): メッセージを送信するWebSocket接続。
+        """
+        self.enqueue_message(websocket, message)
+
+    async def broadcast(self, message, topic=None):
+        """
+        接続中の全てのクライアントにメッセージをブロードキャストします（各クライアントの送信キューに追加します）。
+        メッセージのシリアライズ（および暗号化）は接続数に関わらず、形式ごとに1回だけ行います。
+
+        Args:
+            message (str, dict or BinaryFrame): 送信するメッセージ。
+            topic (str or None): メッセージのトピック。
+        """
+        encoded_cache = {}
+        for connection in list(self.active_connections):
+            self.enqueue_message(connection, message, encoded_cache, topic)
+
+    def start_sampler(self):
+        """
+        共有サンプラータスクが動作していなければ開始します。
+        """
+        if self.sampler_task is None or self.sampler_task.done():
+            self.sampler_task = asyncio.create_task(self.sampler_loop())
+
+    async def send_initial_state(self, websocket: WebSocket, topics=None):
+        """
+        クライアントに購読中のトピックの現在の状態（差分ではなく全体）を送信します。
 
         Args:
             websocket (WebSocket): WebSocketプロトコルオブジェクト。
+            topics (list or None): 送信するトピック。Noneの場合は購読中の全てのトピック。
+        """
+        client = self.client_states.get(websocket)
+        if client is None:
+            return
+        for topic in list(client["subscriptions"] if topics is None else topics):
+            client["topic_states"][topic] = {}
+            client["last_sent"].pop(topic, None)
+            await self.push_topic(websocket, topic)
+
+    async def sampler_loop(self):
         """
-        self.is_first = True
-        buffer = {}
+        一定時間おきにポーリングが必要な情報を1回だけ取得するループ。取得した情報の変化はEventBus経由で配信されます。
+        生存確認のためのハートビートもここで送信します。接続中のクライアントが居なくなると終了します。
+        """
+        last_heartbeat = 0.0
         try:
-            while True:
+            while self.active_connections:
                 # ここで定期的に実行したい処理を行う
-                message = json.dumps(
-                    {"status": "alive", "message": "Periodic update"})
-                await self.send_personal_message(message, websocket)
-                # print(f"Sent periodic message to {
-                #       websocket.client}: {message}")
-                global periodic_task
+                now = self.loop.time()
+                if now - last_heartbeat >= SEND_INTERVAL:
+                    await self.broadcast({"status": "alive", "message": "Periodic update"}, "heartbeat")
+                    last_heartbeat = now
                 if periodic_task is not None:
-                    async def send_message(message):
-                        await self.send_personal_message(message, websocket)
-                    await periodic_task(send_message, self.is_first, buffer)
-                    self.is_first = False
-                await asyncio.sleep(SEND_INTERVAL)
+                    try:
+                        await periodic_task(self.get_topic_intervals())
+                    except Exception as e:
+                        print(f"Error in periodic task: {e}")
+                await asyncio.sleep(SAMPLE_INTERVAL)
         except asyncio.CancelledError:
-            print(f"Periodic task cancelled for client: {websocket.client}")
-        except WebSocketDisconnect:
-            self.disconnect(websocket)
+            print("Sampler task cancelled.")
         except Exception as e:
-            print(f"Error in periodic task: {e}")
+            print(f"Error in sampler task: {e}")
 
 #######################################################################################
 # 変数
@@ -135,8 +551,14 @@ app = FastAPI()
 key_manager = None
 # key_manager = KeyManager(Path("./shared_key.bin"))
 manager = WebSocketConnectionManager()
+action_executor = ActionExecutor()
+upload_manager = UploadManager()
 callback = None
+upload_callback = None  # 確定したアップロードの一時ファイルを処理する関数
 periodic_task = None
+blob_store = None
+extra_blob_stores = []  # blob_store以外にデータを配信するBlobStoreのリスト
+image_pipeline = None  # /api/stats/images で統計を返すImagePipeline
 
 #######################################################################################
 # FastAPIルーティング
@@ -150,50 +572,225 @@ async def websocket_endpoint(websocket: WebSocket):
         websocket (WebSocket): クライアントからのWebSocket接続。
     """
     await manager.connect(websocket)
+    uploads = set()  # この接続で受信中のアップロードのID
     try:
         while True:
-            data = await websocket.receive_text()
-            if key_manager is not None:
-                data = key_manager.decrypt(data)
-            print(f"Received message: {data}")
-            response = process_message(data)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes") is not None:
+                # バイナリフレームはペイロードをbytesとして埋め込んだ辞書に変換する
+                try:
+                    data = unpack_message(message["bytes"])
+                except ValueError as e:
+                    # 不正なフレームはそのメッセージだけを破棄し、接続は維持する
+                    await manager.send_personal_message({"error": f"Invalid binary frame: {e}"}, websocket)
+                    continue
+                print(f"Received binary message: {data.get('type')}")
+            else:
+                data = message.get("text")
+                if key_manager is not None:
+                    data = key_manager.decrypt(data)
+                print(f"Received message: {data}")
+                try:
+                    data = json.loads(data)
+                except json.JSONDecodeError:
+                    await manager.send_personal_message({"error": "Invalid JSON format"}, websocket)
+                    continue
+            if type(data) == dict and data.get("type") == "negotiate":
+                # 通信方式のネゴシエーションは接続単位の処理のため、ここで応答する
+                binary_frames = manager.negotiate(websocket, data)
+                await manager.send_personal_message({"type": "negotiate", "binary_frames": binary_frames}, websocket)
+                continue
+            if type(data) == dict and data.get("type") == "subscribe":
+                # 購読するトピックと最小送信間隔を設定し、新たに購読したトピックは現在の状態を送信する
+                try:
+                    added_topics = manager.subscribe(websocket, data.get("topics", {}))
+                except ValueError as e:
+                    # 不正な購読要求は接続を切らずにエラーを返す（購読内容は変更されない）
+                    await manager.send_personal_message({"type": "subscribe", "error": str(e)}, websocket)
+                    continue
+                await manager.send_personal_message({"type": "subscribe", "topics": manager.get_subscriptions(websocket)}, websocket)
+                await manager.send_initial_state(websocket, added_topics)
+                continue
+            if type(data) == dict and data.get("type") in UPLOAD_MESSAGE_TYPES:
+                await handle_upload_message(websocket, data, uploads)
+                continue
+            # クリップボード・キーボード操作はブロッキングするため、専用スレッドで直列に実行して結果を待つ
+            response = await action_executor.run(process_message, data)
             await manager.send_personal_message(response, websocket)
-            print(f"Sent message to {websocket.client}: {response}")
-            async def send_message(message):
-                await manager.send_personal_message(message, websocket)
-            await asyncio.sleep(0.1)
-            await periodic_task(send_message, True)
+            print(f"Sent message to {websocket.client}: {response.header if isinstance(response, BinaryFrame) else response}")
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         print(f"Client {websocket.client} disconnected")
+    except Exception as e:
+        print(f"Error in websocket connection {websocket.client}: {e}")
+    finally:
+        # 切断以外の理由で終了した場合も、接続の状態と送信タスクを必ず片付ける
+        manager.disconnect(websocket)
+        for upload_id in uploads:
+            upload_manager.abort(upload_id)
+
+async def handle_upload_message(websocket: WebSocket, message: dict, uploads: set):
+    """
+    分割アップロードのメッセージを処理します。
+    チャンクはイベントループをブロックしないようスレッドプールで一時ファイルに書き込み、
+    確定したファイルはstart_server() で登録したupload_callbackでアクション実行スレッドで処理します。
+    一時ファイルのパスはサーバー側でのみ扱い、クライアントが処理の内容やパスを指定することはできません。
+
+    - upload_init: {"size", "mime", "sha256"（任意）, "target"（upload_callbackに渡す保存先の指定。例: {"id": 0}）}
+    - upload_chunk: {"upload_id", "offset", "data"（バイナリフレームのペイロード、またはBase64）}
+    - upload_commit / upload_abort: {"upload_id"}
+
+    Args:
+        websocket (WebSocket): 送信元のWebSocket接続。
+        message (dict): 受信したメッセージ。
+        uploads (set): この接続で受信中のアップロードのIDの集合。
+    """
+    loop = asyncio.get_running_loop()
+    upload_id = message.get("upload_id")
+    try:
+        if message["type"] == "upload_init":
+            target = message.get("target")
+            if not isinstance(target, dict):
+                raise ValueError("Upload target must be an object")
+            if upload_callback is None:
+                raise ValueError("Uploads are not supported")
+            metadata = {"target": target}
+            result = upload_manager.begin(message["size"], message.get("mime", "application/octet-stream"),
+                                          message.get("sha256"), metadata)
+            uploads.add(result["upload_id"])
+            await manager.send_personal_message({"type": "upload_ready", **result}, websocket)
+        elif message["type"] == "upload_chunk":
+            chunk = message.get("data", b"")
+            if isinstance(chunk, str):
+                chunk = base64.b64decode(chunk)
+            result = await loop.run_in_executor(None, upload_manager.write_chunk, upload_id, message.get("offset", 0), chunk)
+            await manager.send_personal_message({"type": "upload_progress", **result}, websocket)
+        elif message["type"] == "upload_commit":
+            uploads.discard(upload_id)
+            path, mime, metadata = await loop.run_in_executor(None, upload_manager.commit, upload_id)
+            try:
+                await manager.send_personal_message({"type": "upload_complete", "upload_id": upload_id}, websocket)
+                # 画像のデコードなどはアクション実行スレッドで一時ファイルから行う
+                try:
+                    response = await action_executor.run(upload_callback, path, mime, metadata["target"])
+                except Exception as e:
+                    # 画像として読み込めないファイルなどは、接続を切らずにこのアップロードだけを失敗として応答する
+                    print(f"Error in processing upload {upload_id}: {e}")
+                    response = {"type": "upload_error", "upload_id": upload_id, "status": "error", "error": str(e)}
+            finally:
+                upload_manager.discard(path)
+            await manager.send_personal_message(response, websocket)
+        else:
+            uploads.discard(upload_id)
+            upload_manager.abort(upload_id)
+    except (KeyError, ValueError) as e:
+        print(f"Error in upload {upload_id}: {e}")
+        if upload_id is not None:
+            uploads.discard(upload_id)
+            upload_manager.abort(upload_id)
+        await manager.send_personal_message({"type": "upload_error", "upload_id": upload_id, "error": str(e)}, websocket)
+
+@app.get("/api/stats/actions")
+async def action_stats_endpoint():
+    """
+    アクション実行キューの深さと待ち時間・実行時間の統計を返すエンドポイント。
+    """
+    return JSONResponse(action_executor.get_stats())
+
+@app.get("/blob/{digest}")
+async def blob_endpoint(digest: str, request: Request):
+    """
+    BlobStoreに保存されたデータをハッシュ値で配信するエンドポイント。
+    ETagによるキャッシュ検証と、Rangeヘッダによる部分取得に対応します。
+    送信中に内容が差し替えられてもデータが削除されないよう、送信を終えるまで参照を保持します。
+
+    Args:
+        digest (str): データのハッシュ値。
+        request (Request): HTTPリクエスト。
+    """
+    lease = None
+    for candidate in [blob_store] + extra_blob_stores:
+        lease = candidate.acquire(digest) if candidate is not None else None
+        if lease is not None:
+            break
+    if lease is None:
+        return JSONResponse({"error": "Blob not found"}, status_code=404)
+    info = lease.info
+    etag = f'"{digest}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": BLOB_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        lease.release()
+        return Response(status_code=304, headers=headers)
+
+    size = info["size"]
+    range_header = request.headers.get("range")
+    if range_header and size > 0 and request.headers.get("if-range", etag) == etag:
+        try:
+            start, end = parse_range_header(range_header, size)
+        except ValueError:
+            lease.release()
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        # 参照は読み終えた時に解放する。読み出しを始める前に送信を中断した場合はバックグラウンドタスクで解放する
+        return StreamingResponse(lease.iter_range(start, end), status_code=206, media_type=info["mime"],
+                                 headers=headers, background=BackgroundTask(lease.release))
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(lease.iter_range(), media_type=info["mime"], headers=headers,
+                             background=BackgroundTask(lease.release))
+
+@app.get("/api/stats/images")
+async def image_stats_endpoint():
+    """
+    画像処理のワーカーの待機中の処理数と、処理の種類ごとの待ち時間・実行時間の統計を返すエンドポイント。
+    """
+    if image_pipeline is None:
+        return JSONResponse({"error": "Image pipeline not configured"}, status_code=404)
+    return JSONResponse(image_pipeline.get_stats())
+
+@app.get("/api/stats/connections")
+async def connection_stats_endpoint():
+    """
+    接続ごとの送信キューの状況と、破棄したメッセージ数・切断したクライアント数を返すエンドポイント。
+    """
+    return JSONResponse(manager.get_stats())
 
 # /publicフォルダをルートパス(/)にホスト
 app.mount("/", StaticFiles(directory="public", html=True), name="public")
 
 #######################################################################################
 # 関数
-def process_message(message: str) -> str:
+def process_message(message):
     """
     クライアントから受信したメッセージを処理します。
     必要に応じて、ここでメッセージの処理ロジックを実装します。
 
     Args:
-        message (str): 受信したメッセージ。
+        message (str or dict): 受信したメッセージ（JSON文字列またはパース済みの辞書）。
 
     Returns:
-        str: 処理された結果を返します（ここではエコーバック）。
+        str, dict or BinaryFrame: 処理された結果を返します。
     """
     # メッセージをJSON形式にパース（必要に応じて）
-    try:
-        message_data = json.loads(message)
-    except json.JSONDecodeError:
-        return json.dumps({"error": "Invalid JSON format"})
+    if type(message) == dict:
+        message_data = message
+    else:
+        try:
+            message_data = json.loads(message)
+        except json.JSONDecodeError:
+            return json.dumps({"error": "Invalid JSON format"})
 
     try:
         global callback
         if callback:
-            callback_response_data = callback(message_data, manager)
-            return json.dumps(callback_response_data)
+            return callback(message_data, manager)
         else:
             return json.dumps({"error": "No callback function set"})
     except Exception as e:
@@ -201,32 +798,75 @@ def process_message(message: str) -> str:
         return json.dumps({"error": f"Error in callback: {e}"})
 
 
-async def start_async_server(callback_func = None, periodic_task_func = None):
+async def start_async_server(callback_func = None, periodic_task_func = None, blob_store_instance = None,
+                             event_bus_instance = None, topic_builders = None, extra_blob_store_instances = None,
+                             max_upload_size = None, image_pipeline_instance = None, upload_func = None):
     """
     Uvicornを使用してFastAPIアプリケーションを非同期で開始するメソッド。
     """
-    config = uvicorn.Config(app, host="0.0.0.0", port=8000, log_level="info", ws_max_size=104857600)
+    config = uvicorn.Config(app, host="0.0.0.0", port=8000, log_level="info", ws_max_size=WS_MAX_SIZE)
     server = uvicorn.Server(config)
     global callback
     callback = callback_func
     global periodic_task
     periodic_task = periodic_task_func
+    global blob_store
+    blob_store = blob_store_instance
+    global extra_blob_stores
+    extra_blob_stores = list(extra_blob_store_instances or [])
+    global image_pipeline
+    image_pipeline = image_pipeline_instance
+    global upload_callback
+    upload_callback = upload_func
+    if max_upload_size is not None:
+        upload_manager.max_size = max_upload_size
+    if event_bus_instance is not None and topic_builders:
+        manager.register_topics(event_bus_instance, topic_builders)
     await asyncio.create_task(server.serve())
 
-def start_server(callback_func=None, periodic_task_func=None, blocking=False):
+def start_server(callback_func=None, periodic_task_func=None, blocking=False, blob_store_instance=None,
+                 event_bus_instance=None, topic_builders=None, extra_blob_store_instances=None, max_upload_size=None,
+                 image_pipeline_instance=None, upload_func=None):
     """
     Uvicornを使用してFastAPIアプリケーションをスレッドで開始するメソッド。
+
+    Args:
+        callback_func (Callable): クライアントから受信したメッセージを処理する関数。
+        periodic_task_func (Callable): 共有サンプラーから定期的に呼び出される非同期関数。
+            購読者が居るトピックと最小送信間隔の辞書を引数に取ります。
+        blocking (bool): サーバーのスレッドが終了するまで待機するかどうか。
+        blob_store_instance (BlobStore or None): /blob で配信するBlobStore。
+        event_bus_instance (EventBus or None): トピックのイベントを受け取るEventBus。
+        topic_builders (dict or None): トピック名をキーとし、メッセージを作成する関数を値とする辞書。
+        extra_blob_store_instances (list or None): blob_store_instanceに無いデータを探す、追加のBlobStoreのリスト。
+        max_upload_size (int or None): 分割アップロードで受け付ける最大サイズ（バイト）。Noneの場合はMAX_UPLOAD_SIZE。
+        image_pipeline_instance (ImagePipeline or None): /api/stats/images で統計を返すImagePipeline。
+        upload_func (Callable or None): 確定したアップロードを処理する関数。
+            upload_func(一時ファイルのパス, MIMEタイプ, upload_initのtarget) の形で呼び出され、応答を返します。
+            Noneの場合は分割アップロードを受け付けません。
     """
     # Freeze環境下での特殊処理
     if getattr(sys, 'frozen', False):
         sys.stdout = open(os.devnull, 'w')
-    config = uvicorn.Config(app, host="0.0.0.0", port=22282, log_level="info", ws_max_size=104857600)
+    config = uvicorn.Config(app, host="0.0.0.0", port=22282, log_level="info", ws_max_size=WS_MAX_SIZE)
     server = uvicorn.Server(config)
     
     global callback
     callback = callback_func
     global periodic_task
     periodic_task = periodic_task_func
+    global blob_store
+    blob_store = blob_store_instance
+    global extra_blob_stores
+    extra_blob_stores = list(extra_blob_store_instances or [])
+    global image_pipeline
+    image_pipeline = image_pipeline_instance
+    global upload_callback
+    upload_callback = upload_func
+    if max_upload_size is not None:
+        upload_manager.max_size = max_upload_size
+    if event_bus_instance is not None and topic_builders:
+        manager.register_topics(event_bus_instance, topic_builders)
     
     # サーバーを別スレッドで開始
     server_thread = threading.Thread(target=server.run, daemon=True)
@@ -245,4 +885,24 @@ def start_server(callback_func=None, periodic_task_func=None, blocking=False):
 #######################################################################################
 # モジュールテスト用処理
 if __name__ == '__main__':
-    pass
+    from fastapi.testclient import TestClient
+    from PIL import Image
+
+    def open_upload(path, mime, target):
+        # 画像でないファイルでは、PILがUnidentifiedImageError（OSError）を送出する
+        with Image.open(path) as image:
+            return {"type": "upload_done", "format": image.format}
+
+    upload_callback = open_upload
+    payload = b"this is not an image"
+    with TestClient(app) as client, client.websocket_connect("/ws") as websocket:
+        websocket.send_text(json.dumps({"type": "upload_init", "size": len(payload), "mime": "image/png", "target": {"id": 0}}))
+        upload_id = websocket.receive_json()["upload_id"]
+        websocket.send_text(json.dumps({"type": "upload_chunk", "upload_id": upload_id, "offset": 0,
+                                        "data": base64.b64encode(payload).decode()}))
+        websocket.send_text(json.dumps({"type": "upload_commit", "upload_id": upload_id}))
+        for _ in range(3):
+            print(websocket.receive_json())
+        # 失敗したアップロードの後も同じ接続でメッセージをやり取りできる
+        websocket.send_text(json.dumps({"type": "negotiate", "binary_frames": True}))
+        print(websocket.receive_json())